@@ -0,0 +1,141 @@
+"""
+Reading a big output (an LDIF dump of every user) over SSH with and without compression, at a few link speeds.
+Also compress='auto', which starts without and turns compression on once it sees big outputs coming in slowly.
+
+Everything runs in this process: a Paramiko SSH server sends the dump, and the client (SshTransport) talks to it
+through a relay that only lets the bytes through as fast as the link speed being tried. So the CPU cost of
+compressing and decompressing is all on this machine, as it would be shared between the DC and the client for real.
+(Paramiko compresses at zlib level 9, where OpenSSH on the DC uses 6, so this is a bit hard on compression.
+On the other hand the made-up dump repeats itself more than a real one, with its GUIDs, SIDs and timestamps,
+so it compresses better: expect the gap to be smaller for real.)
+
+Run from the repo folder:
+    python benchmarks/bench_compression.py [number of users] [link speeds in Mbit/s, comma separated]
+"""
+
+import os
+import socket
+import sys
+import threading
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import paramiko  # noqa: E402
+
+from bench_parse import make_dump  # noqa: E402
+from samba_transport import SshTransport  # noqa: E402
+
+RUNS = 3  # Commands per connection, so 'auto' has something to learn from
+
+
+class DumpServer(paramiko.ServerInterface):
+    """Lets anyone in, and answers any command with the dump"""
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OR_UNKNOWN_CHANNEL_TYPE
+
+    def check_channel_exec_request(self, channel, command):
+        def send():
+            channel.sendall(self.payload)
+            channel.send_exit_status(0)
+            channel.close()
+        # After a moment, so Paramiko has said yes to the command before the output (and the end of it) goes.
+        # The same 10 ms in every time below.
+        timer = threading.Timer(0.01, send)
+        timer.daemon = True
+        timer.start()
+        return True
+
+
+def relay(fpFrom: socket.socket, fpTo: socket.socket, bytes_per_second: float):
+    """Copy from one socket to the other, no faster than bytes_per_second"""
+    start = perf_counter()
+    sent = 0
+    try:
+        while True:
+            data = fpFrom.recv(16384)
+            if not data:
+                break
+            sent += len(data)
+            wait = start + sent / bytes_per_second - perf_counter()
+            if wait > 0:
+                sleep(wait)
+            else:
+                # Idle links don't save up bandwidth for later
+                start, sent = perf_counter(), 0
+            fpTo.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            fpTo.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def slow_link(mbit: float) -> tuple:
+    """
+    :return: (client end, server end) of a connection that goes at mbit Mbit/s each way
+    """
+    client, client_relay = socket.socketpair()
+    server_relay, server = socket.socketpair()
+    for fpFrom, fpTo in ((client_relay, server_relay), (server_relay, client_relay)):
+        threading.Thread(target=relay, args=(fpFrom, fpTo, mbit * 1000000 / 8), daemon=True).start()
+    return client, server
+
+
+def time_reads(payload: bytes, host_key, mbit: float, compress) -> tuple:
+    """
+    Connect with compress, and read the payload RUNS times.
+    :return: (list of seconds for each read, whether compression was on by the end)
+    """
+    client_sock, server_sock = slow_link(mbit)
+    server = paramiko.Transport(server_sock)
+    server.add_server_key(host_key)
+    server.use_compression(True)  # Willing, if the client asks for it
+    server.start_server(event=threading.Event(), server=DumpServer(payload))  # Without waiting for the client
+
+    transport = SshTransport('bench', 'root', 'password', compress=compress, sock=client_sock)
+    transport.connect()
+    lstTimes = []
+    try:
+        for _ in range(RUNS):
+            start = perf_counter()
+            out, err = transport.run('ldbsearch -H /var/lib/samba/private/sam.ldb "(objectClass=user)"')
+            lstTimes.append(perf_counter() - start)
+            assert out == payload
+        return lstTimes, transport.compressed
+    finally:
+        transport.close()
+        server.close()
+
+
+def main():
+    no_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lstSpeeds = [float(mbit) for mbit in sys.argv[2].split(',')] if len(sys.argv) > 2 else [4, 16, 100]
+    payload = ('\n'.join(make_dump(no_of_users)) + '\n').encode()
+    host_key = paramiko.RSAKey.generate(2048)
+
+    print(f"Reading {no_of_users} users ({len(payload) / 1000000:.1f} MB of LDIF) over SSH, "
+          f"{RUNS} times per connection:")
+    for mbit in lstSpeeds:
+        print(f"  {mbit:g} Mbit/s (uncompressed, that's {len(payload) * 8 / mbit / 1000000:.1f} s of bytes):")
+        for label, compress in (('off', False), ('on', True), ('auto', 'auto')):
+            lstTimes, compressed = time_reads(payload, host_key, mbit, compress)
+            times = '  '.join(f'{seconds * 1000:8.1f} ms' for seconds in lstTimes)
+            print(f"    compression {label:4}  {times}   (compressed by the end: {'yes' if compressed else 'no'})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Decoding userAccountControl and the AD timestamps of a whole domain:
+one Python loop per user (the way User does it) versus samba_directory.decode_user_columns.
+
+Run from the repo folder:
+    python benchmarks/bench_decode.py [number of users]
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ssh_samba import User  # noqa: E402
+from samba_directory import decode_user_columns, FILETIME_NEVER  # noqa: E402
+
+
+def make_columns(no_of_users: int) -> dict:
+    random.seed(0)
+    recent = 133400000000000000
+    return {
+        'userAccountControl': [str(random.choice((0x200, 0x202, 0x10200, 0x10202, 0x210))) for _ in range(no_of_users)],
+        'pwdLastSet': [str(recent + random.randrange(10 ** 14)) for _ in range(no_of_users)],
+        'lastLogonTimestamp': [str(recent + random.randrange(10 ** 14)) if random.random() < 0.9 else None
+                               for _ in range(no_of_users)],
+        'accountExpires': [str(random.choice((0, FILETIME_NEVER, recent))) for _ in range(no_of_users)],
+        'lockoutTime': [str(random.choice((0, 0, 0, recent))) for _ in range(no_of_users)],
+    }
+
+
+def decode_one_at_a_time(dicColumns: dict) -> list:
+    def filetime(value):
+        value = int(value) if value else 0
+        if value <= 0 or value >= FILETIME_NEVER:
+            return None
+        return datetime(1601, 1, 1) + timedelta(microseconds=value // 10)
+
+    lstDecoded = []
+    for i in range(len(dicColumns['userAccountControl'])):
+        flags = User.parse_user_flags(dicColumns['userAccountControl'][i])
+        lstDecoded.append({
+            'flags': flags,
+            'disabled': 'ACCOUNTDISABLE' in flags,
+            'locked': 'LOCKOUT' in flags or bool(filetime(dicColumns['lockoutTime'][i])),
+            'pwdLastSet': filetime(dicColumns['pwdLastSet'][i]),
+            'lastLogonTimestamp': filetime(dicColumns['lastLogonTimestamp'][i]),
+            'accountExpires': filetime(dicColumns['accountExpires'][i]),
+        })
+    return lstDecoded
+
+
+def main():
+    no_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dicColumns = make_columns(no_of_users)
+
+    start = perf_counter()
+    decode_one_at_a_time(dicColumns)
+    loop_time = perf_counter() - start
+
+    start = perf_counter()
+    dicDecoded = decode_user_columns(dicColumns)
+    batch_time = perf_counter() - start
+
+    print(f"Decoding {no_of_users} users:")
+    print(f"  one user at a time:   {loop_time * 1000:8.1f} ms")
+    print(f"  decode_user_columns:  {batch_time * 1000:8.1f} ms")
+    print(f"  ({dicDecoded['disabled'].sum()} disabled, {dicDecoded['locked'].sum()} locked)")
+
+
+if __name__ == '__main__':
+    main()
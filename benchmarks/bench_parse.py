@@ -0,0 +1,91 @@
+"""
+Parsing a full LDIF dump of every user: parse_ldif in this process versus
+parse_ldif_in_processes, which splits the dump at record boundaries and parses the pieces in worker processes.
+
+Run from the repo folder:
+    python benchmarks/bench_parse.py [number of users] [processes]
+"""
+
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ssh_samba import parse_ldif, parse_ldif_in_processes  # noqa: E402
+
+
+def make_dump(no_of_users: int) -> list:
+    """About 40 lines per user, like 'ldbsearch' of every attribute of a user"""
+    random.seed(0)
+    lstLines = []
+    for i in range(no_of_users):
+        lstLines += [
+            f'# record {i + 1}',
+            f'dn: CN=User {i},OU=Students,DC=school,DC=net',
+            'objectClass: top',
+            'objectClass: person',
+            'objectClass: organizationalPerson',
+            'objectClass: user',
+            f'cn: User {i}',
+            'sn: Smith',
+            'givenName: John',
+            'instanceType: 4',
+            'whenCreated: 20230101120000.0Z',
+            'whenChanged: 20230101120000.0Z',
+            f'displayName: John Smith {i}',
+            'uSNCreated: 4000',
+            'name: John Smith',
+            'objectGUID: 5f8a9a2c-1b2c-4d5e-8f90-0a1b2c3d4e5f',
+            'badPwdCount: 0',
+            'codePage: 0',
+            'countryCode: 0',
+            'badPasswordTime: 0',
+            'lastLogoff: 0',
+            'lastLogon: 0',
+            f'pwdLastSet: {133400000000000000 + random.randrange(10 ** 14)}',
+            'primaryGroupID: 513',
+            f'objectSid: S-1-5-21-1-2-3-{1000 + i}',
+            'accountExpires: 9223372036854775807',
+            'logonCount: 0',
+            f'sAMAccountName: user{i}',
+            'sAMAccountType: 805306368',
+            f'userPrincipalName: user{i}@school.net',
+            'objectCategory: CN=Person,CN=Schema,CN=Configuration,DC=school,DC=net',
+            'memberOf: CN=Students,OU=Groups,DC=school,DC=net',
+            'memberOf: CN=Year 7,OU=Groups,DC=school,DC=net',
+            f'userAccountControl: {random.choice((512, 514, 66048))}',
+            'lastLogonTimestamp: 133400000000000000',
+            f'description: A fairly long description of user {i} which gets folded onto',
+            '  the next line because LDIF lines are kept short',
+            'uSNChanged: 4010',
+            'distinguishedName: CN=User,OU=Students,DC=school,DC=net',
+            '',
+        ]
+    return lstLines
+
+
+def main():
+    no_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    lstLines = make_dump(no_of_users)
+
+    start = perf_counter()
+    lstSerial = list(parse_ldif(lstLines))
+    serial_time = perf_counter() - start
+
+    # The first call starts the worker processes, which the app only pays for once
+    parse_ldif_in_processes(lstLines[:100000], processes=processes, min_lines=0)
+    start = perf_counter()
+    lstParallel = parse_ldif_in_processes(lstLines, processes=processes, min_lines=0)
+    parallel_time = perf_counter() - start
+    assert lstParallel == lstSerial
+
+    print(f"Parsing {no_of_users} users ({len(lstLines)} lines of LDIF):")
+    print(f"  parse_ldif:                          {serial_time * 1000:8.1f} ms")
+    print(f"  parse_ldif_in_processes ({processes} procs): {parallel_time * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
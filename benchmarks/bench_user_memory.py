@@ -0,0 +1,107 @@
+"""
+How much memory does a User take?
+Builds lots of users from made-up samba-tool dictionaries and measures what they keep hold of with tracemalloc.
+Compares the current User with a copy of the old plain one (per-instance __dict__, a list of flag strings
+per user and the raw dictionary kept forever).
+
+Run from the repo folder:
+    python benchmarks/bench_user_memory.py [number of users]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ssh_samba import User  # noqa: E402
+
+
+class LegacyUser:
+    """The User class as it was before __slots__, cut down to what affects memory"""
+    def __init__(self, dic_user):
+        self.username = dic_user['sAMAccountName']
+        self.password = ''
+        self.given_name = dic_user['givenName']
+        self.surname = dic_user['sn']
+        self.flags = User.parse_user_flags(dic_user['userAccountControl'])
+        self.ou = ''
+        self.must_change_at_next_login = False
+        self.dic_full_info = dic_user
+
+
+def summary_dict(i: int) -> dict:
+    """What get_users(full=False) gets for a user"""
+    return {
+        'sAMAccountName': f'user{i:06d}',
+        'givenName': f'Given{i % 500}',
+        'sn': f'Surname{i % 2000}',
+        'userAccountControl': str(0x200 | (0x2 if i % 10 == 0 else 0)),
+    }
+
+
+def full_dict(i: int) -> dict:
+    """Roughly what 'user show' gets for a user"""
+    dic_user = summary_dict(i)
+    dic_user.update({
+        'dn': f'CN=Given{i % 500} Surname{i % 2000},OU=Students,DC=school,DC=example,DC=net',
+        'objectClass': ['top', 'person', 'organizationalPerson', 'user'],
+        'cn': f'Given{i % 500} Surname{i % 2000}',
+        'instanceType': '4',
+        'whenCreated': '20230901083000.0Z',
+        'whenChanged': '20240115101500.0Z',
+        'displayName': f'Given{i % 500} Surname{i % 2000}',
+        'uSNCreated': str(4000 + i),
+        'name': f'Given{i % 500} Surname{i % 2000}',
+        'objectGUID': f'{i:08x}-1234-5678-9abc-def012345678',
+        'badPwdCount': '0',
+        'codePage': '0',
+        'countryCode': '0',
+        'badPasswordTime': '0',
+        'lastLogoff': '0',
+        'lastLogon': '133500000000000000',
+        'primaryGroupID': '513',
+        'objectSid': f'S-1-5-21-1111111111-2222222222-3333333333-{1100 + i}',
+        'accountExpires': '9223372036854775807',
+        'logonCount': '12',
+        'sAMAccountType': '805306368',
+        'userPrincipalName': f'user{i:06d}@school.example.net',
+        'objectCategory': 'CN=Person,CN=Schema,CN=Configuration,DC=school,DC=example,DC=net',
+        'pwdLastSet': '133400000000000000',
+        'uSNChanged': str(9000 + i),
+        'distinguishedName': f'CN=Given{i % 500} Surname{i % 2000},OU=Students,DC=school,DC=example,DC=net',
+    })
+    return dic_user
+
+
+def measure(make_user, make_dict, no_of_users: int) -> float:
+    """
+    :return: bytes held per user, once the users are built and everything else has gone
+    """
+    gc.collect()
+    tracemalloc.start()
+    lstUsers = [make_user(make_dict(i)) for i in range(no_of_users)]
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del lstUsers
+    return held / no_of_users
+
+
+def main():
+    no_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lstCases = [
+        ('old User, full record kept', LegacyUser, full_dict),
+        ('User, full record kept', User, full_dict),
+        ('old User, list columns only', LegacyUser, summary_dict),
+        ('User, list columns only (keep_raw=False)', lambda dic_user: User(dic_user, keep_raw=False), summary_dict),
+    ]
+    print(f"Memory held per user, {no_of_users} users:")
+    for name, make_user, make_dict in lstCases:
+        per_user = measure(make_user, make_dict, no_of_users)
+        print(f"  {name:45} {per_user:8.0f} bytes  ({per_user * no_of_users / 2 ** 20:7.1f} MB in total)")
+
+
+if __name__ == '__main__':
+    main()
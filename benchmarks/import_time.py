@@ -0,0 +1,83 @@
+"""
+Import-time budget: how long each module takes to import in a fresh interpreter, and which heavy modules it drags in.
+Fails (exit status 1) if a module goes over its budget or imports something it shouldn't at load time,
+eg. ssh_samba importing Paramiko before anyone connects.
+
+Each module is imported in a new python process with -X importtime, a few times, and the fastest run is kept,
+so a busy machine doesn't fail the check. The modules are byte-compiled first, so it's importing that is timed,
+not compiling. Modules whose dependencies aren't installed (eg. wx) are skipped.
+
+Run from the repo folder:
+    python benchmarks/import_time.py [runs]
+"""
+
+import compileall
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# module: (budget in ms, modules it mustn't import when it is loaded)
+BUDGETS = {
+    'ssh_samba': (40, ('paramiko', 'multiprocessing', 'numpy', 'wx', 'yaml')),
+    'samba_cli': (25, ('ssh_samba', 'paramiko', 'numpy', 'wx', 'yaml')),
+    'samba_directory': (250, ('paramiko', 'multiprocessing', 'wx', 'yaml')),  # numpy is most of it
+    'samba_gui': (800, ('paramiko', 'multiprocessing', 'numpy', 'yaml')),  # wx is most of it
+}
+
+
+def measure(module: str) -> tuple:
+    """
+    Import module in a fresh interpreter.
+    :return: (import time in ms, set of every module loaded), or None if it can't be imported here
+    """
+    code = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    # -X importtime lines look like 'import time:  self [us] | cumulative | imported package'
+    # and the module itself is the one that isn't indented.
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        if name.rstrip() == f' {module}':
+            cumulative = int(total)
+    return cumulative / 1000, set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    lstFailures = []
+    compileall.compile_dir(REPO, maxlevels=0, quiet=1)
+
+    print(f"Import time (fastest of {runs}):")
+    for module, (budget, forbidden) in BUDGETS.items():
+        lstResults = [measure(module) for _ in range(runs)]
+        if None in lstResults:
+            print(f"  {module:16} skipped: can't be imported here")
+            continue
+        ms = min(result[0] for result in lstResults)
+        setLoaded = lstResults[0][1]
+        setBad = {name for name in forbidden if name in setLoaded}
+
+        status = 'ok'
+        if ms > budget:
+            status = 'OVER BUDGET'
+            lstFailures.append(f"{module} took {ms:.1f} ms to import (budget {budget} ms)")
+        if setBad:
+            status = 'IMPORTS ' + ', '.join(sorted(setBad))
+            lstFailures.append(f"{module} imports {', '.join(sorted(setBad))} at load time")
+        print(f"  {module:16} {ms:8.1f} ms  (budget {budget:4} ms)  {status}")
+
+    if lstFailures:
+        print('\n'.join(['', 'FAILED:'] + lstFailures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+What the domain controller's Samba can do, so SshSamba can use the quickest way it has of getting something,
+and fall back to reading samba-tool's text on older DCs.
+
+Found out with one command on the DC (see probe_command), once per connection:
+    - samba-tool's version
+    - which samba-tool commands can write JSON (--json, Samba 4.20 or so onwards, a few commands at a time)
+    - whether ldbsearch is there, for reading the whole directory in one go
+    - where Samba keeps its database (PRIVATE_DIR), which isn't /var/lib/samba/private if Samba was built from source
+
+samba-tool's JSON doesn't use the same names as its text, and has changed between versions, so from_json matches
+the JSON up with the names in the text (which the rest of SshSamba already uses) and gives up if it can't,
+so that the text is read instead.
+"""
+
+import re
+import shlex
+
+# The samba-tool commands SshSamba reads JSON from, if they write it
+JSON_COMMANDS = ('domain info', 'domain passwordsettings show')
+
+
+def probe_command(lstCommands=JSON_COMMANDS) -> str:
+    """
+    The shell command that finds everything out. samba-tool takes a while to start, so the --help's (to see if
+    --json is there) are run at the same time. Every line it writes is 'what: answer'.
+    It looks for the programs on the same PATH the commands SshSamba sends are run with, so that what it finds is
+    what they will find.
+    :param lstCommands: the samba-tool commands to check for --json
+    """
+    lstLines = [
+        'samba-tool --version 2>/dev/null | sed -n "1s/^/version: /p"',
+        'command -v ldbsearch >/dev/null 2>&1 && echo "ldbsearch: yes"',
+        'samba -b 2>/dev/null | sed -n "s/^ *PRIVATE_DIR: */private_dir: /p"',
+    ]
+    for cmd in lstCommands:
+        lstLines.append(f'(samba-tool {cmd} --help 2>/dev/null | grep -q -e --json && echo {shlex.quote("json: " + cmd)}) &')
+    lstLines.append('wait')
+    return '\n'.join(lstLines)
+
+
+class SambaCapabilities:
+    def __init__(self, lstLines=None):
+        """
+        :param lstLines: what probe_command wrote. None if it couldn't be run, in which case nothing is known,
+                         and the old ways are tried as before.
+        """
+        self.probed = lstLines is not None
+        self.version_string = None  # eg. '4.19.5-Debian'
+        self.version = None  # eg. (4, 19, 5)
+        self.json_commands = set()
+        self.ldbsearch = None  # True/False, or None if not known
+        self.private_dir = None
+        if lstLines is None:
+            return
+
+        self.ldbsearch = False
+        for line in lstLines:
+            what, _, answer = line.partition(':')
+            answer = answer.strip()
+            if what == 'version':
+                self.version_string = answer
+                match = re.match(r'(\d+)\.(\d+)\.(\d+)', answer)
+                if match:
+                    self.version = tuple(int(number) for number in match.groups())
+            elif what == 'ldbsearch':
+                self.ldbsearch = True
+            elif what == 'private_dir':
+                self.private_dir = answer
+            elif what == 'json':
+                self.json_commands.add(answer)
+
+    def supports_json(self, cmd: str) -> bool:
+        """
+        :param cmd: a samba-tool command, eg. 'domain info'
+        """
+        return cmd in self.json_commands
+
+    def no_json(self, cmd: str):
+        """samba-tool said it could write JSON for cmd, but what it wrote couldn't be used. Stop asking."""
+        self.json_commands.discard(cmd)
+
+    def __repr__(self):
+        return (f"SambaCapabilities(version={self.version_string!r}, json={sorted(self.json_commands)}, "
+                f"ldbsearch={self.ldbsearch}, private_dir={self.private_dir!r})")
+
+
+def _squash(name: str) -> str:
+    """'Minimum password age (days)', 'minimum_password_age' and 'minimumPasswordAge' all match"""
+    return re.sub('[^a-z0-9]', '', name.lower())
+
+
+def from_json(dicJson: dict, lstLabels, dicOptions: dict = None, required=None) -> dict:
+    """
+    Match samba-tool's JSON up with the names from its text.
+    A JSON name matches a label if it is the label, the label without its units in brackets,
+    or the label's --option for setting it (from dicOptions), ignoring case, spaces and punctuation.
+    Values are turned into what the text would have said: True/False into on/off, and numbers into strings.
+    :param dicJson: what samba-tool wrote
+    :param lstLabels: the names the text uses, eg. 'Minimum password age (days)'
+    :param dicOptions: label: option, eg. 'Minimum password age (days)': 'min-pwd-age'
+    :param required: the labels that have to be found. Defaults to all of them.
+    :return: dictionary of label: value, or None if the JSON isn't something that can be matched up
+    """
+    if not isinstance(dicJson, dict):
+        return None
+    dicOptions = dicOptions or {}
+    dicNames = {}
+    for label in lstLabels:
+        for name in (label, label.split(' (')[0], dicOptions.get(label, '')):
+            if name:
+                dicNames[_squash(name)] = label
+
+    dicLabelled = {}
+    for name, value in dicJson.items():
+        label = dicNames.get(_squash(name))
+        if label is None or isinstance(value, (dict, list)):
+            continue
+        if isinstance(value, bool):
+            value = 'on' if value else 'off'
+        dicLabelled[label] = '' if value is None else str(value)
+
+    if any(label not in dicLabelled for label in (lstLabels if required is None else required)):
+        return None
+    return dicLabelled
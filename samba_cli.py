@@ -0,0 +1,380 @@
+"""
+Command line interface to SshSamba, for cron jobs and scripts.
+Never imports wx or yaml, and only imports ssh_samba (and so Paramiko) once the arguments are known to be good,
+so --help and typos come back straight away.
+
+Connecting:
+    The DC comes from --host or $SAMBA_HOST, the administrating user from --user or $SAMBA_USER (default root),
+    and the password from $SAMBA_PASSWORD, or it is asked for.
+    On the DC itself, --local runs samba-tool directly instead of over SSH (no host or password needed).
+    --worker runs all the samba-tool commands in one process on the DC (see samba_dispatcher), which is much
+    quicker for batches of more than a few names.
+    Otherwise batches run several commands at once, as many as the DC copes with (see samba_concurrency),
+    up to --max-parallel. --max-parallel 1 is the gentlest on the DC.
+    --compression on compresses everything over SSH, which helps over a slow link. The default (auto) turns it on
+    once big outputs are seen to come in slowly.
+
+Output:
+    Plain text by default. With --json, lists come out as JSON Lines (one object per line, written as they arrive)
+    and single things as one JSON object.
+
+Batch input:
+    Where a command takes names, '-' (or no names at all) reads them from stdin, one per line.
+    'users add --csv -' reads users from a CSV/TSV file on stdin (see ssh_samba.read_user_csv),
+    and 'policy set -' reads a JSON object like the one 'policy show --json' writes.
+
+Examples:
+    samba_cli.py --host 10.0.0.2 users list --json > users.jsonl
+    samba_cli.py users show jbloggs
+    cut -f1 leavers.tsv | samba_cli.py users disable -
+    samba_cli.py users add --csv - < new_students.csv
+    samba_cli.py members add Staff jbloggs asmith
+    samba_cli.py policy set "Minimum password length=10"
+
+Exit status: 0 = success, 1 = something went wrong (details on stderr), 2 = bad arguments.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from getpass import getpass
+
+
+# =========================================================================
+# =========================     Output     ================================
+# =========================================================================
+def user_to_dict(usr, full: bool = False) -> dict:
+    """
+    :param usr: user object
+    :param full: include everything samba-tool had to say about the user, if it was kept
+    :return: dictionary that json.dumps can write
+    """
+    dicUsr = {'username': usr.username,
+              'given_name': usr.given_name,
+              'surname': usr.surname,
+              'flags': usr.flags,
+              }
+    if full and usr.dic_full_info:
+        dicUsr['attributes'] = usr.dic_full_info
+    return dicUsr
+
+
+def write_json(obj):
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + '\n')
+
+
+def read_names(names: list) -> list:
+    """
+    The names given on the command line, or from stdin (one per line) if there were none or just '-'.
+    """
+    if not names or names == ['-']:
+        names = [line.strip() for line in sys.stdin]
+    return [name for name in names if name]
+
+
+# =========================================================================
+# =========================     Commands     ==============================
+# =========================================================================
+def users_list(ad, args):
+    for usr in ad.iter_users():
+        if args.json:
+            write_json(user_to_dict(usr))
+        else:
+            print('\t'.join((usr.username, usr.given_name, usr.surname, ','.join(usr.flags))))
+
+
+def users_show(ad, args):
+    usr = ad.get_user(args.username, use_cache=False)
+    if not usr.username:
+        raise LookupError(f"No such user: {args.username}")
+    if args.json:
+        write_json(user_to_dict(usr, full=True))
+    else:
+        for attribute, value in usr.dic_full_info.items():
+            for item in value if isinstance(value, list) else [value]:
+                print(f"{attribute}: {item}")
+
+
+def users_add(ad, args):
+    from ssh_samba import User, read_user_csv
+
+    if args.csv:
+        # read_user_csv looks at the start of the file to work out the delimiter, so stdin has to be read first
+        fp = io.StringIO(sys.stdin.read(), newline='') if args.csv == '-' else args.csv
+        lstUsers = []
+        lstErrors = []
+        for lstChunk, lstChunk_errors in read_user_csv(fp):
+            lstUsers.extend(lstChunk)
+            lstErrors.extend(lstChunk_errors)
+        if lstErrors:
+            # Nothing is added unless the whole file is good, as in the Add users window
+            raise ValueError('\n'.join(f"line {line_no}: {message}" for line_no, message in lstErrors))
+    else:
+        if not (args.username and args.given_name):
+            raise ValueError("Give a username and --given-name, or --csv")
+        usr = User()
+        usr.set_username(args.username)
+        usr.set_given_name(args.given_name)
+        if args.surname:
+            usr.set_surname(args.surname)
+        usr.set_password(os.environ.get('SAMBA_NEW_PASSWORD') or getpass(f"New password for {args.username}: "))
+        usr.set_must_change_at_next_login(args.must_change)
+        lstUsers = [usr]
+
+    ad.add_users(lstUsers)
+    report(args, 'added', [usr.username for usr in lstUsers])
+
+
+def users_delete(ad, args):
+    names = read_names(args.names)
+    ad.delete_users(names)
+    report(args, 'deleted', names)
+
+
+def users_enable(ad, args):
+    names = read_names(args.names)
+    ad.enable_users(names)
+    report(args, 'enabled', names)
+
+
+def users_disable(ad, args):
+    names = read_names(args.names)
+    ad.disable_users(names)
+    report(args, 'disabled', names)
+
+
+def groups_list(ad, args):
+    if args.members:
+        for grp, lstMembers in ad.iter_groups():
+            if args.json:
+                write_json({'group': grp, 'members': lstMembers})
+            else:
+                print('\t'.join([grp] + lstMembers))
+        return
+
+    lstGroups = [grp for grp in ad.samba_command('group list') if grp != '' and grp not in ad.built_in_groups]
+    for grp in lstGroups:
+        if args.json:
+            write_json({'group': grp})
+        else:
+            print(grp)
+
+
+def groups_add(ad, args):
+    names = read_names(args.names)
+    run_each(ad.add_group, names, 'adding groups')
+    report(args, 'added', names)
+
+
+def groups_delete(ad, args):
+    names = read_names(args.names)
+    run_each(ad.delete_group, names, 'deleting groups')
+    report(args, 'deleted', names)
+
+
+def members_list(ad, args):
+    for lstPage in ad.iter_group_members(args.group):
+        for member in lstPage:
+            if args.json:
+                write_json({'group': args.group, 'member': member})
+            else:
+                print(member)
+
+
+def members_add(ad, args):
+    names = read_names(args.names)
+    ad.add_members_to_group(args.group, names)
+    report(args, f'added to {args.group}', names)
+
+
+def members_remove(ad, args):
+    names = read_names(args.names)
+    ad.delete_members_from_group(args.group, names)
+    report(args, f'removed from {args.group}', names)
+
+
+def policy_show(ad, args):
+    dicPolicy = ad.get_password_policy()
+    if args.json:
+        write_json(dicPolicy)
+    else:
+        for key, value in dicPolicy.items():
+            print(f"{key}: {value}")
+
+
+def policy_set(ad, args):
+    if not args.settings or args.settings == ['-']:
+        dicPolicy = json.load(sys.stdin)
+        if not isinstance(dicPolicy, dict):
+            raise ValueError("Expected a JSON object of policy settings on stdin")
+    else:
+        dicPolicy = {}
+        for setting in args.settings:
+            key, sep, value = setting.partition('=')
+            if not sep:
+                raise ValueError(f"Expected 'setting=value', got: {setting}")
+            dicPolicy[key.strip()] = value.strip()
+    ad.set_password_policy(dicPolicy)
+    report(args, 'set', list(dicPolicy))
+
+
+def run_each(func, names: list, doing: str):
+    """
+    Call func for each name, carrying on past failures, and raise them all together at the end
+    (the same as the bulk SshSamba methods).
+    """
+    from ssh_samba import SambaException
+
+    lstErrors = []
+    for name in names:
+        try:
+            func(name)
+        except Exception as e:
+            lstErrors.append(f"{name}: {e.args[0] if e.args else repr(e)}")
+    if lstErrors:
+        errors = '\n'.join(lstErrors)
+        raise SambaException(f"Errors when {doing}: {errors}")
+
+
+def report(args, done: str, names: list):
+    """Say what a command changed: on stdout with --json, otherwise on stderr unless --quiet"""
+    if args.json:
+        write_json({'result': done, 'names': names})
+    elif not args.quiet:
+        print(f"{len(names)} {done}", file=sys.stderr)
+        if args.concurrency is not None and args.concurrency.completed > 1:
+            dicStats = args.concurrency.stats()
+            print(f"({dicStats['completed']} commands, ended up running {dicStats['limit']} at once, "
+                  f"{dicStats['latency'] * 1000:.0f} ms each on average)", file=sys.stderr)
+
+
+# =========================================================================
+# =========================     Arguments     =============================
+# =========================================================================
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Manage a Samba Active Directory Domain Controller over SSH.",
+                                     epilog="The password is taken from $SAMBA_PASSWORD, or asked for.")
+    parser.add_argument('--host', default=os.environ.get('SAMBA_HOST'),
+                        help="IP address of the domain controller (default $SAMBA_HOST)")
+    parser.add_argument('--user', default=os.environ.get('SAMBA_USER', 'root'),
+                        help="user to log in to the domain controller as (default $SAMBA_USER or root)")
+    parser.add_argument('--local', action='store_true',
+                        help="run on this machine, which is the domain controller, without SSH")
+    parser.add_argument('--worker', action='store_true',
+                        help="run the commands in one long-lived samba-tool process on the DC, for big batches")
+    parser.add_argument('--max-parallel', type=int, default=6, metavar='N',
+                        help="most commands to run on the DC at once in a batch (default 6)")
+    parser.add_argument('--compression', choices=('on', 'off', 'auto'), default='auto',
+                        help="compress over SSH: on, off, or auto to turn it on if the link is slow (default auto)")
+    parser.add_argument('--json', action='store_true', help="write JSON (JSON Lines for lists) instead of text")
+    parser.add_argument('-q', '--quiet', action='store_true', help="don't say what was changed")
+    subparsers = parser.add_subparsers(dest='noun', metavar='{users,groups,members,policy}', required=True)
+
+    names_help = "names, or '-' (or nothing) to read them from stdin, one per line"
+
+    users = subparsers.add_parser('users', help="list, show, add, delete, enable or disable users")
+    users_verbs = users.add_subparsers(dest='verb', required=True)
+    users_verbs.add_parser('list', help="every non-built-in user").set_defaults(func=users_list)
+    show = users_verbs.add_parser('show', help="everything about one user")
+    show.add_argument('username')
+    show.set_defaults(func=users_show)
+    add = users_verbs.add_parser('add', help="add one user (the password is asked for, or taken from "
+                                             "$SAMBA_NEW_PASSWORD), or all the users in a CSV/TSV file")
+    add.add_argument('username', nargs='?')
+    add.add_argument('--given-name')
+    add.add_argument('--surname')
+    add.add_argument('--must-change', action='store_true', help="must change password at next login")
+    add.add_argument('--csv', metavar='FILE', help="add the users in FILE ('-' for stdin) instead")
+    add.set_defaults(func=users_add)
+    for verb, func in (('delete', users_delete), ('enable', users_enable), ('disable', users_disable)):
+        sub = users_verbs.add_parser(verb, help=f"{verb} users")
+        sub.add_argument('names', nargs='*', help=names_help)
+        sub.set_defaults(func=func)
+
+    groups = subparsers.add_parser('groups', help="list, add or delete groups")
+    groups_verbs = groups.add_subparsers(dest='verb', required=True)
+    sub = groups_verbs.add_parser('list', help="every non-built-in group")
+    sub.add_argument('--members', action='store_true', help="with their members")
+    sub.set_defaults(func=groups_list)
+    for verb, func in (('add', groups_add), ('delete', groups_delete)):
+        sub = groups_verbs.add_parser(verb, help=f"{verb} groups")
+        sub.add_argument('names', nargs='*', help=names_help)
+        sub.set_defaults(func=func)
+
+    members = subparsers.add_parser('members', help="list, add or remove the members of a group")
+    members_verbs = members.add_subparsers(dest='verb', required=True)
+    sub = members_verbs.add_parser('list', help="the members of a group, a page at a time")
+    sub.add_argument('group')
+    sub.set_defaults(func=members_list)
+    for verb, func in (('add', members_add), ('remove', members_remove)):
+        sub = members_verbs.add_parser(verb, help=f"{verb} members")
+        sub.add_argument('group')
+        sub.add_argument('names', nargs='*', help=names_help)
+        sub.set_defaults(func=func)
+
+    policy = subparsers.add_parser('policy', help="show or set the password policy")
+    policy_verbs = policy.add_subparsers(dest='verb', required=True)
+    policy_verbs.add_parser('show').set_defaults(func=policy_show)
+    sub = policy_verbs.add_parser('set')
+    sub.add_argument('settings', nargs='*', metavar='SETTING=VALUE',
+                     help="settings named as 'policy show' names them, or '-' to read a JSON object from stdin")
+    sub.set_defaults(func=policy_set)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.max_parallel < 1:
+        parser.error("--max-parallel must be at least 1")
+    if not args.host and not args.local:
+        parser.error("no domain controller: use --host or set $SAMBA_HOST")
+
+    # Only now that the arguments are good is it worth loading Paramiko
+    from ssh_samba import SshSamba
+
+    try:
+        ad = SshSamba()
+        if args.local:
+            ad.connect_locally()
+        else:
+            ad.set_ip(args.host)
+            ad.set_user(args.user)
+            ad.set_compression({'on': True, 'off': False, 'auto': 'auto'}[args.compression])
+            ad.set_password(os.environ.get('SAMBA_PASSWORD') or getpass(f"Password for {args.user}@{args.host}: "))
+            # connect_to_server talks to the user on stdout, which is for the results here
+            with redirect_stdout(sys.stderr if not args.quiet else io.StringIO()):
+                ad.connect_to_server()
+        if args.max_parallel == 1:
+            ad.concurrency = None
+        else:
+            from samba_concurrency import AdaptiveConcurrency
+            ad.concurrency = AdaptiveConcurrency(initial=2, max_limit=args.max_parallel)
+        args.concurrency = ad.concurrency
+        if args.worker and not ad.start_dispatcher() and not args.quiet:
+            print("Couldn't start the samba-tool worker, so running samba-tool for each command", file=sys.stderr)
+        try:
+            args.func(ad, args)
+        finally:
+            ad.close()
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # eg. piped into head. Nowhere left to write to, so go quietly.
+        sys.stderr.close()
+        return 1
+    except Exception as e:
+        message = e.args[0] if e.args else repr(e)
+        if isinstance(message, list):
+            message = '\n'.join(line for line in message if line)
+        print(f"{type(e).__name__}: {message}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""
+Several domain controllers at once: reads go to whichever is answering quickest, writes to one of them.
+
+With DCs at several sites, whichever one SshSamba is pointed at might be the far one, or busy. DomainControllers
+holds a connected SshSamba for each DC and works out which to use for each call:
+    - reads (get_users, get_password_policy, ldb_search, ...) go to the healthy DC with the lowest latency,
+      measured by timing a command that does nothing on each of them (every probe_interval seconds)
+    - writes (add_users, set_password_policy, ...) all go to one DC: the PDC emulator (from 'samba-tool fsmo show')
+      unless told otherwise. That's where AD sends password changes first anyway, so a password set here works
+      straight away everywhere.
+    - read-your-writes: the other DCs only see a write once it has replicated to them, so for consistency_window
+      seconds after a write, reads go to the DC that took it too
+If a DC stops answering in the middle of a read, the read is tried again on the next quickest one.
+The iter_ reads are only tried again if the DC stops before the first item: after that, the caller has already
+had some of the answer.
+Writes aren't tried again anywhere else, as they might have happened.
+
+Use it wherever an SshSamba would be used (the same methods), eg.:
+    dcs = connect_all(['10.0.0.2', '10.1.0.2', '10.2.0.2'], 'root', password)
+    dcs.get_users()
+    dcs.add_users(lstUsers)
+    dcs.close()
+"""
+
+import sys
+import threading
+from contextlib import redirect_stdout
+from time import monotonic
+
+from ssh_samba import SambaException, SshSamba
+
+# The methods of SshSamba that only read the directory, so any up-to-date DC will do
+READS = ('get_domain', 'get_domain_long', 'get_users', 'get_user_columns', 'get_user', 'get_groups',
+         'count_group_members', 'get_group_member_counts', 'iter_group_members', 'get_group_nesting',
+         'iter_users', 'iter_groups', 'iter_computers', 'export_users', 'export_groups', 'export_directory',
+         'get_organizational_units', 'get_computers', 'get_password_policy', 'ldb_search', 'ldb_search_iter')
+# The READS that are generators: the DC is only asked when the first item is wanted
+ITERATOR_READS = ('iter_group_members', 'iter_users', 'iter_groups', 'iter_computers', 'ldb_search_iter')
+# The methods of SshSamba that change the directory, which all go to the one DC.
+# samba_command and samba_commands could be anything, so they go there too to be on the safe side.
+WRITES = ('add_users', 'delete_users', 'disable_users', 'enable_users', 'password_user', 'password_users',
+          'edit_user', 'add_group', 'delete_group', 'add_members_to_group', 'delete_members_from_group',
+          'add_organizational_unit', 'set_password_policy', 'samba_command', 'samba_commands')
+
+
+class _DomainController:
+    """One DC, and how it's been doing"""
+    def __init__(self, ad: SshSamba):
+        self.ad = ad
+        self.host = ad.remote_server_ip
+        self.latency = None  # Running average of a round trip, in seconds
+        self.healthy = ad.is_connected()
+        self.error = None if self.healthy else "Not connected"
+        self.probing = False
+
+    def ping(self):
+        """Time a command that does nothing. Runs in its own thread, as a DC that has gone away might never answer."""
+        start = monotonic()
+        try:
+            if not self.ad.is_connected():
+                raise ConnectionError("Not connected")
+            self.ad.transport.run('true')
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e) or type(e).__name__
+        else:
+            latency = monotonic() - start
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+            self.healthy = True
+            self.error = None
+        finally:
+            self.probing = False
+
+
+class DomainControllers:
+    def __init__(self, lstSessions: list, writer: SshSamba = None, consistency_window: float = 60.0,
+                 probe_interval: float = 30.0, probe_timeout: float = 2.0):
+        """
+        :param lstSessions: a connected SshSamba for each DC
+        :param writer: the one to send writes to. Leave it out for the PDC emulator.
+        :param consistency_window: seconds after a write that reads go to the DC that took it. DCs in the same site
+                                   replicate within seconds; between sites it's whatever the site link says
+                                   (3 hours by default!), so make it longer, or make the site links replicate more
+                                   often, if the DCs are at different sites and the PDC emulator isn't the quickest.
+        :param probe_interval: how often (seconds) to time the DCs again, when there are reads to do
+        :param probe_timeout: DCs that take longer than this (seconds) to answer are left out until they answer
+        """
+        if not lstSessions:
+            raise ValueError("Need at least one domain controller.")
+        self.dcs = [_DomainController(ad) for ad in lstSessions]
+        self.consistency_window = consistency_window
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._writer = None if writer is None else next(dc for dc in self.dcs if dc.ad is writer)
+        self._last_write = None  # monotonic() of the last write
+        self._last_probe = None
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()  # So reads from several threads at once don't all time the DCs
+
+    def measure(self):
+        """
+        Time a round trip to every DC, all at once. Those that don't answer within probe_timeout are counted as
+        unhealthy until they do.
+        """
+        lstThreads = []
+        for dc in self.dcs:
+            if dc.probing:
+                # Still waiting for the last one: it's not answering
+                dc.healthy = False
+                dc.error = f"No answer in {self.probe_timeout} s"
+                continue
+            dc.probing = True
+            thread = threading.Thread(target=dc.ping, daemon=True)
+            thread.start()
+            lstThreads.append((dc, thread))
+        deadline = monotonic() + self.probe_timeout
+        for dc, thread in lstThreads:
+            thread.join(max(0.0, deadline - monotonic()))
+            if thread.is_alive():
+                dc.healthy = False
+                dc.error = f"No answer in {self.probe_timeout} s"
+        self._last_probe = monotonic()
+
+    @property
+    def writer(self) -> SshSamba:
+        """The DC writes go to: the one given, or the PDC emulator, or failing that the first one"""
+        with self._lock:
+            if self._writer is None:
+                self._writer = self._find_pdc_emulator() or self.dcs[0]
+            return self._writer.ad
+
+    def _find_pdc_emulator(self) -> _DomainController:
+        """
+        Ask a DC which DC is the PDC emulator, and find that one among ours.
+        :return: the PDC emulator, or None if it isn't one of ours (or nobody could say)
+        """
+        for dc in self.dcs:
+            if not dc.healthy:
+                continue
+            try:
+                lstFsmo = dc.ad.samba_command('fsmo show')
+            except Exception:
+                continue
+            # eg. PdcEmulationMasterRole owner: CN=NTDS Settings,CN=DC1,CN=Servers,CN=Site,CN=Sites,...
+            owner = next((line.partition(':')[2] for line in lstFsmo if line.startswith('PdcEmulationMasterRole')), '')
+            parts = [part.strip() for part in owner.split(',')]
+            if len(parts) < 2 or parts[0] != 'CN=NTDS Settings':
+                continue
+            name = parts[1].partition('=')[2].upper()
+            for candidate in self.dcs:
+                try:
+                    dicDomain = candidate.ad.get_domain()
+                except Exception:
+                    continue
+                if name in (dicDomain.get('DC netbios name', '').upper(),
+                            dicDomain.get('DC name', '').partition('.')[0].upper()):
+                    return candidate
+            return None
+        return None
+
+    def reader(self) -> SshSamba:
+        """
+        The DC reads go to: the DC that took the last write, if that was less than consistency_window seconds ago,
+        otherwise the healthy DC with the lowest latency.
+        Raises ConnectionError if none of them are answering.
+        """
+        return self._readers()[0].ad
+
+    def _readers(self) -> list:
+        """Healthy DCs, in the order to try them for a read"""
+        with self._probe_lock:
+            if self._last_probe is None or monotonic() - self._last_probe > self.probe_interval:
+                self.measure()
+        lstHealthy = sorted((dc for dc in self.dcs if dc.healthy),
+                            key=lambda dc: float('inf') if dc.latency is None else dc.latency)
+        if self._last_write is not None and monotonic() - self._last_write < self.consistency_window:
+            # Read your writes
+            return [self._writer] if self._writer.healthy else []
+        if not lstHealthy:
+            raise ConnectionError("None of the domain controllers are answering: " +
+                                  '; '.join(f"{dc.host}: {dc.error}" for dc in self.dcs))
+        return lstHealthy
+
+    def _read(self, name: str, *args, **kwargs):
+        lstReaders = self._readers()
+        if not lstReaders:
+            raise ConnectionError(f"The domain controller that took the last write ({self._writer.host}) "
+                                  f"isn't answering: {self._writer.error}")
+        for i, dc in enumerate(lstReaders):
+            try:
+                return getattr(dc.ad, name)(*args, **kwargs)
+            except (SambaException, ValueError, KeyError):
+                # The DC answered; it's the request that was wrong
+                raise
+            except Exception as e:
+                dc.healthy = False
+                dc.error = str(e) or type(e).__name__
+                if i == len(lstReaders) - 1:
+                    raise
+
+    def _read_iter(self, name: str, *args, **kwargs):
+        """_read for generators, which go wrong when they're gone through rather than when they're called"""
+        lstReaders = self._readers()
+        if not lstReaders:
+            raise ConnectionError(f"The domain controller that took the last write ({self._writer.host}) "
+                                  f"isn't answering: {self._writer.error}")
+        for i, dc in enumerate(lstReaders):
+            iterator = getattr(dc.ad, name)(*args, **kwargs)
+            try:
+                first = next(iterator)
+            except StopIteration:
+                return
+            except (SambaException, ValueError, KeyError):
+                raise
+            except Exception as e:
+                dc.healthy = False
+                dc.error = str(e) or type(e).__name__
+                if i == len(lstReaders) - 1:
+                    raise
+                continue
+            try:
+                yield first
+                yield from iterator
+            except (SambaException, ValueError, KeyError, GeneratorExit):
+                raise
+            except Exception as e:
+                # Too late to start again somewhere else, but don't send the next read here
+                dc.healthy = False
+                dc.error = str(e) or type(e).__name__
+                raise
+            return
+
+    def _write(self, name: str, *args, **kwargs):
+        writer = self.writer
+        try:
+            return getattr(writer, name)(*args, **kwargs)
+        except (SambaException, ValueError, KeyError):
+            raise
+        except Exception as e:
+            self._writer.healthy = False
+            self._writer.error = str(e) or type(e).__name__
+            raise
+        finally:
+            self._last_write = monotonic()
+            # The other DCs' cached users are out of date until the write reaches them
+            for dc in self.dcs:
+                if dc.ad is not writer:
+                    dc.ad.user_cache.clear()
+
+    def __getattr__(self, name):
+        # Only called for what isn't found the usual way, ie. SshSamba's methods
+        if name in ITERATOR_READS:
+            return lambda *args, **kwargs: self._read_iter(name, *args, **kwargs)
+        if name in READS:
+            return lambda *args, **kwargs: self._read(name, *args, **kwargs)
+        if name in WRITES:
+            return lambda *args, **kwargs: self._write(name, *args, **kwargs)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def is_connected(self) -> bool:
+        return any(dc.ad.is_connected() for dc in self.dcs)
+
+    def stats(self) -> list:
+        """How each DC is doing: list of dictionaries, one per DC"""
+        writer = self._writer
+        return [{'host': dc.host,
+                 'latency': dc.latency,
+                 'healthy': dc.healthy,
+                 'writer': dc is writer,
+                 'error': dc.error,
+                 } for dc in self.dcs]
+
+    def close(self):
+        for dc in self.dcs:
+            dc.ad.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def connect_all(lstHosts: list, user: str, password: str, writer_host: str = None, compression='auto',
+                **kwargs) -> DomainControllers:
+    """
+    Connect to every DC over SSH, all at once. DCs that can't be connected to are left out (and said so on stderr),
+    as long as at least one can. Nothing is written to stdout, which may be for the results (eg. samba_cli --json).
+    :param lstHosts: IP addresses of the DCs
+    :param user: the administrating user, the same on all of them
+    :param password: their password
+    :param writer_host: the DC to send writes to. Leave it out for the PDC emulator.
+    :param compression: see SshSamba.set_compression
+    :param kwargs: see DomainControllers
+    :return: DomainControllers
+    """
+    dicSessions = {}
+    dicErrors = {}
+
+    def connect(host):
+        ad = SshSamba()
+        try:
+            ad.set_ip(host)
+            ad.set_user(user)
+            ad.set_password(password)
+            ad.set_compression(compression)
+            ad.connect_to_server()
+            dicSessions[host] = ad
+        except Exception as e:
+            dicErrors[host] = e
+
+    # connect_to_server says how it's getting on, on stdout
+    with redirect_stdout(sys.stderr):
+        lstThreads = [threading.Thread(target=connect, args=(host,)) for host in lstHosts]
+        for thread in lstThreads:
+            thread.start()
+        for thread in lstThreads:
+            thread.join()
+
+    for host, e in dicErrors.items():
+        print(f"Couldn't connect to {host}: {e}", file=sys.stderr)
+    lstSessions = [dicSessions[host] for host in lstHosts if host in dicSessions]
+    if not lstSessions:
+        raise ConnectionError("Couldn't connect to any of the domain controllers.")
+    if writer_host is not None and writer_host not in dicSessions:
+        for ad in lstSessions:
+            ad.close()
+        raise ConnectionError(f"Couldn't connect to {writer_host}, which writes are meant to go to.")
+    return DomainControllers(lstSessions, writer=dicSessions.get(writer_host), **kwargs)
@@ -0,0 +1,176 @@
+"""
+How many commands to have running on the domain controller at once, for bulk jobs.
+
+Every samba-tool call is a Python process on the DC, so running more at once only helps until the DC's CPU is busy.
+After that they just queue up there, and everybody else using the DC (logins!) waits behind them.
+AdaptiveConcurrency works out the limit as it goes, the same way TCP works out how fast it can send (AIMD):
+    - while commands come back about as quickly as the quickest ones so far, allow one more at once per round
+      (a round being as many commands as the limit)
+    - when they start taking much longer than that, or fail in a way that suggests the DC or the link is
+      struggling, cut the limit by a fraction (at most once per round, so one slow patch isn't punished over and over)
+"""
+
+import threading
+from collections import deque
+from time import monotonic
+
+
+class AdaptiveConcurrency:
+    """
+    Thread safe. Use a slot for each command:
+        with controller.slot():
+            ...
+    or acquire() and release(latency, ok) yourself. See run_concurrently for the easy way.
+    """
+    def __init__(self, initial: int = 2, min_limit: int = 1, max_limit: int = 6,
+                 tolerance: float = 2.0, backoff: float = 0.7, smoothing: float = 0.2):
+        """
+        :param initial: commands at once to start with
+        :param min_limit: never fewer than this
+        :param max_limit: never more than this. OpenSSH allows 10 channels per connection (MaxSessions), and
+                          the rest of the app needs some too (the GUI's prefetcher has 2 threads, each with a
+                          channel, the dispatcher or a latency probe one more, and the shell SshSamba keeps for
+                          samba_commands one more), so keep it well below that over SSH.
+        :param tolerance: commands taking more than this many times as long as the quickest are a sign of trouble
+        :param backoff: the limit is multiplied by this when there's trouble
+        :param smoothing: weight of each new latency in the running average (latency)
+        """
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError("Need 1 <= min_limit <= initial <= max_limit")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+
+        self._limit = float(initial)
+        self.in_flight = 0
+        self.latency = None  # Running average of how long commands take, in seconds
+        self.min_latency = None  # The quickest so far: what a command takes when the DC isn't busy
+        self.completed = 0
+        self.errors = 0
+        self._last_cut = 0  # self.completed when the limit was last cut
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """How many commands are allowed at once right now"""
+        return int(self._limit)
+
+    def acquire(self):
+        """Wait until another command is allowed"""
+        with self._condition:
+            while self.in_flight >= int(self._limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, ok: bool = True):
+        """
+        A command has finished.
+        :param latency: how long it took, in seconds
+        :param ok: False if it failed in a way that suggests the DC or the link is struggling
+        """
+        with self._condition:
+            saturated = self.in_flight >= int(self._limit)
+            self.in_flight -= 1
+            self.completed += 1
+            if not ok:
+                self.errors += 1
+            else:
+                self.latency = latency if self.latency is None else \
+                    (1 - self.smoothing) * self.latency + self.smoothing * latency
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                else:
+                    # Creep up towards what commands take now, so one lucky quick one doesn't set the bar forever
+                    self.min_latency += (latency - self.min_latency) * 0.001
+
+            if not ok or latency > self.tolerance * max(self.min_latency, 0.001):
+                # Multiplicative decrease, once per round
+                if self.completed - self._last_cut >= int(self._limit):
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._last_cut = self.completed
+            elif saturated:
+                # Additive increase: 1/limit a command makes one more per round. Only when the limit is what's
+                # holding things back, otherwise it would grow without ever being tested.
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def abandon(self):
+        """Give back a slot that was acquired but never used"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def slot(self):
+        """Context manager that holds a slot while the with block runs, and times it"""
+        return _Slot(self)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'limit': int(self._limit),
+                    'in_flight': self.in_flight,
+                    'latency': self.latency,
+                    'min_latency': self.min_latency,
+                    'completed': self.completed,
+                    'errors': self.errors,
+                    }
+
+
+class _Slot:
+    def __init__(self, controller: AdaptiveConcurrency):
+        self.controller = controller
+        self.start = None
+
+    def __enter__(self):
+        self.controller.acquire()
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.controller.release(monotonic() - self.start, ok=exc_type is None)
+
+
+def run_concurrently(func, items, controller: AdaptiveConcurrency, is_trouble=lambda e: True, cost=lambda item: 1):
+    """
+    Call func(item) for each item, with as many running at once as the controller allows.
+    :param func: function of one item
+    :param items: the items
+    :param controller: decides how many at once
+    :param is_trouble: function of an exception func raised: True if it suggests the DC or the link is struggling
+                       (so the controller backs off), False if it's just that item (eg. the user already exists)
+    :param cost: function of an item: how many commands it is (eg. for a batch of them), so the controller
+                 compares the time per command
+    :return: generator of func's result, or the exception it raised, for each item in order,
+             as soon as it and all the ones before it are finished
+    """
+    # Not imported at the top, as it's slow to import and only bulk jobs need it (see benchmarks/import_time.py)
+    from concurrent.futures import ThreadPoolExecutor
+
+    def call(item):
+        start = monotonic()
+        try:
+            result = func(item)
+        except Exception as e:
+            controller.release((monotonic() - start) / max(1, cost(item)), ok=not is_trouble(e))
+            return e
+        controller.release((monotonic() - start) / max(1, cost(item)))
+        return result
+
+    queFutures = deque()
+    with ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
+        try:
+            for item in items:
+                while queFutures and queFutures[0].done():
+                    yield queFutures.popleft().result()
+                controller.acquire()
+                queFutures.append(executor.submit(call, item))
+            while queFutures:
+                yield queFutures.popleft().result()
+        finally:
+            # Stopped early: don't start any more
+            for future in queFutures:
+                if future.cancel():
+                    controller.abandon()
@@ -0,0 +1,996 @@
+"""
+In-memory helpers for working with what SshSamba fetched from the domain controller.
+Nothing in here talks to the server, so it is quick to use from the GUI or from scripts.
+
+Abilities so far:
+    Searching:
+        - as-you-type prefix and substring search over users and groups
+    Decoding:
+        - userAccountControl flags, disabled/locked state and AD timestamps for all users at once (NumPy)
+    Directory model:
+        - a columnar snapshot of users and groups, indexed by name, DN and OU, with a small query API
+        - a sparse user-by-group membership matrix for lookups both ways, set operations and snapshot diffs
+        - nested groups: effective members of a group and effective groups of a user, with loop detection
+"""
+
+import re
+from bisect import bisect_left, insort
+from itertools import chain
+
+import numpy as np
+
+from ssh_samba import AccountFlags
+from ssh_samba import SambaException
+from ssh_samba import User
+
+# AD timestamps (pwdLastSet, lastLogonTimestamp, accountExpires, lockoutTime) are Windows FILETIMEs:
+# the number of 100 nanosecond intervals since 1601-01-01 UTC.
+FILETIME_UNIX_EPOCH = 116444736000000000  # 1970-01-01 as a FILETIME
+FILETIME_NEVER = 0x7FFFFFFFFFFFFFFF  # accountExpires uses this (or 0) for 'never'
+
+
+class SearchIndex:
+    """
+    An index for as-you-type searching, fast enough to re-filter on every key press with 100k entries.
+    Each entry has a key (eg. username or group name) and one or more text fields to search in.
+    Short search terms match the start of any word in the fields (prefix index).
+    Terms of three letters or more also match anywhere inside a field (trigram index).
+    Build it once from the loaded data, then keep it up to date with add, update and remove.
+    """
+    def __init__(self):
+        self.dicFields = {}     # key: tuple of lower-cased fields
+        self.lstWords = []      # sorted list of (word, key) for prefix searches
+        self.dicTrigrams = {}   # trigram: set of keys whose fields contain it
+
+    def __len__(self):
+        return len(self.dicFields)
+
+    def __contains__(self, key):
+        return key in self.dicFields
+
+    @staticmethod
+    def _words(fields: tuple) -> set:
+        """
+        Every field, and every word inside a field, can be matched by its beginning.
+        """
+        words = set(fields)
+        for field in fields:
+            words.update(re.split(r'[\s._\-]+', field))
+        words.discard('')
+        return words
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, key, *fields):
+        """
+        Add an entry to the index. If the key is already there, it is updated instead.
+        :param key: what search returns for this entry, eg. the username
+        :param fields: the text to search in, eg. username, given name and surname
+        """
+        if key in self.dicFields:
+            self.remove(key)
+        fields = tuple(str(field).lower() for field in fields if field)
+        self.dicFields[key] = fields
+        for word in self._words(fields):
+            insort(self.lstWords, (word, key))
+        for field in fields:
+            for trigram in self._trigrams(field):
+                self.dicTrigrams.setdefault(trigram, set()).add(key)
+
+    def build(self, entries):
+        """
+        Throw away whatever is indexed and index a whole snapshot in one go.
+        Much quicker than calling add for each entry, because the word list is sorted once at the end.
+        :param entries: iterable of (key, field, field, ...) tuples
+        """
+        self.dicFields = {}
+        self.lstWords = []
+        self.dicTrigrams = {}
+        for key, *fields in entries:
+            fields = tuple(str(field).lower() for field in fields if field)
+            self.dicFields[key] = fields
+            self.lstWords.extend((word, key) for word in self._words(fields))
+            for field in fields:
+                for trigram in self._trigrams(field):
+                    self.dicTrigrams.setdefault(trigram, set()).add(key)
+        self.lstWords.sort()
+
+    def update(self, key, *fields):
+        """
+        Replace the fields of an entry
+        """
+        self.add(key, *fields)
+
+    def remove(self, key):
+        """
+        Take an entry out of the index. Silence = success, even if it wasn't there.
+        """
+        fields = self.dicFields.pop(key, None)
+        if fields is None:
+            return
+        for word in self._words(fields):
+            i = bisect_left(self.lstWords, (word, key))
+            if i < len(self.lstWords) and self.lstWords[i] == (word, key):
+                del self.lstWords[i]
+        for field in fields:
+            for trigram in self._trigrams(field):
+                keys = self.dicTrigrams.get(trigram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.dicTrigrams[trigram]
+
+    def _search_term(self, term: str) -> set:
+        # Prefix matches: every (word, key) pair from term up to the next possible string after term
+        start = bisect_left(self.lstWords, (term,))
+        end = bisect_left(self.lstWords, (term + '\uffff',))
+        matches = {key for word, key in self.lstWords[start:end]}
+
+        # Substring matches: start from the rarest trigram and check the candidates really contain the term
+        if len(term) >= 3:
+            lstSets = [self.dicTrigrams.get(trigram, set()) for trigram in self._trigrams(term)]
+            lstSets.sort(key=len)
+            candidates = set(lstSets[0])
+            for keys in lstSets[1:]:
+                candidates &= keys
+                if not candidates:
+                    break
+            matches.update(key for key in candidates if any(term in field for field in self.dicFields[key]))
+
+        return matches
+
+    def search(self, query: str):
+        """
+        Find the entries matching every word of the query (case insensitive).
+        :param query: what the user typed
+        :return: set of matching keys, or None if the query is empty (ie. everything matches)
+        """
+        terms = query.lower().split()
+        if not terms:
+            return None
+        # Longest term first, it's likely the most selective
+        terms.sort(key=len, reverse=True)
+        matches = self._search_term(terms[0])
+        for term in terms[1:]:
+            if not matches:
+                break
+            matches &= self._search_term(term)
+        return matches
+
+
+def _column_to_int64(values) -> np.ndarray:
+    """
+    Raw attribute values (strings, with None or '' where a user doesn't have the attribute) to an int64 array.
+    Missing values become 0, which AD uses for 'never' or 'not set' anyway.
+    Multi-valued attributes (lists, from parse_ldif) count as their first value.
+    """
+    if isinstance(values, np.ndarray) and values.dtype == np.int64:
+        return values
+
+    def first(value):
+        if isinstance(value, list):
+            value = value[0] if value else None
+        return int(value) if value else 0
+
+    return np.fromiter((first(value) for value in values), dtype=np.int64, count=len(values))
+
+
+def decode_filetimes(values) -> np.ndarray:
+    """
+    Decode a column of AD timestamps (FILETIME) all at once.
+    :param values: raw values, eg. every user's pwdLastSet, as strings or an int64 array
+    :return: numpy datetime64[us] array (UTC), with NaT where the timestamp is 0/missing or means 'never'
+    """
+    filetimes = _column_to_int64(values)
+    never = (filetimes <= 0) | (filetimes >= FILETIME_NEVER)
+    microseconds = (filetimes - FILETIME_UNIX_EPOCH) // 10
+    decoded = microseconds.astype('datetime64[us]')
+    decoded[never] = np.datetime64('NaT')
+    return decoded
+
+
+def decode_user_columns(dicColumns: dict, lockout_duration_mins: float = None, now: np.datetime64 = None) -> dict:
+    """
+    Decode the raw attributes of all users in one go, instead of a Python loop per user.
+    Give it the columns from SshSamba.get_user_columns, get back arrays with one entry per user (in the same order).
+    :param dicColumns:  attribute: list of raw values, one per user. Uses whichever of
+                        userAccountControl, lockoutTime, pwdLastSet, lastLogonTimestamp and accountExpires are there.
+    :param lockout_duration_mins:   from the password policy ('Account lockout duration (mins)').
+                                    If given, a lockout older than this counts as over. Otherwise any lockout counts.
+    :param now: what time it is, for working out lockouts and expiry. Defaults to now.
+    :return: dictionary of numpy arrays:
+        'userAccountControl':   int64
+        'flags':                bool, one row per user and one column per flag in flag_names
+        'flag_names':           the AccountFlags names, in the order of the columns of 'flags'
+        'disabled':             bool
+        'locked':               bool
+        'expired':              bool, the account (not the password) has expired
+        'pwdLastSet', 'lastLogonTimestamp', 'accountExpires', 'lockoutTime':
+                                datetime64[us], NaT for never. Only the ones that were in dicColumns.
+    """
+    lstLengths = {len(values) for values in dicColumns.values()}
+    if len(lstLengths) > 1:
+        raise ValueError("Every column needs one value per user.")
+    no_of_users = lstLengths.pop() if lstLengths else 0
+    if now is None:
+        now = np.datetime64('now', 'us')
+
+    dicDecoded = {}
+    if 'userAccountControl' in dicColumns:
+        user_account_control = _column_to_int64(dicColumns['userAccountControl'])
+    else:
+        user_account_control = np.zeros(no_of_users, dtype=np.int64)
+    dicDecoded['userAccountControl'] = user_account_control
+
+    flag_values = np.array([flag.value for flag in AccountFlags], dtype=np.int64)
+    dicDecoded['flag_names'] = [flag.name for flag in AccountFlags]
+    dicDecoded['flags'] = (user_account_control[:, np.newaxis] & flag_values) == flag_values
+    dicDecoded['disabled'] = (user_account_control & AccountFlags.ACCOUNTDISABLE.value) != 0
+
+    for attribute in ('pwdLastSet', 'lastLogonTimestamp', 'accountExpires', 'lockoutTime'):
+        if attribute in dicColumns:
+            dicDecoded[attribute] = decode_filetimes(dicColumns[attribute])
+
+    # Samba doesn't keep the LOCKOUT bit of userAccountControl up to date, lockoutTime is what really counts
+    locked = (user_account_control & AccountFlags.LOCKOUT.value) != 0
+    if 'lockoutTime' in dicDecoded:
+        locked_since = dicDecoded['lockoutTime']
+        if lockout_duration_mins:
+            lockout_duration = np.timedelta64(int(float(lockout_duration_mins) * 60 * 10 ** 6), 'us')
+            locked |= ~np.isnat(locked_since) & (locked_since + lockout_duration > now)
+        else:
+            locked |= ~np.isnat(locked_since)
+    dicDecoded['locked'] = locked
+
+    if 'accountExpires' in dicDecoded:
+        expires = dicDecoded['accountExpires']
+        dicDecoded['expired'] = ~np.isnat(expires) & (expires <= now)
+    else:
+        dicDecoded['expired'] = np.zeros(no_of_users, dtype=bool)
+
+    return dicDecoded
+
+
+class MembershipMatrix:
+    """
+    Who is in which group, as a sparse user-by-group matrix of integers.
+    Every user and group gets a number. For each group we keep a sorted array of its members' numbers,
+    and for each user a sorted array of their groups' numbers (compressed sparse rows, both ways round).
+    That makes "is X in G", "who is in G" and "which groups is X in" lookups rather than scans, and lets
+    questions across many groups (union, intersection) and comparisons of two snapshots run in NumPy.
+
+    Usage:
+        matrix = MembershipMatrix(ad.get_groups())
+        ('Teachers', 'jsmith') in matrix
+        matrix.groups_of('jsmith')
+        matrix.intersection(['Teachers', 'Year 7'])
+        added, removed = old_matrix.diff(new_matrix)
+    """
+    def __init__(self, dicGroups: dict = None, usernames=()):
+        """
+        :param dicGroups: group name: [member, member], eg. from SshSamba.get_groups
+        :param usernames: users to include even if they aren't in any group
+        """
+        dicGroups = dicGroups or {}
+        lstMembers = [members for members in dicGroups.values()]
+        self.groups = np.array(sorted(dicGroups), dtype=str)
+        self.users = np.array(sorted(set(usernames).union(*lstMembers)), dtype=str)
+        self.dicGroup_index = {grp: i for i, grp in enumerate(self.groups.tolist())}
+        self.dicUser_index = {usr: i for i, usr in enumerate(self.users.tolist())}
+
+        # Every membership as (group number, user number), sorted and without duplicates
+        lstRows = [dicGroups[grp] for grp in self.groups.tolist()]
+        user_numbers = np.fromiter(map(self.dicUser_index.__getitem__, chain.from_iterable(lstRows)), dtype=np.int32)
+        group_numbers = np.repeat(np.arange(len(self.groups), dtype=np.int32), [len(row) for row in lstRows])
+        pairs = np.sort(group_numbers.astype(np.int64) * max(len(self.users), 1) + user_numbers)
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))] if len(pairs) else pairs
+        group_numbers, user_numbers = np.divmod(pairs, max(len(self.users), 1))
+
+        # Group rows: the members of group g are user_numbers[group_starts[g]:group_starts[g + 1]]
+        self.user_numbers = user_numbers.astype(np.int32)
+        self.group_starts = np.zeros(len(self.groups) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(group_numbers, minlength=len(self.groups)), out=self.group_starts[1:])
+
+        # User rows, the same the other way round (a stable sort keeps each user's groups in order)
+        group_numbers = group_numbers.astype(np.int32)
+        order = np.argsort(self.user_numbers, kind='stable')
+        self.group_numbers = group_numbers[order]
+        self.user_starts = np.zeros(len(self.users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.user_numbers, minlength=len(self.users)), out=self.user_starts[1:])
+
+    def __len__(self):
+        """The number of memberships"""
+        return len(self.user_numbers)
+
+    def __contains__(self, group_and_user) -> bool:
+        grp, usr = group_and_user
+        g = self.dicGroup_index.get(grp)
+        u = self.dicUser_index.get(usr)
+        if g is None or u is None:
+            return False
+        row = self.user_numbers[self.group_starts[g]:self.group_starts[g + 1]]
+        i = np.searchsorted(row, u)
+        return bool(i < len(row) and row[i] == u)
+
+    def _member_numbers(self, group: str) -> np.ndarray:
+        g = self.dicGroup_index.get(group)
+        if g is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.user_numbers[self.group_starts[g]:self.group_starts[g + 1]]
+
+    def members(self, group: str) -> list:
+        """
+        :return: the members of the group, sorted. Empty if there is no such group.
+        """
+        return self.users[self._member_numbers(group)].tolist()
+
+    def groups_of(self, username: str) -> list:
+        """
+        :return: the groups the user is a member of, sorted. Empty if the user isn't in any.
+        """
+        u = self.dicUser_index.get(username)
+        if u is None:
+            return []
+        return self.groups[self.group_numbers[self.user_starts[u]:self.user_starts[u + 1]]].tolist()
+
+    def member_counts(self) -> dict:
+        """
+        :return: group name: number of members, for every group
+        """
+        return dict(zip(self.groups.tolist(), np.diff(self.group_starts).tolist()))
+
+    def _counts(self, groups) -> np.ndarray:
+        """How many of the groups each user is in"""
+        lstRows = [self._member_numbers(grp) for grp in groups]
+        if not lstRows:
+            return np.zeros(len(self.users), dtype=np.int64)
+        return np.bincount(np.concatenate(lstRows), minlength=len(self.users))
+
+    def union(self, groups) -> list:
+        """
+        :return: users in any of the groups
+        """
+        return self.users[self._counts(groups) > 0].tolist()
+
+    def intersection(self, groups) -> list:
+        """
+        :return: users in every one of the groups
+        """
+        groups = set(groups)
+        if not groups:
+            return []
+        return self.users[self._counts(groups) == len(groups)].tolist()
+
+    def difference(self, group: str, other_groups) -> list:
+        """
+        :return: users in group but in none of other_groups
+        """
+        mask = self._counts([group]) > 0
+        mask &= self._counts(other_groups) == 0
+        return self.users[mask].tolist()
+
+    def _pairs(self, groups: np.ndarray, users: np.ndarray) -> np.ndarray:
+        """
+        Every membership as one int64 (group number * number of users + user number), numbered against
+        the given (sorted) groups and users rather than our own, so two snapshots can be compared.
+        """
+        g = np.searchsorted(groups, self.groups)[np.repeat(np.arange(len(self.groups)), np.diff(self.group_starts))]
+        u = np.searchsorted(users, self.users)[self.user_numbers]
+        return g.astype(np.int64) * len(users) + u
+
+    def diff(self, other) -> tuple:
+        """
+        Compare this (older) snapshot to another (newer) one.
+        :param other: another MembershipMatrix
+        :return: (added, removed) - lists of (group, user) memberships in other but not here, and here but not in other
+        """
+        groups = np.union1d(self.groups, other.groups)
+        users = np.union1d(self.users, other.users)
+        old = self._pairs(groups, users)
+        new = other._pairs(groups, users)
+
+        def to_names(pairs):
+            g, u = np.divmod(pairs, len(users)) if len(users) else (pairs, pairs)
+            return list(zip(groups[g].tolist(), users[u].tolist()))
+
+        return to_names(np.setdiff1d(new, old, assume_unique=True)), to_names(np.setdiff1d(old, new, assume_unique=True))
+
+
+class GroupGraph:
+    """
+    Nested groups as a directed graph: an edge from a group to each group that is a member of it.
+    Answers "who is effectively in Domain Admins", counting members of members of members..., and
+    "which groups is this user effectively in".
+    Groups can (wrongly, but AD allows it) be members of each other in a loop. Each loop is treated as one
+    group whose members are everyone in any group of the loop, and cycles() lists them so they can be fixed.
+    Effective members are worked out once per group and remembered. Changing one group with set_group
+    only forgets the answers for that group and the groups it is nested in.
+
+    Usage:
+        graph = GroupGraph(ad.get_group_nesting())
+        graph.effective_members('Domain Admins')
+        graph.effective_groups('jsmith')
+    """
+    def __init__(self, dicNesting: dict = None):
+        """
+        :param dicNesting: group name: {'users': [user, user], 'groups': [group, group]} (see SshSamba.get_group_nesting)
+        """
+        self.dicUsers = {}        # group: set of users directly in it
+        self.dicSubgroups = {}    # group: set of groups directly in it
+        self.dicParents = {}      # group: set of groups it is directly in
+        self.dicUser_groups = {}  # user: set of groups they are directly in
+
+        self.dicEffective_members = {}  # group: frozenset of users, worked out as needed
+        self.dicEffective_groups = {}   # user: frozenset of groups, worked out as needed
+        self.dicComponents = None       # group: frozenset of the groups in its loop (just itself if none)
+
+        for grp, dicMembers in (dicNesting or {}).items():
+            self._set_edges(grp, dicMembers.get('users', ()), dicMembers.get('groups', ()))
+
+    def __contains__(self, group):
+        return group in self.dicUsers
+
+    def groups(self) -> list:
+        return list(self.dicUsers)
+
+    def _add_node(self, group: str):
+        self.dicUsers.setdefault(group, set())
+        self.dicSubgroups.setdefault(group, set())
+        self.dicParents.setdefault(group, set())
+
+    def _set_edges(self, group: str, users, groups):
+        self._add_node(group)
+        for usr in self.dicUsers[group]:
+            self.dicUser_groups[usr].discard(group)
+        for sub in self.dicSubgroups[group]:
+            self.dicParents[sub].discard(group)
+
+        self.dicUsers[group] = set(users)
+        self.dicSubgroups[group] = set(groups)
+        for usr in self.dicUsers[group]:
+            self.dicUser_groups.setdefault(usr, set()).add(group)
+        for sub in self.dicSubgroups[group]:
+            self._add_node(sub)
+            self.dicParents[sub].add(group)
+
+    def _forget(self, lstGroups):
+        """Forget the remembered answers that changing these groups could affect"""
+        for grp in lstGroups:
+            self.dicEffective_members.pop(grp, None)
+        self.dicEffective_groups.clear()
+        self.dicComponents = None
+
+    def set_group(self, group: str, users=(), groups=()):
+        """
+        Add a group, or replace the direct members of one, eg. after a member was added or removed.
+        :param group: group name
+        :param users: users directly in the group
+        :param groups: groups directly in the group
+        """
+        setAffected = self.ancestors(group) | {group} if group in self else {group}
+        self._set_edges(group, users, groups)
+        self._forget(setAffected | self.ancestors(group))
+
+    def remove_group(self, group: str):
+        """
+        A group was deleted. It is also no longer a member of any other group.
+        """
+        if group not in self:
+            return
+        setAffected = self.ancestors(group) | {group}
+        self._set_edges(group, (), ())
+        for parent in self.dicParents.pop(group):
+            self.dicSubgroups[parent].discard(group)
+        del self.dicUsers[group]
+        del self.dicSubgroups[group]
+        self._forget(setAffected)
+
+    def ancestors(self, group: str) -> set:
+        """
+        :return: the groups this group is nested in, at any depth
+        """
+        setSeen = set()
+        lstTo_visit = list(self.dicParents.get(group, ()))
+        while lstTo_visit:
+            grp = lstTo_visit.pop()
+            if grp not in setSeen:
+                setSeen.add(grp)
+                lstTo_visit.extend(self.dicParents[grp])
+        return setSeen
+
+    def descendants(self, group: str) -> set:
+        """
+        :return: the groups nested in this group, at any depth
+        """
+        setSeen = set()
+        lstTo_visit = list(self.dicSubgroups.get(group, ()))
+        while lstTo_visit:
+            grp = lstTo_visit.pop()
+            if grp not in setSeen:
+                setSeen.add(grp)
+                lstTo_visit.extend(self.dicSubgroups[grp])
+        return setSeen
+
+    def _components(self) -> dict:
+        """
+        Find the loops (strongly connected components) with Tarjan's algorithm, without recursion
+        so very deep nesting can't hit Python's recursion limit.
+        :return: group: frozenset of the groups in its loop (just itself if it isn't in one)
+        """
+        if self.dicComponents is not None:
+            return self.dicComponents
+
+        dicComponents = {}
+        dicIndex = {}
+        dicLow = {}
+        lstStack = []
+        setOn_stack = set()
+        counter = 0
+        for start in self.dicUsers:
+            if start in dicIndex:
+                continue
+            lstWork = [(start, iter(self.dicSubgroups[start]))]
+            dicIndex[start] = dicLow[start] = counter
+            counter += 1
+            lstStack.append(start)
+            setOn_stack.add(start)
+            while lstWork:
+                grp, children = lstWork[-1]
+                for sub in children:
+                    if sub not in dicIndex:
+                        dicIndex[sub] = dicLow[sub] = counter
+                        counter += 1
+                        lstStack.append(sub)
+                        setOn_stack.add(sub)
+                        lstWork.append((sub, iter(self.dicSubgroups[sub])))
+                        break
+                    if sub in setOn_stack:
+                        dicLow[grp] = min(dicLow[grp], dicIndex[sub])
+                else:
+                    lstWork.pop()
+                    if lstWork:
+                        parent = lstWork[-1][0]
+                        dicLow[parent] = min(dicLow[parent], dicLow[grp])
+                    if dicLow[grp] == dicIndex[grp]:
+                        lstComponent = []
+                        while True:
+                            member = lstStack.pop()
+                            setOn_stack.discard(member)
+                            lstComponent.append(member)
+                            if member == grp:
+                                break
+                        component = frozenset(lstComponent)
+                        for member in lstComponent:
+                            dicComponents[member] = component
+        self.dicComponents = dicComponents
+        return dicComponents
+
+    def cycles(self) -> list:
+        """
+        :return: list of sets of groups that are (indirectly) members of themselves
+        """
+        setCycles = {component for grp, component in self._components().items()
+                     if len(component) > 1 or grp in self.dicSubgroups[grp]}
+        return [set(component) for component in setCycles]
+
+    def effective_members(self, group: str) -> frozenset:
+        """
+        :return: every user in the group, directly or through nested groups. Empty if there is no such group.
+        """
+        if group not in self:
+            return frozenset()
+        dicComponents = self._components()
+        lstTo_do = [group]
+        while lstTo_do:
+            grp = lstTo_do[-1]
+            if grp in self.dicEffective_members:
+                lstTo_do.pop()
+                continue
+            component = dicComponents[grp]
+            setSubgroups = {sub for member in component for sub in self.dicSubgroups[member] if sub not in component}
+            lstPending = [sub for sub in setSubgroups if sub not in self.dicEffective_members]
+            if lstPending:
+                # Work out the nested groups first. Loops are collapsed, so this always gets to the bottom.
+                lstTo_do.extend(lstPending)
+                continue
+            setMembers = set()
+            for member in component:
+                setMembers.update(self.dicUsers[member])
+            for sub in setSubgroups:
+                setMembers.update(self.dicEffective_members[sub])
+            setMembers = frozenset(setMembers)
+            for member in component:
+                self.dicEffective_members[member] = setMembers
+            lstTo_do.pop()
+        return self.dicEffective_members[group]
+
+    def effective_groups(self, username: str) -> frozenset:
+        """
+        :return: every group the user is in, directly or because a group they are in is nested in it
+        """
+        if username not in self.dicEffective_groups:
+            setGroups = set(self.dicUser_groups.get(username, ()))
+            for grp in list(setGroups):
+                setGroups.update(self.ancestors(grp))
+            self.dicEffective_groups[username] = frozenset(setGroups)
+        return self.dicEffective_groups[username]
+
+    def is_effective_member(self, username: str, group: str) -> bool:
+        return group in self.effective_groups(username)
+
+
+def container_of(dn: str) -> str:
+    """
+    The OU (or container) an object lives in, ie. its DN without the first part.
+    'CN=John Smith,OU=Students,DC=school,DC=net' -> 'OU=Students,DC=school,DC=net'
+    """
+    # Commas can be escaped inside a name, eg. 'CN=Smith\\, John,OU=...'
+    match = re.match(r'(?:[^,\\]|\\.)*,(.*)$', dn or '')
+    return match.group(1) if match else ''
+
+
+class DirectoryModel:
+    """
+    A snapshot of the users and groups in the domain, loaded once and then queried as often as you like.
+    Users are held as columns (one list or array per attribute, one entry per user), which is compact and lets
+    questions about every user be answered with NumPy instead of a loop. Dictionary indexes find users by
+    username, DN or OU without scanning.
+
+    Usage:
+        model = DirectoryModel.load(ad)     # ad is a connected SshSamba
+        model.has_user('jsmith')
+        model.members('Teachers')
+        model.query(disabled=True, in_group='Teachers')
+
+    The users and groups can also be refreshed separately, which is what the GUI does:
+        model.set_users(DirectoryModel.fetch_users(ad))
+        model.set_groups(DirectoryModel.fetch_groups(ad))
+    """
+    def __init__(self):
+        # User columns
+        self.usernames = []
+        self.given_names = []
+        self.surnames = []
+        self.dns = []
+        self.ous = []
+        self.dicDecoded = decode_user_columns({})  # see decode_user_columns
+
+        # User indexes. AD names and DNs are case insensitive, so these are keyed by the casefolded versions.
+        self.dicUser_rows = {}  # username: row
+        self.dicDn_rows = {}    # DN: row
+        self.dicOu_rows = {}    # OU/container DN: [row, row]
+
+        # Groups
+        self.dicGroups = {}       # group name: (member, member)
+        self.dicGroup_names = {}  # casefolded group name: group name
+        self.dicMember_counts = {}  # group name: number of members, for groups we only have some of the members of
+        self.dicMember_offsets = {}  # group name: where the next page of members starts on the server, for those groups
+        self._membership = MembershipMatrix()
+        self.nesting = GroupGraph()
+
+        self.dicFlag_names = {}  # userAccountControl: string of flag names, so each is only worked out once
+
+    # =========================     Loading     =========================
+    @staticmethod
+    def fetch_users(ad) -> dict:
+        """
+        Get the user columns from the server. Slow (it's the network), so call it in the background.
+        :param ad: a connected SshSamba
+        :return: columns for set_users
+        """
+        try:
+            return ad.get_user_columns()
+        except SambaException:
+            # No ldbsearch on this DC. Fall back to samba-tool and turn the users into columns ourselves.
+            lstUsers = ad.get_users()
+            return {
+                'sAMAccountName': [usr.username for usr in lstUsers],
+                'givenName': [usr.given_name for usr in lstUsers],
+                'sn': [usr.surname for usr in lstUsers],
+                'userAccountControl': [str(usr.user_account_control or 0) for usr in lstUsers],
+                'dn': [usr.dic_full_info.get('dn') for usr in lstUsers],
+            }
+
+    @staticmethod
+    def fetch_groups(ad, max_members: int = None) -> tuple:
+        """
+        Get the groups and their members from the server.
+        :param ad: a connected SshSamba
+        :param max_members: only get the first max_members members of bigger groups (see SshSamba.get_groups)
+        :return: (groups, member counts, member offsets) for set_groups. The counts and offsets are None if every
+                 member was fetched.
+        """
+        if max_members is None:
+            return ad.get_groups(), None, None
+        dicCounts = ad.get_group_member_counts()
+        dicGroups = ad.get_groups(max_members=max_members, member_counts=dicCounts)
+        # The big groups came with the first max_members of their members on the server, less any built-in ones
+        dicOffsets = {grp: max_members for grp, count in dicCounts.items() if count > max_members}
+        return dicGroups, dicCounts, dicOffsets
+
+    @staticmethod
+    def fetch_nesting(ad) -> dict:
+        """
+        Get every group's direct members, split into users and groups, from the server.
+        :param ad: a connected SshSamba
+        :return: nesting for set_nesting
+        """
+        return ad.get_group_nesting()
+
+    @classmethod
+    def load(cls, ad):
+        """
+        Make a model of the whole directory, in one go.
+        :param ad: a connected SshSamba
+        """
+        model = cls()
+        model.set_users(cls.fetch_users(ad))
+        model.set_groups(*cls.fetch_groups(ad))
+        model.set_nesting(cls.fetch_nesting(ad))
+        return model
+
+    def set_users(self, dicColumns: dict):
+        """
+        Replace the users with a new snapshot and rebuild the user indexes.
+        :param dicColumns: attribute: [value for each user], eg. from SshSamba.get_user_columns
+        """
+        no_of_users = len(dicColumns['sAMAccountName'])
+
+        def column(attribute):
+            values = dicColumns.get(attribute)
+            if values is None:
+                return [''] * no_of_users
+            return [value or '' for value in values]
+
+        self.usernames = list(dicColumns['sAMAccountName'])
+        self.given_names = column('givenName')
+        self.surnames = column('sn')
+        self.dns = column('dn')
+        self.ous = [container_of(dn) for dn in self.dns]
+        self.dicDecoded = decode_user_columns({attribute: dicColumns[attribute] for attribute in
+                                               ('userAccountControl',) + User.timestamp_attributes
+                                               if attribute in dicColumns})
+
+        self.dicUser_rows = {username.casefold(): row for row, username in enumerate(self.usernames)}
+        self.dicDn_rows = {dn.casefold(): row for row, dn in enumerate(self.dns) if dn}
+        self.dicOu_rows = {}
+        for row, ou in enumerate(self.ous):
+            self.dicOu_rows.setdefault(ou.casefold(), []).append(row)
+
+    def set_groups(self, dicGroups: dict, member_counts: dict = None, member_offsets: dict = None):
+        """
+        Replace the groups with a new snapshot.
+        :param dicGroups: group name: [member, member], eg. from SshSamba.get_groups
+        :param member_counts: group name: number of members, if some groups only came with some of their members
+        :param member_offsets: group name: where the next page of members starts on the server
+                               (see SshSamba.iter_group_members), for those groups
+        """
+        dicOld = self.dicGroups
+        self.dicGroups = {grp: tuple(members) for grp, members in dicGroups.items()}
+        self.dicGroup_names = {grp.casefold(): grp for grp in self.dicGroups}
+        self.dicMember_counts = {grp: count for grp, count in (member_counts or {}).items()
+                                 if grp in self.dicGroups and count > len(self.dicGroups[grp])
+                                 and (member_offsets is None or grp in member_offsets)}
+        self.dicMember_offsets = {grp: (member_offsets or {}).get(grp, len(self.dicGroups[grp]))
+                                  for grp in self.dicMember_counts}
+        self._membership = None
+
+        # Keep the nested group graph up to date with just the groups that changed
+        for grp in set(dicOld) - set(self.dicGroups):
+            self.nesting.remove_group(grp)
+        for grp, members in self.dicGroups.items():
+            if dicOld.get(grp) != members:
+                self._update_nesting(grp)
+
+    def set_group_members(self, group: str, members):
+        """
+        Replace the members of one group, eg. after fetching them again.
+        """
+        self.dicGroups[group] = tuple(members)
+        self.dicGroup_names[group.casefold()] = group
+        self.dicMember_counts.pop(group, None)
+        self.dicMember_offsets.pop(group, None)
+        self._membership = None
+        self._update_nesting(group)
+
+    def _update_nesting(self, group: str):
+        """
+        A group's members changed (eg. members were added or removed, and the group fetched again).
+        Update it in the nested group graph, if there is one. Only groups we have all the members of:
+        the graph already has all of the members of the others, from get_group_nesting.
+        """
+        if not self.nesting.groups() or group in self.dicMember_counts:
+            return
+        members = self.dicGroups[group]
+        self.nesting.set_group(group, users=[mem for mem in members if not self.has_group(mem)],
+                               groups=[mem for mem in members if self.has_group(mem)])
+
+    def add_member_page(self, group: str, members, next_start: int = None):
+        """
+        Add a page of members (see SshSamba.iter_group_members) to a group we only have some of the members of.
+        :param next_start: where the next page starts on the server, or None if that was the last page
+        """
+        setKnown = set(self.dicGroups[group])
+        self.dicGroups[group] += tuple(mem for mem in members if mem not in setKnown)
+        if next_start is None:
+            self.dicMember_counts.pop(group, None)
+            self.dicMember_offsets.pop(group, None)
+        else:
+            self.dicMember_offsets[group] = next_start
+        self._membership = None
+
+    @property
+    def membership(self) -> MembershipMatrix:
+        """The membership matrix of the groups, rebuilt on first use after they change"""
+        if self._membership is None:
+            self._membership = MembershipMatrix(self.dicGroups)
+        return self._membership
+
+    def set_nesting(self, dicNesting: dict):
+        """
+        Replace the nested group graph.
+        :param dicNesting: group name: {'users': [...], 'groups': [...]}, eg. from SshSamba.get_group_nesting
+        """
+        self.nesting = GroupGraph(dicNesting)
+
+    # =========================     Users     =========================
+    def __len__(self):
+        return len(self.usernames)
+
+    def has_user(self, username: str) -> bool:
+        return username.casefold() in self.dicUser_rows
+
+    def user_row(self, username: str) -> int:
+        """
+        :return: the user's row in the columns
+        Raises KeyError if there is no such user
+        """
+        return self.dicUser_rows[username.casefold()]
+
+    def user(self, username: str) -> User:
+        """
+        Make a (lightweight) User object for one user.
+        Raises KeyError if there is no such user
+        """
+        return self._user_from_row(self.user_row(username))
+
+    def users(self):
+        """
+        Every user as a (lightweight) User object
+        """
+        return (self._user_from_row(row) for row in range(len(self.usernames)))
+
+    def _user_from_row(self, row: int) -> User:
+        usr = User()
+        usr.username = self.usernames[row]
+        usr.given_name = self.given_names[row]
+        usr.surname = self.surnames[row]
+        usr.ou = self.ous[row]
+        usr.flags = []
+        usr._user_account_control = int(self.dicDecoded['userAccountControl'][row])
+        return usr
+
+    def user_by_dn(self, dn: str) -> str:
+        """
+        :return: the username of the user with this distinguished name, or None
+        """
+        row = self.dicDn_rows.get(dn.casefold())
+        return self.usernames[row] if row is not None else None
+
+    def users_in_ou(self, ou: str) -> list:
+        """
+        :param ou: the DN of the OU or container, eg. 'OU=Students,DC=school,DC=net' or 'CN=Users,DC=school,DC=net'
+        :return: list of usernames directly in it
+        """
+        return [self.usernames[row] for row in self.dicOu_rows.get(ou.casefold(), [])]
+
+    def organizational_units(self) -> list:
+        """
+        :return: the OUs and containers that have users in them
+        """
+        return sorted({self.ous[rows[0]] for rows in self.dicOu_rows.values()})
+
+    def flag_names(self, username: str) -> str:
+        """
+        The user's flags as text, the way the GUI shows them, eg. "['NORMAL_ACCOUNT']"
+        """
+        user_account_control = int(self.dicDecoded['userAccountControl'][self.user_row(username)])
+        if user_account_control not in self.dicFlag_names:
+            self.dicFlag_names[user_account_control] = str(User.parse_user_flags(user_account_control))
+        return self.dicFlag_names[user_account_control]
+
+    def is_disabled(self, username: str) -> bool:
+        return bool(self.dicDecoded['disabled'][self.user_row(username)])
+
+    # =========================     Groups     =========================
+    def has_group(self, group: str) -> bool:
+        return group.casefold() in self.dicGroup_names
+
+    def groups(self) -> list:
+        return list(self.dicGroups)
+
+    def members(self, group: str) -> tuple:
+        """
+        :return: the (direct) members of the group
+        Raises KeyError if there is no such group
+        """
+        return self.dicGroups[self.dicGroup_names[group.casefold()]]
+
+    def member_count(self, group: str) -> int:
+        """
+        :return: how many members the group has, including any we haven't fetched
+        """
+        group = self.dicGroup_names[group.casefold()]
+        return self.dicMember_counts.get(group, len(self.dicGroups[group]))
+
+    def is_complete(self, group: str) -> bool:
+        """
+        :return: whether we have all of the group's members
+        """
+        return self.dicGroup_names[group.casefold()] not in self.dicMember_counts
+
+    def member_offset(self, group: str) -> int:
+        """
+        :return: where the next page of the group's members starts on the server (see SshSamba.iter_group_members).
+                 Not the same as how many members we have, as built-in and unknown members are left out of pages.
+        """
+        group = self.dicGroup_names[group.casefold()]
+        return self.dicMember_offsets.get(group, len(self.dicGroups[group]))
+
+    def members_not_loaded(self, group: str) -> int:
+        """
+        :return: how many of the group's members (on the server) haven't been fetched yet
+        """
+        if self.is_complete(group):
+            return 0
+        return max(0, self.member_count(group) - self.member_offset(group))
+
+    def groups_of(self, username: str) -> list:
+        """
+        :return: the groups the user is (directly) a member of
+        """
+        if self.has_user(username):
+            username = self.usernames[self.user_row(username)]
+        return self.membership.groups_of(username)
+
+    def effective_members(self, group: str) -> frozenset:
+        """
+        :return: every user in the group, directly or through nested groups (needs set_nesting)
+        """
+        return self.nesting.effective_members(group)
+
+    def effective_groups(self, username: str) -> frozenset:
+        """
+        :return: every group the user is in, directly or through nested groups (needs set_nesting)
+        """
+        return self.nesting.effective_groups(username)
+
+    # =========================     Queries     =========================
+    def query(self, disabled: bool = None, locked: bool = None, expired: bool = None,
+              ou: str = None, in_group: str = None) -> list:
+        """
+        Find users matching all of the conditions given. Leave a condition out (None) to not care about it.
+        eg. the disabled users still in a group: model.query(disabled=True, in_group='Teachers')
+        :param disabled: account disabled or not
+        :param locked: locked out or not (see decode_user_columns)
+        :param expired: account expired or not
+        :param ou: directly in this OU/container (DN)
+        :param in_group: direct member of this group
+        :return: list of usernames, in model order
+        """
+        mask = np.ones(len(self.usernames), dtype=bool)
+        for wanted, column in ((disabled, 'disabled'), (locked, 'locked'), (expired, 'expired')):
+            if wanted is not None:
+                mask &= self.dicDecoded[column] == wanted
+        if ou is not None:
+            in_ou = np.zeros(len(self.usernames), dtype=bool)
+            in_ou[self.dicOu_rows.get(ou.casefold(), [])] = True
+            mask &= in_ou
+        if in_group is not None:
+            in_grp = np.zeros(len(self.usernames), dtype=bool)
+            rows = [self.dicUser_rows[mem.casefold()] for mem in self.members(in_group) if mem.casefold() in self.dicUser_rows]
+            in_grp[rows] = True
+            mask &= in_grp
+        return [self.usernames[row] for row in np.flatnonzero(mask)]
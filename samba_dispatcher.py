@@ -0,0 +1,269 @@
+"""
+Run many samba-tool commands in one long-lived Python process on the domain controller.
+
+samba-tool is a Python program, so every call starts an interpreter and imports the Samba libraries again
+before doing anything, which is hundreds of ms a go. The worker here imports samba-tool's commands once and then
+runs one command after another, each exactly as 'samba-tool <command>' would, with its output captured separately.
+
+Talking to the worker, one JSON object per line:
+    -> {"id": 1, "argv": ["user", "show", "bob"]}
+    <- {"id": 1, "status": 0, "stdout": "...", "stderr": "..."}
+The first line from the worker says whether it managed to import samba-tool:
+    <- {"ready": true}   or   {"ready": false, "error": "..."}
+
+Requests can be sent back-to-back without waiting for each reply (see run_many); the replies come back in order.
+
+Used by SshSamba.start_dispatcher. Needs nothing installed on the DC: the worker is sent on the command line.
+"""
+
+import itertools
+import json
+import shlex
+import threading
+
+from samba_transport import Transport
+
+# Runs on the domain controller with the same Python as samba-tool. Kept to the standard library.
+WORKER_SOURCE = r'''
+import json
+import os
+import sys
+import tempfile
+import traceback
+
+
+def load_samba_tool(tool_path):
+    # samba-tool puts where Samba was installed (eg. /usr/local/samba/lib/python3/site-packages) on sys.path
+    # before importing anything, so do the same
+    try:
+        with open(tool_path) as fp:
+            for line in fp:
+                if line.startswith('sys.path.insert'):
+                    exec(line)
+    except OSError:
+        pass
+    try:
+        from samba.netcmd.main import samba_tool
+    except ImportError:
+        # Samba before 4.18
+        from samba.netcmd.main import cmd_sambatool
+
+        def samba_tool(*args):
+            return cmd_sambatool()._run('samba-tool', *args)
+    return samba_tool
+
+
+def run(samba_tool, argv):
+    # samba-tool's commands keep hold of sys.stdout and sys.stderr from when they were imported, and some of
+    # Samba writes straight to the file descriptors, so it's the file descriptors that are pointed at the files
+    with tempfile.TemporaryFile() as fpOut, tempfile.TemporaryFile() as fpErr:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_out, saved_err = os.dup(1), os.dup(2)
+        os.dup2(fpOut.fileno(), 1)
+        os.dup2(fpErr.fileno(), 2)
+        try:
+            status = samba_tool(*argv)
+        except SystemExit as e:
+            status = e.code
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_out, 1)
+            os.dup2(saved_err, 2)
+            os.close(saved_out)
+            os.close(saved_err)
+        fpOut.seek(0)
+        fpErr.seek(0)
+        out = fpOut.read().decode('utf-8', errors='replace')
+        err = fpErr.read().decode('utf-8', errors='replace')
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        status = 1
+    return status, out, err
+
+
+def main():
+    # Requests and replies have stdin and stdout to themselves. samba-tool gets /dev/null to read from
+    # (eg. if it asks for a password) so it can't eat the requests.
+    fpRequests = os.fdopen(os.dup(0), 'r', encoding='utf-8')
+    fpReplies = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    def reply(dicReply):
+        fpReplies.write(json.dumps(dicReply) + '\n')
+        fpReplies.flush()
+
+    try:
+        samba_tool = load_samba_tool(sys.argv[1])
+    except Exception as e:
+        reply({'ready': False, 'error': repr(e)})
+        return
+    reply({'ready': True})
+
+    for line in fpRequests:
+        dicRequest = json.loads(line)
+        status, out, err = run(samba_tool, dicRequest['argv'])
+        reply({'id': dicRequest['id'], 'status': status, 'stdout': out, 'stderr': err})
+
+
+main()
+'''
+
+
+def command_argv(cmd: str) -> list:
+    """
+    Split a samba_command command line into arguments, the way the shell would.
+    :param cmd: the stuff that comes after typing 'samba-tool'
+    :return: list of arguments, or None if the command needs a real shell (pipes, variables, etc.)
+    """
+    if any(char in cmd for char in '$`'):
+        return None
+    lexer = shlex.shlex(cmd, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        argv = list(lexer)
+    except ValueError:
+        # eg. unbalanced quotes. Let the shell complain about it the usual way.
+        return None
+    if any(arg and all(char in '();<>|&' for char in arg) for arg in argv):
+        return None
+    return argv
+
+
+class SambaToolDispatcher:
+    """
+    Client end of the worker. One command at a time; safe to share between threads.
+    """
+    def __init__(self, transport: Transport, samba_tool: str = 'samba-tool'):
+        """
+        :param transport: how to get to the DC (see samba_transport)
+        :param samba_tool: the samba-tool to take the Python and the Samba libraries from
+        """
+        self.transport = transport
+        self.samba_tool = samba_tool
+        self.channel = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker on the DC, with the Python that samba-tool uses (from its #! line).
+        Silence = success. Raises RuntimeError if the worker couldn't import samba-tool,
+        ConnectionError if it didn't start at all.
+        """
+        cmd = (f'tool=$(command -v {shlex.quote(self.samba_tool)}) && '
+               f'py=$(sed -n "1s/^#!//p" "$tool") && '
+               f'exec ${{py:-python3}} -c {shlex.quote(WORKER_SOURCE)} "$tool" 2>/dev/null')
+        self.channel = self.transport.open(cmd)
+        try:
+            dicHello = json.loads(self.channel.read_line())
+        except (ConnectionError, ValueError) as e:
+            self.close()
+            raise ConnectionError(f"The samba-tool worker didn't start: {e}")
+        if not dicHello.get('ready'):
+            self.close()
+            raise RuntimeError(f"The samba-tool worker couldn't load samba-tool: {dicHello.get('error')}")
+
+    def run(self, argv: list) -> tuple:
+        """
+        Run one samba-tool command in the worker.
+        :param argv: the arguments that come after 'samba-tool'
+        :return: (exit status, stdout, stderr) - the output as strings
+        Raises ConnectionError if the worker has stopped. It might have been part way through the command.
+        """
+        with self._lock:
+            if self.channel is None:
+                raise ConnectionError("The samba-tool worker isn't running.")
+            request_id = next(self._ids)
+            try:
+                self.channel.write_line(json.dumps({'id': request_id, 'argv': list(argv)}))
+            except OSError as e:
+                self._close()
+                raise ConnectionError(f"The samba-tool worker stopped: {e}")
+            dicReply = self._read_reply(request_id)
+        return dicReply['status'], dicReply['stdout'], dicReply['stderr']
+
+    def run_many(self, lstArgv: list):
+        """
+        Run many samba-tool commands in the worker, in order. They are all sent straight away rather than each
+        waiting for the one before to finish, so over a slow link there's only one round trip to wait for.
+        Stopping early still waits for (and throws away) the replies to the commands already sent, as they will run
+        anyway, so the worker is ready for the next command.
+        :param lstArgv: list of the arguments that come after 'samba-tool', one list for each command
+        :return: generator of (exit status, stdout, stderr), in order, as soon as each is finished.
+                 Raises ConnectionError if the worker stops.
+        """
+        with self._lock:
+            if self.channel is None:
+                raise ConnectionError("The samba-tool worker isn't running.")
+            channel = self.channel
+            lstIds = [next(self._ids) for _ in lstArgv]
+
+            def send():
+                # From another thread, so that a lot of output coming back can't hold up sending the commands
+                try:
+                    for request_id, argv in zip(lstIds, lstArgv):
+                        channel.write_line(json.dumps({'id': request_id, 'argv': list(argv)}))
+                except OSError:
+                    pass  # Reading will find out
+
+            sender = threading.Thread(target=send, daemon=True)
+            sender.start()
+            received = 0
+            last = None
+            try:
+                for request_id in lstIds:
+                    dicReply = self._read_reply(request_id)
+                    received += 1
+                    if received == len(lstIds):
+                        # Handed over once the lock is let go, in case whoever is reading doesn't ask for more
+                        # (eg. zip) and leaves this generator waiting here
+                        last = dicReply['status'], dicReply['stdout'], dicReply['stderr']
+                    else:
+                        yield dicReply['status'], dicReply['stdout'], dicReply['stderr']
+            finally:
+                try:
+                    for request_id in lstIds[received:]:
+                        if self.channel is None:
+                            break
+                        self._read_reply(request_id)
+                except ConnectionError:
+                    pass
+                sender.join()
+        if last is not None:
+            yield last
+
+    def _read_reply(self, request_id: int) -> dict:
+        try:
+            dicReply = json.loads(self.channel.read_line())
+        except (OSError, ValueError) as e:
+            # ConnectionError is an OSError
+            self._close()
+            raise ConnectionError(f"The samba-tool worker stopped: {e}")
+        if dicReply.get('id') != request_id:
+            # Out of step, so nothing more it says can be trusted
+            self._close()
+            raise ConnectionError(f"The samba-tool worker answered request {dicReply.get('id')}, not {request_id}")
+        return dicReply
+
+    def is_running(self) -> bool:
+        return self.channel is not None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self.channel is not None:
+            channel, self.channel = self.channel, None
+            try:
+                channel.close()
+            except OSError:
+                pass
@@ -1,15 +1,20 @@
+import csv
 import functools
+import hashlib
+import itertools
 import os
-import yaml
+import queue
+from concurrent.futures import Future
 from time import sleep
-import multiprocessing
 import threading
 
 import wx
 from wx.lib.newevent import NewEvent
 
+from ssh_samba import JobJournal
 from ssh_samba import SshSamba
 from ssh_samba import User
+from ssh_samba import read_user_csv
 
 
 # =========================================================================
@@ -28,7 +33,23 @@ def get_selected_rows(listCtrl: wx.ListCtrl) -> list:
 
     return selection
 
+
+def diff_snapshot(dicOld: dict, dicNew: dict) -> tuple[list, list, list]:
+    """
+    Compare what is displayed with a fresh snapshot from the model, so we only touch the widgets that need it.
+    Both dictionaries must be keyed by something unique, eg. username or group name.
+    :param dicOld: what is currently on the screen
+    :param dicNew: what the model just gave us
+    :return: lists of keys that were added, removed and changed (in the order of dicNew where it makes sense)
+    """
+    added = [key for key in dicNew if key not in dicOld]
+    removed = [key for key in dicOld if key not in dicNew]
+    changed = [key for key in dicNew if key in dicOld and dicOld[key] != dicNew[key]]
+    return added, removed, changed
+
 background_return = None  # Return value for threads running in the background
+GROUP_PAGE_SIZE = 1000  # Members of big groups are fetched and shown this many at a time
+IMPORT_CHUNK_SIZE = 50  # Users sent to the server at a time when importing a CSV, between progress bar updates
 # =========================================================================
 # =========================     Custom events     =========================
 # =========================================================================
@@ -80,6 +101,240 @@ def loading_window(function):
         return function_result
     return wrapped
 
+# ============================================================================
+# ======================     Refresh scheduler     ===========================
+# ============================================================================
+class RefreshScheduler:
+    """
+    Collects refresh requests for each panel of a window and runs at most one reload per panel.
+    Requests that arrive within delay_ms of each other are coalesced, so a burst of button clicks
+    or events costs one trip to the server per panel instead of one per click.
+    If a panel is asked for again while its reload is still in flight, that reload is stale,
+    so the panel is reloaded once more after it finishes rather than running two at the same time.
+    """
+    def __init__(self, frame: wx.Window, dicRefreshers: dict, delay_ms: int = 250):
+        """
+        :param frame: the window owning the panels. Nothing runs once it has been destroyed.
+        :param dicRefreshers: panel name: function that reloads it. Panels are reloaded in this order.
+        :param delay_ms: how long to wait for things to go quiet before reloading
+        """
+        self.frame = frame
+        self.dicRefreshers = dicRefreshers
+        self.delay_ms = delay_ms
+        self.setPending = set()
+        self.setRunning = set()
+        self.timer = None
+
+    def request(self, *panels):
+        """
+        Ask for one or more panels to be reloaded soon.
+        Every request restarts the countdown, so the reload happens once the burst is over.
+        """
+        for panel in panels:
+            if panel not in self.dicRefreshers:
+                raise KeyError(f"No such panel to refresh: {panel}")
+        self.setPending.update(panels)
+        if self.timer and self.timer.IsRunning():
+            self.timer.Start(self.delay_ms)
+        else:
+            self.timer = wx.CallLater(self.delay_ms, self.run)
+
+    def run(self):
+        """
+        Reload every panel that has been asked for and is not already reloading.
+        """
+        if not self.frame:
+            # Window has been closed in the meantime
+            return
+        for panel, refresher in self.dicRefreshers.items():
+            if panel not in self.setPending or panel in self.setRunning:
+                continue
+            self.setPending.discard(panel)
+            self.setRunning.add(panel)
+            try:
+                refresher()
+            finally:
+                self.setRunning.discard(panel)
+
+        # Anything asked for while we were busy gets its own (single) reload
+        if self.setPending and not (self.timer and self.timer.IsRunning()):
+            self.timer = wx.CallLater(self.delay_ms, self.run)
+
+
+# ============================================================================
+# ======================     Prefetcher     ==================================
+# ============================================================================
+class Prefetcher:
+    """
+    Fetches things from the server in the background, before anyone asks for them.
+    Jobs are identified by a key, eg. 'users' or ('user', 'jsmith'). A key that is already fetched or being
+    fetched is not fetched again, and whoever asks for it gets the same result rather than a second trip
+    to the server. Jobs run in priority order on a couple of daemon threads, so speculative jobs (hovering over
+    a user, expanding a group) never hold up the warm-up of what the window needs first.
+    """
+    PRIORITY_HIGH = 0   # the first directory fetch at startup
+    PRIORITY_NORMAL = 5  # the admin is waiting for it
+    PRIORITY_LOW = 10   # speculative
+
+    def __init__(self, no_of_threads: int = 2):
+        self.queJobs = queue.PriorityQueue()
+        self.dicFutures = {}  # key: concurrent.futures.Future
+        self.lock = threading.Lock()
+        self.counter = itertools.count()  # keeps jobs of the same priority in the order they were asked for
+        for _ in range(no_of_threads):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self):
+        while True:
+            priority, _, key, function, future = self.queJobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function())
+            except Exception as e:
+                future.set_exception(e)
+
+    def request(self, key, function, priority=PRIORITY_LOW, callback=None, keep=True) -> Future:
+        """
+        Start fetching something in the background unless it is already fetched or on its way.
+        :param key: anything hashable to identify the job
+        :param function: called with no arguments on a background thread to do the fetching
+        :param priority: lower numbers run first
+        :param callback: optional, called in the GUI thread with the result once it arrives
+        :param keep:    False to forget the result as soon as it arrives, eg. because the function caches it itself.
+                        Asking again while it is on its way still doesn't fetch it twice.
+        :return: the future holding the result
+        """
+        with self.lock:
+            future = self.dicFutures.get(key)
+            if future is None or future.cancelled():
+                future = Future()
+                self.dicFutures[key] = future
+                self.queJobs.put((priority, next(self.counter), key, function, future))
+                if not keep:
+                    future.add_done_callback(functools.partial(self._discard, key))
+        if callback:
+            future.add_done_callback(functools.partial(self._callback, callback))
+        return future
+
+    def _discard(self, key, future):
+        with self.lock:
+            if self.dicFutures.get(key) is future:
+                del self.dicFutures[key]
+
+    @staticmethod
+    def _callback(callback, future):
+        # Speculative work failing is not worth bothering the admin about, so only pass on successes
+        if not future.cancelled() and future.exception() is None:
+            wx.CallAfter(callback, future.result())
+
+    def peek(self, key):
+        """
+        :return: the result if it has already arrived, otherwise None. Never waits.
+        """
+        future = self.dicFutures.get(key)
+        if future is not None and future.done() and not future.cancelled() and not future.exception():
+            return future.result()
+        return None
+
+    def take(self, key, function):
+        """
+        Get something, using the prefetched result (or the fetch in flight) if there is one, and forget it,
+        so the next take goes back to the server.
+        Blocks until the result arrives, so call it from a background thread (eg. the bg_ functions).
+        :param function: used to fetch it here and now if nobody has started fetching it yet
+        """
+        with self.lock:
+            future = self.dicFutures.pop(key, None)
+        if future is not None and future.cancel():
+            # Queued but not started yet, so it is quicker to just do it ourselves
+            future = None
+        if future is None:
+            return function()
+        return future.result()
+
+    def forget(self, *keys):
+        """
+        Throw away prefetched results that have gone stale, eg. after changing a user
+        """
+        with self.lock:
+            for key in keys:
+                future = self.dicFutures.pop(key, None)
+                if future is not None:
+                    future.cancel()
+
+
+# ============================================================================
+# ======================     Custom widgets     ==============================
+# ============================================================================
+class UserListCtrl(wx.ListCtrl):
+    """
+    A virtual list of users. The control only asks for the text of the rows on the screen,
+    so it stays responsive with 100k users and can be filtered by swapping the list of rows it shows.
+    Rows are tracked by username, so the selection and scroll position survive refreshes and filtering.
+    """
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL)
+        self.dicRows = {}       # username: (username, given name, surname, flags)
+        self.lstOrder = []      # every username, in the order they arrived
+        self.lstRows = []       # the usernames on show, in row order
+        self.setFilter = None   # usernames to show, or None to show them all
+
+    def OnGetItemText(self, item, column):
+        return self.dicRows[self.lstRows[item]][column]
+
+    def get_selected_usernames(self) -> list:
+        return [self.lstRows[row] for row in get_selected_rows(self)]
+
+    def update_rows(self, dicRows: dict, added: list, removed: list):
+        """
+        Take a new snapshot of the rows. New users go on the end, the rest keep their place.
+        :param dicRows: username: (username, given name, surname, flags) for every user
+        :param added: usernames that are new since the last snapshot
+        :param removed: usernames that have gone since the last snapshot
+        """
+        if removed:
+            setRemoved = set(removed)
+            self.lstOrder = [username for username in self.lstOrder if username not in setRemoved]
+        self.lstOrder.extend(added)
+        self.dicRows = dicRows
+        self.show_rows()
+
+    def set_filter(self, setFilter):
+        """
+        Only show these usernames. None shows everyone.
+        """
+        self.setFilter = setFilter
+        self.show_rows()
+
+    def show_rows(self):
+        """
+        Work out which rows are on show, then put the selection and scroll position back where they were.
+        """
+        lstSelected = self.get_selected_usernames()
+        for row in get_selected_rows(self):
+            self.Select(row, False)
+        top_row = self.GetTopItem()
+        top_username = self.lstRows[top_row] if 0 <= top_row < len(self.lstRows) else None
+
+        if self.setFilter is None:
+            self.lstRows = list(self.lstOrder)
+        else:
+            self.lstRows = [username for username in self.lstOrder if username in self.setFilter]
+        self.SetItemCount(len(self.lstRows))
+
+        if lstSelected or top_username:
+            dicPositions = {username: row for row, username in enumerate(self.lstRows)}
+            for username in lstSelected:
+                if username in dicPositions:
+                    self.Select(dicPositions[username])
+            if top_username in dicPositions and dicPositions[top_username] != top_row:
+                row = dicPositions[top_username]
+                self.EnsureVisible(min(row + self.GetCountPerPage() - 1, len(self.lstRows) - 1))
+                self.EnsureVisible(row)
+        self.Refresh()
+
+
 # ============================================================================
 # ======================     Main Application Class     ======================
 # ============================================================================
@@ -92,6 +347,12 @@ class AppMain(wx.App):
 
         # Initialise model
         self.ad = SshSamba()  # This will be the ssh_samba model
+        self.ad.parse_processes = None  # Parse big dumps on every core (fine here: see the end of this file)
+        self.prefetch = Prefetcher()  # Gets things from the model before the windows ask for them
+        # The main window's DirectoryModel and search indexes (users, groups). Made by warm_up.
+        self.model = None
+        self.indexUsers = None
+        self.indexGroups = None
 
         # Initialise preferences dictionary
         self.dicPrefs = {
@@ -101,15 +362,17 @@ class AppMain(wx.App):
         }
         self.read_preferences_file()
 
-        # Connect automatically if stated in prefs
-        if self.connect_automatically():
+        self.Bind(EVT_CONNECTION_MADE, self.on_thread_connection_made)
+
+        # Connect automatically if stated in prefs.
+        # The SSH handshake and the first fetch happen in the background while the main window appears.
+        if self.dicPrefs['Connect automatically']:
             self.show_main_window()
+            threading.Thread(target=self.bg_connect_automatically, daemon=True).start()
             return True
 
         # Show startup window if not
-        self.frStartup = FrStartup(self)
-        self.Bind(EVT_CONNECTION_MADE, self.show_main_window)
-        self.frStartup.Show(True)
+        self.show_startup_window()
         return True
 
     def read_preferences_file(self):
@@ -117,6 +380,7 @@ class AppMain(wx.App):
         Get the preferences from file into self.dicPrefs
         """
         if os.path.exists(self.fpPreferences):
+            import yaml
             with open(self.fpPreferences, 'r') as file:
                 self.dicPrefs = yaml.full_load(file)
         if not 'IP Address' in self.dicPrefs:
@@ -136,6 +400,7 @@ class AppMain(wx.App):
         if not os.access(folder, os.W_OK):
             raise PermissionError(f"Trying to save preferences but cannot write to folder {os.path.basename(folder)}")
 
+        import yaml
         with open(self.fpPreferences, 'w') as file:
             yaml.dump(self.dicPrefs, file)
 
@@ -157,6 +422,55 @@ class AppMain(wx.App):
         except:
             return False
 
+    def bg_connect_automatically(self):
+        """
+        Run in a background thread at startup: connect, start warming up, then tell the GUI how it went.
+        """
+        connected = self.connect_automatically()
+        if connected:
+            self.warm_up()
+        wx.PostEvent(self, EvtConnectionMade(connected=connected))
+
+    def warm_up(self):
+        """
+        Start fetching everything the main window shows first, as soon as we are connected.
+        The main window's bg_get functions pick these up (waiting for them if they are still on their way).
+        """
+        # samba_directory brings in numpy, which is slow to import, so it is left until now (in the background,
+        # while we wait for the server) rather than holding up the startup window
+        from samba_directory import DirectoryModel, SearchIndex
+        if self.model is None:
+            # The main window picks these up once it has something to show (see FrMainwindow.populate_gui)
+            self.model = DirectoryModel()
+            self.indexUsers = SearchIndex()  # username, given name and surname
+            self.indexGroups = SearchIndex()  # group names
+        self.prefetch.request('users', functools.partial(DirectoryModel.fetch_users, self.ad), Prefetcher.PRIORITY_HIGH)
+        self.prefetch.request('groups', functools.partial(DirectoryModel.fetch_groups, self.ad, max_members=GROUP_PAGE_SIZE),
+                              Prefetcher.PRIORITY_HIGH)
+        self.prefetch.request('domain name', self.ad.get_domain_long, Prefetcher.PRIORITY_HIGH)
+        self.prefetch.request('domain', self.ad.get_domain, Prefetcher.PRIORITY_HIGH)
+        self.prefetch.request('password policy', self.ad.get_password_policy, Prefetcher.PRIORITY_HIGH)
+
+    def on_thread_connection_made(self, event):
+        """
+        A connection has been made (or failed to be made) by the startup window or in the background.
+        """
+        if not getattr(event, 'connected', True):
+            # Couldn't connect automatically, so ask the admin
+            if getattr(self, 'frMain', None):
+                self.frMain.Destroy()
+                self.frMain = None
+            self.show_startup_window()
+            return
+        if getattr(self, 'frMain', None):
+            self.frMain.on_thread_connection_made()
+        else:
+            self.show_main_window()
+
+    def show_startup_window(self):
+        self.frStartup = FrStartup(self)
+        self.frStartup.Show(True)
+
     def show_main_window(self, event=None):
         self.frMain = FrMainwindow(self)
         self.frMain.Show(True)
@@ -311,7 +625,8 @@ class FrStartup(wx.Frame):
         self.app.dicPrefs['Connect automatically'] = self.chkAuto.GetValue()
         self.app.write_preferences_file()
         self.app.ad.connect_to_server()
-        wx.PostEvent(self.app, EvtConnectionMade())
+        self.app.warm_up()
+        wx.PostEvent(self.app, EvtConnectionMade(connected=True))
         self.Destroy()
 
     def populate(self):
@@ -332,10 +647,22 @@ class FrMainwindow(wx.Frame):
 
         # Bind frame to events to have events change the GUI
         self.Bind(EVT_THREAD, self.template_on_thread)
-        self.Bind(EVT_USERS_CHANGED, self.populate_users)
-
-        # Initalise GUI content
-        self.populate_gui()
+        self.Bind(EVT_USERS_CHANGED, self.on_thread_users_changed)
+
+        # All refreshes after the first go through here, so bursts of changes are reloaded once
+        self.refresh = RefreshScheduler(self, {
+            'users': self.populate_users,
+            'groups': self.populate_groups,
+            'domain': self.populate_domain,
+            'policy': self.populate_password_policy,
+        })
+
+        # Initalise GUI content, unless we are still connecting in the background
+        self.title = self.GetTitle()
+        if self.app.ad.is_connected():
+            self.populate_gui()
+        else:
+            self.SetTitle(f"{self.title} - connecting to {self.app.dicPrefs['IP Address']}...")
 
         # The secrete recipe to fit window to content
         self.panMaster.SetAutoLayout(True)
@@ -431,8 +758,10 @@ class FrMainwindow(wx.Frame):
             'Domain info 2': 'info',
             'Domain info 3': 'info',
         }
-        self.lst_txt_domain_info = [wx.StaticText(self.panMaster, label=x) for x in dic_domain_info.values()]
-        for txt in self.lst_txt_domain_info:
+        # Keyed by the domain info item, so populate_domain can relabel just the ones that changed
+        self.dicDomain_info = dic_domain_info
+        self.dic_txt_domain_info = {key: wx.StaticText(self.panMaster, label=value) for key, value in dic_domain_info.items()}
+        for txt in self.dic_txt_domain_info.values():
             self.boxDomainSizer.Add(txt, 1, wx.ALL | wx.EXPAND, 1)
 
         self.sizerGrid.Add(self.boxDomainSizer, pos=(0, 0), span=(1, 1), flag=wx.ALL | wx.EXPAND, border=5)
@@ -458,9 +787,11 @@ class FrMainwindow(wx.Frame):
             'Policy 2': 'value',
             'Policy 3': 'value',
         }
-        self.lst_password_policy_boxes = [[wx.StaticText(self.panMaster, label=key), wx.TextCtrl(self.panMaster, value=value)] for key, value in dic_password_policy.items()]
+        # Keyed by the policy item, so populate_password_policy can update just the ones that changed
+        self.dicPassword_policy = dic_password_policy
+        self.dic_password_policy_boxes = {key: [wx.StaticText(self.panMaster, label=key), wx.TextCtrl(self.panMaster, value=value)] for key, value in dic_password_policy.items()}
         self.sizerPolicy = wx.FlexGridSizer(2, 1, 1)
-        for policy_item in self.lst_password_policy_boxes:
+        for policy_item in self.dic_password_policy_boxes.values():
             self.sizerPolicy.Add(policy_item[0], 0, wx.ALL, 1)
             self.sizerPolicy.Add(policy_item[1], 0, wx.ALL, 1)
         self.boxPolicySizer.Add(self.sizerPolicy, 0, wx.ALL, 5)
@@ -485,11 +816,28 @@ class FrMainwindow(wx.Frame):
         self.boxUsers = wx.StaticBox(self.panMaster, label="Users")
         self.boxUsersSizer = wx.StaticBoxSizer(self.boxUsers, wx.VERTICAL)
 
-        self.lstctrlUsers = wx.ListCtrl(self.panMaster, style=wx.LC_REPORT)
+        self.srchUsers = wx.SearchCtrl(self.panMaster)
+        self.srchUsers.SetDescriptiveText("Search users")
+        self.srchUsers.ShowCancelButton(True)
+        self.srchUsers.Bind(wx.EVT_TEXT, self.on_key_search_users)
+        self.srchUsers.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.on_but_search_users_cancel)
+
+        self.lstctrlUsers = UserListCtrl(self.panMaster)
         self.lstctrlUsers.InsertColumn(0, 'Login name', width=100)
         self.lstctrlUsers.InsertColumn(1, 'Given name', width=100)
         self.lstctrlUsers.InsertColumn(2, 'Surname', width=100)
         self.lstctrlUsers.InsertColumn(3, 'Flags', width=200)
+        # The admin will probably want the details of a user they point at or select, so start fetching them
+        self.lstctrlUsers.Bind(wx.EVT_MOTION, self.on_motion_users)
+        self.timerHover = None
+        self.lstctrlUsers.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_sel_user)
+        # The users and groups from the last refresh. Questions about them (does this group exist? who is in it?)
+        # are answered from here rather than by asking the server again.
+        # Made by AppMain.warm_up, off this thread, and picked up by populate_gui.
+        self.model = None
+        # Every row of the users list from the last refresh, so a refresh only touches the rows that changed.
+        self.dicUsers_all = {}
+        self.indexUsers = None  # username, given name and surname. Like self.model.
 
         self.sizer_buttons_users = wx.FlexGridSizer(cols=2, vgap=1, hgap=1)
         self.but_user_add = wx.Button(self.panMaster, label="Add users")
@@ -510,6 +858,7 @@ class FrMainwindow(wx.Frame):
         self.sizer_buttons_users.AddGrowableCol(0)
         self.sizer_buttons_users.AddGrowableCol(1)
 
+        self.boxUsersSizer.Add(self.srchUsers, 0, wx.ALL | wx.EXPAND, 5)
         self.boxUsersSizer.Add(self.lstctrlUsers, 1, wx.ALL | wx.EXPAND, 5)
         self.boxUsersSizer.Add(self.sizer_buttons_users, 1, wx.ALL | wx.EXPAND, 5)
         # self.boxUsersSizer.AddStretchSpacer()
@@ -532,7 +881,25 @@ class FrMainwindow(wx.Frame):
         self.boxGroups = wx.StaticBox(self.panMaster, label="Groups")
         self.boxGroupsSizer = wx.StaticBoxSizer(self.boxGroups, wx.VERTICAL)
 
+        self.srchGroups = wx.SearchCtrl(self.panMaster)
+        self.srchGroups.SetDescriptiveText("Search groups and members")
+        self.srchGroups.ShowCancelButton(True)
+        self.srchGroups.Bind(wx.EVT_TEXT, self.on_key_search_groups)
+        self.srchGroups.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.on_but_search_groups_cancel)
+
         self.treeGroups = wx.TreeCtrl(self.panMaster, style=wx.TR_MULTIPLE)
+        self.treeGroups.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_sel_group_expanding)
+        self.treeGroups.Bind(wx.EVT_TREE_ITEM_ACTIVATED, self.on_sel_group_activated)
+        # Every group from the last refresh, and what is on the tree right now (which might be filtered):
+        # group name: (tree item, {member name: tree item})
+        self.dicGroups_all = {}
+        self.indexGroups = None  # group names. Like self.model.
+        self.domain_name = ''
+        self.dicGroups_displayed = {}
+        self.dicGroup_items = {}
+        # Big groups only come with their first page of members. They get a "more members" item at the bottom,
+        # which loads the next page when double-clicked. group name: tree item
+        self.dicMore_items = {}
 
         self.sizer_buttons_groups = wx.FlexGridSizer(cols=2, vgap=1, hgap=1)
         self.but_group_add = wx.Button(self.panMaster, label="Add groups")
@@ -550,6 +917,7 @@ class FrMainwindow(wx.Frame):
         self.sizer_buttons_groups.AddGrowableCol(0)
         self.sizer_buttons_groups.AddGrowableCol(1)
 
+        self.boxGroupsSizer.Add(self.srchGroups, 0, wx.ALL | wx.EXPAND, 5)
         self.boxGroupsSizer.Add(self.treeGroups, 1, wx.ALL | wx.EXPAND, 5)
         self.boxGroupsSizer.Add(self.sizer_buttons_groups, 1, wx.ALL | wx.EXPAND, 5)
         # self.boxGroupsSizer.AddStretchSpacer()
@@ -557,8 +925,33 @@ class FrMainwindow(wx.Frame):
 
         self.sizerGrid.Add(self.boxGroupsSizer, pos=(0, 2), span=(2, 1), flag=wx.ALL | wx.EXPAND, border=5)
 
+        # ======================================================================================
+        #  -------------------------------
+        # |       |       |       |       |
+        # |       |       |       | this  |
+        # |       |       |       |  box  |
+        #  -------        |       |       |
+        # |       |       |       |       |
+        # |       |       |       |       |
+        # |       |       |       |       |
+        #  -------------------------------
+        # Everything about the selected user. Fetched when they are selected, not with the users list.
+
+        self.boxDetails = wx.StaticBox(self.panMaster, label="User details")
+        self.boxDetailsSizer = wx.StaticBoxSizer(self.boxDetails, wx.VERTICAL)
+
+        self.lstctrlDetails = wx.ListCtrl(self.panMaster, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        self.lstctrlDetails.InsertColumn(0, 'Attribute', width=150)
+        self.lstctrlDetails.InsertColumn(1, 'Value', width=250)
+        self.details_username = None  # Whose details are (or are about to be) on show
+
+        self.boxDetailsSizer.Add(self.lstctrlDetails, 1, wx.ALL | wx.EXPAND, 5)
+
+        self.sizerGrid.Add(self.boxDetailsSizer, pos=(0, 3), span=(2, 1), flag=wx.ALL | wx.EXPAND, border=5)
+
         # ==========    Now that the rows and columns have been populated, choose which ones stretch    ==============
 
+        self.sizerGrid.AddGrowableCol(3, 1)
         self.sizerGrid.AddGrowableCol(2, 1)
         self.sizerGrid.AddGrowableCol(1, 1)
         self.sizerGrid.AddGrowableRow(1, 1)
@@ -616,10 +1009,10 @@ class FrMainwindow(wx.Frame):
     @error_window
     def on_but_policy_update(self, event=None):
         dicPolicy = {}
-        for policy_item in self.lst_password_policy_boxes:
+        for policy_item in self.dic_password_policy_boxes.values():
             dicPolicy[policy_item[0].GetLabel()] = policy_item[1].GetValue()
         self.bg_set_password_policy(dicPolicy)
-        self.populate_password_policy()
+        self.refresh.request('policy')
 
     @error_window
     def on_but_user_add(self, event=None):
@@ -631,22 +1024,24 @@ class FrMainwindow(wx.Frame):
         lstUsers = self.get_selected_usernames()
         if lstUsers:
             self.bg_delete_users(lstUsers)
-            self.populate_users()
-            self.populate_groups()
+            self.app.prefetch.forget(*[('user', usr) for usr in lstUsers])
+            self.refresh.request('users', 'groups')
 
     @error_window
     def on_but_user_disable(self, event=None):
         lstUsers = self.get_selected_usernames()
         if lstUsers:
             self.bg_disable_users(lstUsers)
-            self.populate_users()
+            self.app.prefetch.forget(*[('user', usr) for usr in lstUsers])
+            self.refresh.request('users')
 
     @error_window
     def on_but_user_enable(self, event=None):
         lstUsers = self.get_selected_usernames()
         if lstUsers:
             self.bg_enable_users(lstUsers)
-            self.populate_users()
+            self.app.prefetch.forget(*[('user', usr) for usr in lstUsers])
+            self.refresh.request('users')
 
     @error_window
     def on_but_user_password(self, event=None):
@@ -661,7 +1056,8 @@ class FrMainwindow(wx.Frame):
         if dlg.ShowModal() == wx.ID_OK:
             new_password = dlg.GetValue()
             self.bg_password_user(usr, new_password)
-            self.populate_users()
+            self.app.prefetch.forget(('user', usr))
+            self.refresh.request('users')
 
         dlg.Destroy()
 
@@ -674,7 +1070,7 @@ class FrMainwindow(wx.Frame):
         if dlg.ShowModal() == wx.ID_OK:
             group_to_add = dlg.GetValue()
             self.bg_add_group(group_to_add)
-            self.populate_groups()
+            self.refresh.request('groups')
 
         dlg.Destroy()
 
@@ -687,11 +1083,11 @@ class FrMainwindow(wx.Frame):
         if len(sel) == 0:
             return
         grp = self.treeGroups.GetItemText(sel[0])
-        if grp not in self.bg_get_groups().keys():
+        if not self.model.has_group(grp):
             wx.MessageBox(f"{grp} is not a group!", "Remove group")
             return
         self.bg_delete_group(grp)
-        self.populate_groups()
+        self.refresh.request('groups')
 
 
     @error_window
@@ -705,12 +1101,12 @@ class FrMainwindow(wx.Frame):
             wx.MessageBox("Please select one group from the group panel.", "Remove group members")
             return
         grp = self.treeGroups.GetItemText(lstSelection[0])
-        if grp not in self.bg_get_groups().keys():
+        if not self.model.has_group(grp):
             wx.MessageBox(f"{grp} is not a group!", "Add users to group.")
             return
         if lstUsers:
             self.bg_add_members_to_group(grp, lstUsers)
-            self.populate_groups()
+            self.refresh.request('groups')
 
     @error_window
     def on_but_members_remove(self, event=None):
@@ -724,25 +1120,116 @@ class FrMainwindow(wx.Frame):
             return
 
         lstSelected_usernames = [self.treeGroups.GetItemText(x) for x in lstSelection]
-        lstUsers = [usr.username for usr in self.bg_get_users()]
         lstRejects = []
         for i in lstSelected_usernames:
-            if i not in lstUsers:
+            if not self.model.has_user(i):
                 lstRejects.append(i)
 
         if lstRejects:
             wx.MessageBox(f"Please select only users on the tree to remove from their parent group.")
             return
 
-        lstGrps = self.bg_get_groups().keys()
         lstGroups_and_members_to_delete = [(self.treeGroups.GetItemText(self.treeGroups.GetItemParent(x)), self.treeGroups.GetItemText(x)) for x in lstSelection]
+        # One removemembers per group rather than one per selected member
+        dicMembers_to_delete = {}
         for grp, usr in lstGroups_and_members_to_delete:
-            assert grp in lstGrps
-            assert usr in lstUsers
-            self.bg_delete_members_from_group(grp, usr)
+            assert self.model.has_group(grp)
+            assert self.model.has_user(usr)
+            dicMembers_to_delete.setdefault(grp, []).append(usr)
+        for grp, members in dicMembers_to_delete.items():
+            self.bg_delete_members_from_group(grp, members)
 
-        self.populate_groups()
+        self.refresh.request('groups')
+
+
+    def on_key_search_users(self, event=None):
+        """
+        Filter the users list as the admin types
+        """
+        if self.indexUsers is None:
+            # Still connecting, so nothing to filter
+            return
+        self.lstctrlUsers.set_filter(self.indexUsers.search(self.srchUsers.GetValue()))
 
+    def on_but_search_users_cancel(self, event=None):
+        self.srchUsers.ChangeValue('')
+        self.lstctrlUsers.set_filter(None)
+
+    def on_key_search_groups(self, event=None):
+        """
+        Filter the group tree as the admin types
+        """
+        self.update_group_tree()
+
+    def on_but_search_groups_cancel(self, event=None):
+        self.srchGroups.ChangeValue('')
+        self.update_group_tree()
+
+    def on_motion_users(self, event):
+        """
+        Mouse moved over the users list. Prefetch the details of the user under it.
+        """
+        row, _ = self.lstctrlUsers.HitTest(event.GetPosition())
+        if 0 <= row < len(self.lstctrlUsers.lstRows):
+            # Wait for the mouse to settle, or sweeping across the list would queue up every user on the way
+            username = self.lstctrlUsers.lstRows[row]
+            if self.timerHover:
+                self.timerHover.Stop()
+            self.timerHover = wx.CallLater(150, self.prefetch_user, username)
+        event.Skip()
+
+    def on_sel_user(self, event):
+        """
+        A user was selected. Show their details.
+        """
+        row = event.GetIndex()
+        if 0 <= row < len(self.lstctrlUsers.lstRows):
+            self.show_user_details(self.lstctrlUsers.lstRows[row])
+        event.Skip()
+
+    def on_sel_group_expanding(self, event):
+        """
+        A group is being expanded. Fetch its members in the background and update just that group when they arrive.
+        """
+        grp = self.treeGroups.GetItemText(event.GetItem())
+        # Big groups are loaded a page at a time instead (see on_sel_group_activated)
+        if grp in self.dicGroups_all and self.model.is_complete(grp):
+            self.app.prefetch.forget(('members', grp))
+            self.app.prefetch.request(('members', grp),
+                                      functools.partial(self.app.ad._get_group_members, grp),
+                                      callback=functools.partial(self.update_group_members, grp))
+        event.Skip()
+
+    def on_sel_group_activated(self, event):
+        """
+        Double-clicking the "more members" item of a big group loads its next page of members in the background.
+        """
+        item = event.GetItem()
+        grp = next((grp for grp, item_more in self.dicMore_items.items() if item_more == item), None)
+        if grp is None:
+            event.Skip()
+            return
+        self.treeGroups.SetItemText(item, "Loading more members...")
+        self.app.prefetch.request(('member page', grp),
+                                  functools.partial(self.get_member_page, grp, self.model.member_offset(grp)),
+                                  priority=Prefetcher.PRIORITY_HIGH,
+                                  callback=functools.partial(self.add_group_member_page, grp))
+
+    def on_thread_connection_made(self, event=None):
+        """
+        We were shown before the background connection was made. Now it's here, so fill in the window.
+        """
+        self.SetTitle(self.title)
+        self.populate_gui()
+        self.sizerGrid.Fit(self.panMaster)
+        self.panMaster.Fit()
+        self.Fit()
+
+    def on_thread_users_changed(self, event=None):
+        """
+        Another window changed the users. Reload them along with anything else changing at the same time.
+        """
+        self.refresh.request('users')
 
     # ==========================================================================
     # =========================     Main functions     =========================
@@ -759,6 +1246,8 @@ class FrMainwindow(wx.Frame):
         #     [x.SetValue(False) for x in self.dicChkBoxes.values()]
         #     self.lstBoxUsers.Clear()
         #     return
+        if self.model is None:
+            self.model, self.indexUsers, self.indexGroups = self.app.model, self.app.indexUsers, self.app.indexGroups
         self.populate_users()
         self.populate_groups()
         self.populate_domain()
@@ -767,78 +1256,303 @@ class FrMainwindow(wx.Frame):
 
     @error_window
     def populate_users(self, event=None):
-        self.lstctrlUsers.DeleteAllItems()
-        for usr in self.bg_get_users():
-            # get_users returns list of user objects
-            item = [usr.username, usr.given_name, usr.surname, str(usr.flags)]
-            self.lstctrlUsers.Append(item)
+        """
+        Bring the users list and its search index up to date without clearing them.
+        Only inserted, removed or changed rows are touched, so the selection and scroll position stay put.
+        """
+        self.model.set_users(self.bg_get_users())
+        dicUsers = {username: (username, given_name, surname, self.model.flag_names(username))
+                    for username, given_name, surname in zip(self.model.usernames, self.model.given_names, self.model.surnames)}
+        added, removed, changed = diff_snapshot(self.dicUsers_all, dicUsers)
+        if not (added or removed or changed):
+            return
+
+        if not self.dicUsers_all:
+            self.indexUsers.build((username,) + row[:3] for username, row in dicUsers.items())
+        else:
+            for username in removed:
+                self.indexUsers.remove(username)
+            for username in added + changed:
+                self.indexUsers.add(username, *dicUsers[username][:3])
+        self.dicUsers_all = dicUsers
+
+        self.lstctrlUsers.Freeze()
+        try:
+            self.lstctrlUsers.setFilter = self.indexUsers.search(self.srchUsers.GetValue())
+            self.lstctrlUsers.update_rows(dicUsers, added, removed)
+        finally:
+            self.lstctrlUsers.Thaw()
+
+        # Somebody changed these users, so whatever we have cached about them is stale
+        for username in removed + changed:
+            self.app.ad.user_cache.pop(username)
+        if self.details_username in removed:
+            self.details_username = None
+            self.lstctrlDetails.DeleteAllItems()
+        elif self.details_username in changed:
+            self.show_user_details(self.details_username)
         self.Layout()
 
     @error_window
     def populate_groups(self, event=None):
-        self.treeGroups.DeleteAllItems()
-        root = self.treeGroups.AddRoot(self.bg_get_domain_name())
-        for grp, members in self.bg_get_groups().items():
-            item_grp = self.treeGroups.AppendItem(root, grp)
-            for mem in members:
-                self.treeGroups.AppendItem(item_grp, mem)
-        self.treeGroups.ExpandAll()
+        """
+        Bring the group tree and its search index up to date.
+        """
+        self.domain_name = self.bg_get_domain_name()
+        self.model.set_groups(*self.bg_get_groups())
+        dicGroups = dict(self.model.dicGroups)
+        added, removed, changed = diff_snapshot(self.dicGroups_all, dicGroups)
+        if not self.dicGroups_all:
+            self.indexGroups.build((grp, grp) for grp in dicGroups)
+        else:
+            for grp in removed:
+                self.indexGroups.remove(grp)
+            for grp in added:
+                self.indexGroups.add(grp, grp)
+        self.dicGroups_all = dicGroups
+        self.update_group_tree()
+
+    def update_group_members(self, grp, members):
+        """
+        Fresh members of one group arrived from the prefetcher. Update just that group.
+        """
+        self.app.prefetch.forget(('members', grp))
+        if not self:
+            # Window closed in the meantime
+            return
+        if grp in self.dicGroups_all and self.dicGroups_all[grp] != tuple(members):
+            self.model.set_group_members(grp, members)
+            self.dicGroups_all[grp] = tuple(members)
+            self.update_group_tree()
+
+    def get_member_page(self, grp, start):
+        """
+        Fetch the next page of a big group's members. Slow, so it runs in the prefetcher.
+        :return: (members, where the page after starts on the server), see SshSamba.iter_group_members
+        """
+        return next(self.app.ad.iter_group_members(grp, page_size=GROUP_PAGE_SIZE, start=start, with_offsets=True),
+                    ([], None))
+
+    def add_group_member_page(self, grp, page):
+        """
+        The next page of a big group's members arrived from the prefetcher. Add it to the tree.
+        """
+        self.app.prefetch.forget(('member page', grp))
+        if not self or not self.model.has_group(grp):
+            return
+        members, next_start = page
+        self.model.add_member_page(grp, members, next_start)
+        self.dicGroups_all[grp] = self.model.members(grp)
+        self.update_group_tree()
+
+    def prefetch_user(self, username, priority=Prefetcher.PRIORITY_LOW, callback=None):
+        """
+        Fetch all the details of a user in the background, speculatively unless told otherwise.
+        They end up in the model's user cache, so the prefetcher doesn't need to keep them.
+        """
+        self.app.prefetch.request(('user', username), functools.partial(self.app.ad.get_user, username),
+                                  priority=priority, callback=callback, keep=False)
+
+    def show_user_details(self, username):
+        """
+        Show everything about a user in the details pane. Instant if they're cached, otherwise fetched in the background.
+        """
+        self.details_username = username
+        usr = self.app.ad.user_cache.get(username)
+        if usr is not None:
+            self.fill_user_details(username, usr)
+            return
+        self.lstctrlDetails.DeleteAllItems()
+        self.lstctrlDetails.Append((username, 'Loading...'))
+        self.prefetch_user(username, Prefetcher.PRIORITY_NORMAL, functools.partial(self.fill_user_details, username))
+
+    def fill_user_details(self, username, usr):
+        """
+        The details of a user have arrived. Show them if that user is still the one we want.
+        """
+        if not self or username != self.details_username:
+            return
+        self.lstctrlDetails.Freeze()
+        try:
+            self.lstctrlDetails.DeleteAllItems()
+            for attribute, value in sorted(usr.dic_full_info.items()):
+                if isinstance(value, list):
+                    value = '; '.join(value)
+                self.lstctrlDetails.Append((attribute, value))
+        finally:
+            self.lstctrlDetails.Thaw()
+
+    def filter_groups(self) -> dict:
+        """
+        Apply the group search box to the groups.
+        A group matching the search keeps all of its members.
+        Otherwise, it is kept with just the members matching the search (by username, given name or surname).
+        :return: dictionary - group name: (group member, group member)
+        """
+        if self.indexGroups is None:
+            # Still connecting
+            return self.dicGroups_all
+        query = self.srchGroups.GetValue()
+        setGroups = self.indexGroups.search(query)
+        if setGroups is None:
+            return self.dicGroups_all
+        setUsers = self.indexUsers.search(query)
+        dicFiltered = {}
+        for grp, members in self.dicGroups_all.items():
+            if grp in setGroups:
+                dicFiltered[grp] = members
+                continue
+            members = tuple(mem for mem in members if mem in setUsers)
+            if members:
+                dicFiltered[grp] = members
+        return dicFiltered
+
+    def update_group_tree(self):
+        """
+        Make the group tree show the (filtered) groups, touching only the groups and members that changed.
+        The selection, expanded groups and scroll position stay put.
+        """
+        dicGroups = self.filter_groups()
+
+        self.treeGroups.Freeze()
+        try:
+            root = self.treeGroups.GetRootItem()
+            if not root.IsOk():
+                root = self.treeGroups.AddRoot(self.domain_name)
+            elif self.treeGroups.GetItemText(root) != self.domain_name:
+                self.treeGroups.SetItemText(root, self.domain_name)
+
+            added, removed, changed = diff_snapshot(self.dicGroups_displayed, dicGroups)
+            for grp in removed:
+                item_grp, _ = self.dicGroup_items.pop(grp)
+                self.treeGroups.Delete(item_grp)
+
+            for grp in changed:
+                item_grp, dicMember_items = self.dicGroup_items[grp]
+                setMembers = set(dicGroups[grp])
+                for mem in [mem for mem in dicMember_items if mem not in setMembers]:
+                    self.treeGroups.Delete(dicMember_items.pop(mem))
+                for mem in dicGroups[grp]:
+                    if mem not in dicMember_items:
+                        dicMember_items[mem] = self.treeGroups.AppendItem(item_grp, mem)
+
+            for grp in added:
+                item_grp = self.treeGroups.AppendItem(root, grp)
+                self.dicGroup_items[grp] = (item_grp, {mem: self.treeGroups.AppendItem(item_grp, mem) for mem in dicGroups[grp]})
+                # New groups arrive expanded, like the whole tree used to. Leave the admin's choice alone for the rest.
+                self.treeGroups.Expand(item_grp)
+
+            for grp in removed:
+                # Deleted along with the group
+                self.dicMore_items.pop(grp, None)
+            for grp in dicGroups:
+                self.update_more_item(grp, moved=grp in changed)
+
+            if not self.dicGroups_displayed:
+                self.treeGroups.Expand(root)
+            self.dicGroups_displayed = dicGroups
+        finally:
+            self.treeGroups.Thaw()
         self.Layout()
 
+    def update_more_item(self, grp, moved=False):
+        """
+        Give a big group a "more members" item at the bottom, saying how many members haven't been loaded yet,
+        or take it away once they all have been.
+        :param moved: members were added to the group on the tree, so the item is no longer at the bottom
+        """
+        not_loaded = self.model.members_not_loaded(grp)
+        item_more = self.dicMore_items.get(grp)
+        if item_more is not None and (moved or not_loaded <= 0):
+            self.treeGroups.Delete(self.dicMore_items.pop(grp))
+            item_more = None
+        if not_loaded <= 0:
+            return
+        label = f"... {not_loaded:,} more of {self.model.member_count(grp):,} members (double-click to load {min(not_loaded, GROUP_PAGE_SIZE):,})"
+        if item_more is None:
+            self.dicMore_items[grp] = self.treeGroups.AppendItem(self.dicGroup_items[grp][0], label)
+        elif self.treeGroups.GetItemText(item_more) != label:
+            self.treeGroups.SetItemText(item_more, label)
+
     @error_window
     def populate_domain(self, event=None):
-        for txt in self.lst_txt_domain_info:
-            txt.Destroy()
-        self.lst_txt_domain_info = [wx.StaticText(self.panMaster, label=f"{x}: {y}") for x, y in self.bg_get_domain().items()]
-        for txt in self.lst_txt_domain_info:
-            self.boxDomainSizer.Add(txt, 0, wx.ALL | wx.EXPAND, 1)
-        self.Layout()
+        """
+        Relabel only the domain info lines that changed.
+        """
+        dicDomain = self.bg_get_domain()
+        added, removed, changed = diff_snapshot(self.dicDomain_info, dicDomain)
+        for key in removed:
+            self.dic_txt_domain_info.pop(key).Destroy()
+        for key in changed:
+            self.dic_txt_domain_info[key].SetLabel(f"{key}: {dicDomain[key]}")
+        for key in added:
+            self.dic_txt_domain_info[key] = wx.StaticText(self.panMaster, label=f"{key}: {dicDomain[key]}")
+            self.boxDomainSizer.Add(self.dic_txt_domain_info[key], 0, wx.ALL | wx.EXPAND, 1)
+        self.dicDomain_info = dicDomain
+        if added or removed:
+            self.Layout()
 
     @error_window
     def populate_password_policy(self, event=None):
-        for policy_item in self.lst_password_policy_boxes:
-            policy_item[0].Destroy()
-            policy_item[1].Destroy()
-        self.lst_password_policy_boxes = [[wx.StaticText(self.panMaster, label=key), wx.TextCtrl(self.panMaster, value=value)] for key, value in self.bg_get_password_policy().items()]
-        for policy_item in self.lst_password_policy_boxes:
-            self.sizerPolicy.Add(policy_item[0], 0, wx.ALL, 1)
-            self.sizerPolicy.Add(policy_item[1], 0, wx.ALL, 1)
-        self.Layout()
+        """
+        Update only the password policy fields whose value on the server changed.
+        An unchanged field keeps whatever the admin has typed into it.
+        """
+        dicPolicy = self.bg_get_password_policy()
+        added, removed, changed = diff_snapshot(self.dicPassword_policy, dicPolicy)
+        for key in removed:
+            for widget in self.dic_password_policy_boxes.pop(key):
+                widget.Destroy()
+        for key in changed:
+            self.dic_password_policy_boxes[key][1].ChangeValue(dicPolicy[key])
+        for key in added:
+            self.dic_password_policy_boxes[key] = [wx.StaticText(self.panMaster, label=key), wx.TextCtrl(self.panMaster, value=dicPolicy[key])]
+            self.sizerPolicy.Add(self.dic_password_policy_boxes[key][0], 0, wx.ALL, 1)
+            self.sizerPolicy.Add(self.dic_password_policy_boxes[key][1], 0, wx.ALL, 1)
+        self.dicPassword_policy = dicPolicy
+        if added or removed:
+            self.Layout()
 
     @loading_window
     @error_window
     def bg_get_users(self):
-        """Gets the users in the domain. Run as background process using decorator, which returns background_return"""
+        """
+        Gets the users in the domain as columns for the DirectoryModel.
+        Run as background process using decorator, which returns background_return
+        """
+        from samba_directory import DirectoryModel
         global background_return
-        background_return = self.app.ad.get_users()
+        background_return = self.app.prefetch.take('users', functools.partial(DirectoryModel.fetch_users, self.app.ad))
 
     @loading_window
     @error_window
     def bg_get_groups(self):
         """Gets the groups in the domain. Run as background process using decorator, which returns bakground_return"""
+        from samba_directory import DirectoryModel
         global background_return
-        background_return = self.app.ad.get_groups()
+        background_return = self.app.prefetch.take('groups', functools.partial(DirectoryModel.fetch_groups, self.app.ad,
+                                                                               max_members=GROUP_PAGE_SIZE))
 
     @loading_window
     @error_window
     def bg_get_domain(self):
         """Gets the domain info. Run as background process using decorator, which returns bakground_return"""
         global background_return
-        background_return = self.app.ad.get_domain()
+        background_return = self.app.prefetch.take('domain', self.app.ad.get_domain)
 
     @loading_window
     @error_window
     def bg_get_domain_name(self):
         """Gets the domain name. Run as background process using decorator, which returns bakground_return"""
         global background_return
-        background_return = self.app.ad.get_domain_long()
+        background_return = self.app.prefetch.take('domain name', self.app.ad.get_domain_long)
 
     @loading_window
     @error_window
     def bg_get_password_policy(self):
         """Gets the domain name. Run as background process using decorator, which returns bakground_return"""
         global background_return
-        background_return = self.app.ad.get_password_policy()
+        background_return = self.app.prefetch.take('password policy', self.app.ad.get_password_policy)
 
     @loading_window
     @error_window
@@ -931,8 +1645,7 @@ class FrMainwindow(wx.Frame):
         self.app.ad.set_password_policy(dicPolicy)
 
     def get_selected_usernames(self):
-        username_column = 0
-        return [self.lstctrlUsers.GetItem(row, username_column).Text for row in get_selected_rows(self.lstctrlUsers)]
+        return self.lstctrlUsers.get_selected_usernames()
 
     def shut_down(self):
         """
@@ -983,6 +1696,7 @@ class FrMainwindow(wx.Frame):
         # This will be an array of C-Types. See the docs of the array module for more info.
         # Examples, 'l' = signed long, 'u' = unicode character, 'i' = signed int, etc.
         # Here, we will make an array of 5 zeroes, of type signed long
+        import multiprocessing
         no_of_progress_bars = 5
         progress = multiprocessing.Array('l', [0] * no_of_progress_bars)
         self.procExample = multiprocessing.Process(target=self.dummy_function, args=(progress,))
@@ -1090,10 +1804,155 @@ class FrAddUsers(wx.Frame):
     @error_window
     def on_but_import(self, event=None):
         """
-        Import a CSV of user details to add to the AD
+        Import a CSV (or TSV) of user details to add to the AD. See ssh_samba.read_user_csv for the columns.
+        Every row is checked before anything is sent, and the admin is told which rows are no good and why.
+        The good ones are then added a chunk at a time, with a progress bar. The file is read again for that rather
+        than held on to: 100k users, with their passwords, are a lot to keep in memory while they're added.
         """
-        # Write me please
-        pass
+        with wx.FileDialog(self, "Import users", wildcard="CSV or TSV files (*.csv;*.tsv;*.txt)|*.csv;*.tsv;*.txt|All files|*",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as dlgFile:
+            if dlgFile.ShowModal() == wx.ID_CANCEL:
+                return
+            path = dlgFile.GetPath()
+
+        result = self.bg_read_user_csv(path)
+        if result is None:
+            # Couldn't read it. The error has been shown already.
+            return
+        lstUsernames, lstErrors = result
+        if lstErrors:
+            self.report_import_problems([(f"Line {line_no}", message) for line_no, message in lstErrors],
+                                        f"{len(lstErrors)} rows of {os.path.basename(path)} can't be imported")
+        if not lstUsernames:
+            wx.MessageBox("No valid user details found.", "Import users")
+            return
+        journal = self.open_import_journal(path, lstUsernames)
+        if journal is None:
+            return
+
+        with journal:
+            setTo_do = set(journal.start('add_users', lstUsernames))
+
+            def chunks():
+                # The rows with problems were reported above
+                for lstChunk, _ in read_user_csv(path, IMPORT_CHUNK_SIZE):
+                    lstChunk = [usr for usr in lstChunk if usr.username in setTo_do]
+                    if lstChunk:
+                        yield lstChunk
+
+            lstProblems, no_added = self.add_users_with_progress(chunks(), len(setTo_do), journal)
+        wx.PostEvent(self.app.frMain, EvtUsersChanged())
+        if lstProblems:
+            self.report_import_problems(lstProblems, "Some users could not be added")
+        elif no_added < len(setTo_do):
+            wx.MessageBox(f"Import stopped after {no_added} of {len(setTo_do)} users.", "Import users")
+        self.Destroy()
+
+    @loading_window
+    @error_window
+    def bg_read_user_csv(self, path):
+        """
+        Read and check every row of a CSV of users, keeping only what on_but_import needs to report on it.
+        Run as background process using decorator, which returns background_return:
+        (usernames of the good rows, [(line number, error)])
+        """
+        global background_return
+        lstUsernames = []
+        lstErrors = []
+        for lstChunk_users, lstChunk_errors in read_user_csv(path):
+            lstUsernames += [usr.username for usr in lstChunk_users]
+            lstErrors += lstChunk_errors
+        background_return = (lstUsernames, lstErrors)
+
+    def open_import_journal(self, path, lstUsernames):
+        """
+        Every import of a file keeps a journal of which users have been added (see JobJournal), so an import that
+        was interrupted (the app closed, the connection dropped, Cancel was pressed) can carry on where it stopped.
+        If the file has been changed since, its journal is no use, so the import starts again from the top.
+        :return: the journal, or None if the admin changed their mind
+        """
+        dir_jobs = os.path.join(wx.StandardPaths.Get().GetUserLocalDataDir(), 'jobs')
+        os.makedirs(dir_jobs, exist_ok=True)
+        path_hash = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+        fpJournal = os.path.join(dir_jobs, f"import {os.path.basename(path)} {path_hash}.jsonl")
+
+        if os.path.exists(fpJournal):
+            journal = JobJournal(fpJournal)
+            if journal.is_resumable('add_users', lstUsernames) and journal.setDone:
+                answer = wx.MessageBox(f"An earlier import of this file stopped after adding {len(journal.setDone)} of "
+                                       f"{len(journal.lstPlanned)} users.\n\nCarry on from there? "
+                                       f"(No starts again from the top.)", "Import users", wx.YES_NO | wx.CANCEL)
+                if answer == wx.CANCEL:
+                    return None
+                if answer == wx.YES:
+                    return journal
+            os.remove(fpJournal)
+        if wx.MessageBox(f"Add {len(lstUsernames)} users?", "Import users", wx.YES_NO) != wx.YES:
+            return None
+        return JobJournal(fpJournal)
+
+    def add_users_with_progress(self, chunks, no_of_users: int, journal=None) -> tuple:
+        """
+        Add lots of users, a chunk at a time in a background thread, with a progress bar that can cancel.
+        :param chunks: iterable of lists of user objects, eg. read from a file as they're needed
+        :param no_of_users: how many users there are in all the chunks, for the progress bar
+        :param journal: a JobJournal to record each user in as it is added
+        :return: list of (which users, what went wrong) and the number of users sent to the server
+        """
+        dicProgress = {'done': 0, 'problems': []}
+        evtCancel = threading.Event()
+
+        def add_chunks():
+            try:
+                for lstChunk in chunks:
+                    if evtCancel.is_set():
+                        return
+                    try:
+                        self.app.ad.add_users(lstChunk, journal=journal)
+                    except Exception as e:
+                        dicProgress['problems'].append((f"{lstChunk[0].username} to {lstChunk[-1].username}",
+                                                        e.args[0] if e.args else repr(e)))
+                    dicProgress['done'] += len(lstChunk)
+            except Exception as e:
+                # Getting the next chunk, eg. the file has gone since it was checked
+                dicProgress['problems'].append((f"After {dicProgress['done']} users", e.args[0] if e.args else repr(e)))
+
+        thAdd = threading.Thread(target=add_chunks)
+        thAdd.start()
+        dlgProgress = wx.ProgressDialog(title="Import users",
+                                        message=f"Adding {no_of_users} users...",
+                                        maximum=no_of_users,
+                                        parent=self,
+                                        style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME)
+        while thAdd.is_alive():
+            done = dicProgress['done']
+            keep_going, _ = dlgProgress.Update(min(done, no_of_users - 1), f"Added {done} of {no_of_users} users")
+            if not keep_going:
+                evtCancel.set()
+            sleep(0.1)
+        thAdd.join()
+        dlgProgress.Destroy()
+        return dicProgress['problems'], dicProgress['done']
+
+    def report_import_problems(self, lstProblems, title):
+        """
+        Show the first few problems, and offer to save all of them to a CSV file.
+        :param lstProblems: list of (where, what went wrong)
+        """
+        lstLines = [f"{where}: {what}" for where, what in lstProblems[:20]]
+        if len(lstProblems) > 20:
+            lstLines.append(f"...and {len(lstProblems) - 20} more.")
+        lstLines.append("\nSave the full list to a file?")
+        if wx.MessageBox('\n'.join(lstLines), title, wx.YES_NO | wx.ICON_WARNING) != wx.YES:
+            return
+        with wx.FileDialog(self, "Save problems", wildcard="CSV files (*.csv)|*.csv", defaultFile="import problems.csv",
+                           style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as dlgFile:
+            if dlgFile.ShowModal() == wx.ID_CANCEL:
+                return
+            with open(dlgFile.GetPath(), 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(("Where", "Problem"))
+                writer.writerows(lstProblems)
 
     def on_but_cancel(self, event=None):
         self.Destroy()
@@ -1110,6 +1969,10 @@ class FrLoading(wx.Frame):
 
 
 if __name__ == '__main__':
+    # Big LDIF dumps are parsed in worker processes (see ssh_samba.parse_ldif_in_processes), which needs this
+    # when the app is frozen into an executable
+    import multiprocessing
+    multiprocessing.freeze_support()
     app = AppMain()
     app.MainLoop()
 
@@ -0,0 +1,449 @@
+"""
+How commands get to the domain controller, for SshSamba.
+Abilities so far:
+    - SshTransport: over SSH with Paramiko, for managing the DC from somewhere else (the usual way).
+      Can compress everything, or work out for itself whether the link is slow enough for that to be worth it.
+    - LocalTransport: as a local subprocess, for scripts running on the DC itself, which don't need SSH to
+      get to localhost. Also handy for trying things out against a fake samba-tool put first on the PATH.
+
+Both run the command through a shell, so pipes and quoting work the same either way,
+and both hand back the output in the same form. Both can also start a long-running command to talk to a line at a
+time (see Channel), eg. the samba-tool worker in samba_dispatcher, or a shell to pipeline commands through
+(see ShellPipeline).
+"""
+
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+import uuid
+import weakref
+from time import monotonic
+
+# compress='auto' turns compression on once outputs at least this big (bytes) come in slower than this (bytes/s).
+# Compressing costs CPU at both ends, which is only worth it when the link is the slow part. LDIF and
+# samba-tool's output compress about 10 to 1, so below about 2 MB/s (16 Mbit/s) it's a clear win.
+AUTO_COMPRESSION_MIN_BYTES = 256 * 1024
+AUTO_COMPRESSION_BELOW = 2 * 1024 * 1024
+
+
+class Channel:
+    """
+    A long-running command that is talked to a line at a time: lines written go to its stdin,
+    and lines read come from its stdout. Nobody reads its stderr, so if it might have much to say there,
+    send that to /dev/null in the command line.
+    """
+    def __init__(self, fpIn, fpOut, close):
+        """
+        :param fpIn: the command's stdin, a text file
+        :param fpOut: the command's stdout, a text file
+        :param close: function that stops the command
+        """
+        self.fpIn = fpIn
+        self.fpOut = fpOut
+        self._close = close
+
+    def write_line(self, line: str):
+        self.fpIn.write(line + '\n')
+        self.fpIn.flush()
+
+    def read_line(self) -> str:
+        """
+        :return: the next line, without its line ending. Raises ConnectionError if the command has finished.
+        """
+        line = self.fpOut.readline()
+        if not line:
+            raise ConnectionError("The command on the other end has stopped.")
+        return line.rstrip('\r\n')
+
+    def close(self):
+        self._close()
+
+
+class Transport:
+    """
+    What SshSamba needs from a transport. A new one just has to fill these in.
+    """
+    def run(self, cmd: str) -> tuple:
+        """
+        Run a command and wait for it to finish.
+        :param cmd: command line, run through the shell
+        :return: (stdout, stderr) as bytes
+        """
+        raise NotImplementedError
+
+    def stream(self, cmd: str):
+        """
+        Run a command and hand back its output a line at a time, as it arrives.
+        Stopping early (closing the generator) stops the command.
+            errors = yield from transport.stream(cmd)
+        :param cmd: command line, run through the shell
+        :return: generator of lines of stdout, without line endings. Returns (as in StopIteration) whatever was
+                 written to stderr, as a string.
+        """
+        raise NotImplementedError
+
+    def open(self, cmd: str) -> Channel:
+        """
+        Start a command that keeps running, to talk to a line at a time.
+        :param cmd: command line, run through the shell
+        """
+        raise NotImplementedError
+
+    def is_connected(self) -> bool:
+        raise NotImplementedError
+
+    def add_pipeline(self, pipeline):
+        """
+        A ShellPipeline has been made to run commands over this transport. Its shell stays open between commands,
+        so the transport may need to close it while it isn't in use (see ShellPipeline.close_if_idle).
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class SshTransport(Transport):
+    def __init__(self, host: str, username: str, password: str, compress=False, sock=None):
+        """
+        :param compress: True to compress everything (zlib), False not to, or 'auto' to start without and turn it on
+                         if big outputs turn out to be coming in slowly (see AUTO_COMPRESSION_BELOW)
+        :param sock: an open socket (or Paramiko channel, eg. through a jump host) to talk SSH over,
+                     instead of connecting to host
+        """
+        if compress not in (True, False, 'auto'):
+            raise ValueError("compress must be True, False or 'auto'")
+        self.host = host
+        self.username = username
+        self._password = password
+        self.compress = compress
+        self.sock = sock
+        self.ssh = None  # Will be Paramiko SSH Client
+        self.compressed = False  # Whether compression is on now
+        self.bandwidth = None  # bytes/s, from the big outputs so far (see _measure)
+        self._lock = threading.Lock()
+        self._running = 0  # Commands with a channel open
+        self._compress_next = False  # Turn compression on before the next command (see _measure)
+        self._pipelines = weakref.WeakSet()  # Their idle shells are closed to let compression be turned on
+
+    def connect(self):
+        """
+        Log in to the server. Forgets the password once it has been used.
+        Silence = success. Exception will be raised if something went wrong
+        """
+        # Paramiko takes longer to import than everything else in SshSamba put together,
+        # so it waits until it's needed
+        import paramiko
+
+        self.ssh = paramiko.SSHClient()
+        self.ssh.load_system_host_keys()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            self.ssh.connect(self.host, username=self.username, password=self._password,
+                             compress=self.compress is True, sock=self.sock)
+            self.compressed = self.ssh.get_transport().remote_compression != 'none'
+        finally:
+            # OS should keep our memory safe from other processes, but I will overwrite and free the memory
+            # now we are finished with the password.
+            self._password = "sahjdio327nyc327qey273eyn921ye923e912eyn2yd283e7bh8237e2y38eb723ye8723ey738"
+            del self._password
+
+    def run(self, cmd: str) -> tuple:
+        if not self.ssh:
+            raise ConnectionError("No SSH client active.")
+        self._begin()
+        try:
+            stdin, stdout, stderr = self.ssh.exec_command(cmd)
+            try:
+                # A bit at a time, to time the output arriving (see _measure)
+                lstChunks = [stdout.read(65536)]
+                first = monotonic()
+                while lstChunks[-1]:
+                    lstChunks.append(stdout.read(65536))
+                out = b''.join(lstChunks)
+                self._measure(len(out) - len(lstChunks[0]), monotonic() - first)
+            except IOError:
+                out = b''
+            try:
+                err = stderr.read()
+            except IOError:
+                err = b''
+            stdout.channel.close()
+        finally:
+            self._end()
+        return out, err
+
+    def stream(self, cmd: str):
+        if not self.ssh:
+            raise ConnectionError("No SSH client active.")
+        self._begin()
+        try:
+            stdin, stdout, stderr = self.ssh.exec_command(cmd)
+            first = None
+            size = 0
+            try:
+                for line in stdout:
+                    if first is None:
+                        first = monotonic()
+                    else:
+                        size += len(line)
+                    yield line.rstrip('\r\n')
+                if first is not None:
+                    self._measure(size, monotonic() - first)
+                return stderr.read().decode('utf-8', errors='replace')
+            finally:
+                stdout.channel.close()
+        finally:
+            self._end()
+
+    def open(self, cmd: str) -> Channel:
+        if not self.ssh:
+            raise ConnectionError("No SSH client active.")
+        self._begin()
+        try:
+            stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        except Exception:
+            self._end()
+            raise
+
+        def close():
+            try:
+                stdout.channel.close()
+            finally:
+                self._end()
+        return Channel(stdin, stdout, close)
+
+    def add_pipeline(self, pipeline):
+        with self._lock:
+            self._pipelines.add(pipeline)
+
+    def _begin(self):
+        """
+        A command is starting. If compression is waiting to be turned on (see _measure), and nothing else is running,
+        now is the time. Shells that are kept open between commands (see ShellPipeline) would never let that happen,
+        so the ones not in use are closed first: they start again when next needed.
+        """
+        with self._lock:
+            lstPipelines = list(self._pipelines) if self._compress_next else []
+        for pipeline in lstPipelines:
+            pipeline.close_if_idle()
+        with self._lock:
+            if self._compress_next and self._running == 0:
+                self._compress_next = False
+                self._turn_on_compression()
+            self._running += 1
+
+    def _end(self):
+        """A command has finished, and its channel is closed"""
+        with self._lock:
+            self._running -= 1
+
+    def _measure(self, size: int, seconds: float):
+        """
+        Keep track of how fast outputs come in, and if compression is 'auto' and they come in slowly,
+        have it turned on before the next command.
+        Only big outputs count, timed from their first bytes to their last, so it's mostly the link being timed
+        rather than the command starting up.
+        :param size: bytes after the first lot
+        :param seconds: time from the first lot arriving to the last
+        """
+        if size < AUTO_COMPRESSION_MIN_BYTES or seconds <= 0:
+            return
+        with self._lock:
+            bandwidth = size / seconds
+            self.bandwidth = bandwidth if self.bandwidth is None else 0.5 * self.bandwidth + 0.5 * bandwidth
+            if self.compress == 'auto' and not self.compressed and self.bandwidth < AUTO_COMPRESSION_BELOW:
+                self._compress_next = True
+
+    def _turn_on_compression(self):
+        """
+        Compression is agreed along with the keys, so ask for it and agree new keys.
+        Only while no channels are open: if the server closes one while the keys are being agreed,
+        Paramiko's reply to that has to wait for the new keys, and holds everything up until it times out.
+        Carries on without compression if the server won't.
+        """
+        transport = self.ssh.get_transport()
+        transport.use_compression(True)
+        transport.renegotiate_keys()
+        self.compressed = transport.remote_compression != 'none'
+
+    def is_connected(self) -> bool:
+        if not self.ssh:
+            return False
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        if self.ssh:
+            self.ssh.close()
+
+
+class LocalTransport(Transport):
+    def __init__(self, env: dict = None):
+        """
+        :param env: extra environment variables for the commands, eg. {'PATH': '/path/to/fake/samba-tool:' + ...}
+        """
+        self.env = None if env is None else {**os.environ, **env}
+        self.closed = False
+
+    def run(self, cmd: str) -> tuple:
+        if self.closed:
+            raise ConnectionError("Transport closed.")
+        result = subprocess.run(cmd, shell=True, env=self.env, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.stdout, result.stderr
+
+    def stream(self, cmd: str):
+        if self.closed:
+            raise ConnectionError("Transport closed.")
+        # stderr goes to a file rather than a pipe: nobody reads a pipe until stdout is finished,
+        # so a command with a lot to complain about could fill it and stop
+        with tempfile.TemporaryFile() as fpErrors:
+            proc = subprocess.Popen(cmd, shell=True, env=self.env, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=fpErrors, encoding='utf-8', errors='replace')
+            try:
+                for line in proc.stdout:
+                    yield line.rstrip('\r\n')
+                proc.wait()
+                fpErrors.seek(0)
+                return fpErrors.read().decode('utf-8', errors='replace')
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+
+    def open(self, cmd: str) -> Channel:
+        if self.closed:
+            raise ConnectionError("Transport closed.")
+        proc = subprocess.Popen(cmd, shell=True, env=self.env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace')
+
+        def close():
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+        return Channel(proc.stdin, proc.stdout, close)
+
+    def is_connected(self) -> bool:
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class ShellPipeline:
+    """
+    One shell on the DC that many commands are sent to back-to-back, without waiting for each one to finish
+    before sending the next. Over a slow link that saves a round trip per command.
+    Each command's output is followed by a line with a sentinel (a random token, the command's number and its exit
+    status), then its stderr and another sentinel, so the outputs can be told apart as they come back.
+    Each command is run with sh -c, with stdin from /dev/null, so one can't upset the shell or eat the commands
+    after it.
+    """
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        self.channel = None
+        self._token = f'SDCC-{uuid.uuid4().hex}'
+        self._lock = threading.Lock()
+        transport.add_pipeline(self)
+
+    def _start(self):
+        self.channel = self.transport.open('exec sh 2>/dev/null')
+        self.channel.write_line('e=$(mktemp) || exit 1; trap \'rm -f "$e"\' EXIT')
+
+    def run_many(self, lstCmds: list):
+        """
+        Run commands, in order, one after another on the DC.
+        Only one run_many at a time: another waits for this one to be finished with (or closed).
+        :param lstCmds: command lines
+        :return: generator of (exit status, stdout, stderr), the output as strings, one for each command in order,
+                 as soon as each is finished. Raises ConnectionError if the shell stops part way.
+        """
+        with self._lock:
+            if self.channel is None:
+                self._start()
+            channel = self.channel
+            finished = False
+
+            def send():
+                # From another thread, so that a lot of output coming back can't hold up sending the commands
+                try:
+                    for i, cmd in enumerate(lstCmds):
+                        channel.write_line(f'sh -c {shlex.quote(cmd)} </dev/null 2>"$e"; '
+                                           f'printf \'%s %d %d\\n\' {self._token} {i} $?; '
+                                           f'cat "$e"; printf \'%s %d end\\n\' {self._token} {i}')
+                except OSError:
+                    pass  # Reading will find out
+
+            sender = threading.Thread(target=send, daemon=True)
+            sender.start()
+            last = None
+            try:
+                for i in range(len(lstCmds)):
+                    stdout, status = self._read_until(channel, f'{self._token} {i} ')
+                    stderr, _ = self._read_until(channel, f'{self._token} {i} end')
+                    if i == len(lstCmds) - 1:
+                        # Handed over once the lock is let go, in case whoever is reading doesn't ask for more
+                        # (eg. zip) and leaves this generator waiting here
+                        last = int(status), stdout, stderr
+                        finished = True
+                    else:
+                        yield int(status), stdout, stderr
+            finally:
+                if not finished:
+                    # Stopped early (or the shell did): the rest of the output is still on its way,
+                    # so start again with a new shell next time
+                    self._close()
+                sender.join()
+        if last is not None:
+            yield last
+
+    @staticmethod
+    def _read_until(channel: Channel, sentinel: str) -> tuple:
+        """
+        Read output up to the sentinel, which needn't be at the start of a line (the output mightn't end with one)
+        :return: (the output before the sentinel, the rest of the sentinel's line)
+        """
+        lstLines = []
+        while True:
+            line = channel.read_line()
+            at = line.find(sentinel)
+            if at >= 0:
+                if at > 0:
+                    lstLines.append(line[:at])
+                    return '\n'.join(lstLines), line[at + len(sentinel):]
+                return ''.join(line + '\n' for line in lstLines), line[at + len(sentinel):]
+            lstLines.append(line)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def close_if_idle(self):
+        """
+        Close the shell unless run_many is using it. Another run_many starts a new one.
+        """
+        if self._lock.acquire(blocking=False):
+            try:
+                self._close()
+            finally:
+                self._lock.release()
+
+    def _close(self):
+        if self.channel is not None:
+            channel, self.channel = self.channel, None
+            try:
+                channel.close()
+            except OSError:
+                pass
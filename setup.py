@@ -7,7 +7,7 @@ app_name = 'Samba Domain Controller Controller'
 APP = ['samba_gui.py']
 DATA_FILES = []
 OPTIONS = {'packages': 'wx',
-           'excludes': ['pandas', 'scipy', 'numpy'],
+           'excludes': ['pandas', 'scipy'],
            'iconfile': 'design/SDCC.icns',
            'plist': {
                 'CFBundleDisplayName': app_name,
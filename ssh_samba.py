@@ -4,12 +4,26 @@ Basically calls the samba-tool commands on a remote server.
 As we know, there is no GUI for Samba Domain Controllers, so this is the model to make one.
 
 Abilities so far:
+    Connecting:
+        - over SSH, or straight to samba-tool when running on the DC itself (see samba_transport)
+        - SSH compression: on, off, or on by itself when big outputs come in over a slow link
+        - finds out what the DC's Samba can do (version, JSON output, ldbsearch, where the database is) once per
+          connection, and reads the domain info and password policy as JSON where samba-tool writes it
+          (see samba_capabilities)
+        - several DCs at once: reads from the quickest, writes to the PDC emulator (see samba_cluster)
+        - optionally, one long-lived samba-tool process on the DC for all the commands (see samba_dispatcher)
+        - bulk jobs send commands back-to-back through shells on the DC instead of waiting for each one,
+          with as many shells at once as the DC copes with (see samba_commands and samba_concurrency)
     Users:
-        - list (users and details)
-        - add
+        - list (users and details, or just the columns for a list of users)
+        - show one user (cached)
+        - add (including from a CSV file, checked before anything is sent)
+        - reset passwords in bulk
+        - long bulk jobs (adding users, resetting passwords) can be journalled and resumed if interrupted
         - remove
     Groups:
-        - list (groups and members)
+        - list (groups and members, or member counts, or the members of a big group a page at a time)
+        - nesting (which members are groups), for working out effective membership
         - add
         - remove
         - add members
@@ -19,12 +33,39 @@ Abilities so far:
         - add
     Computers:
         - list
+    Streaming:
+        - iter_users, iter_groups and iter_computers hand back one object at a time as the server pages through them
+    Export:
+        - users (with decoded flags and timestamps), groups and memberships to CSV or JSON Lines, written as they arrive
 """
 
-import paramiko
+import atexit
+import csv
+import itertools
+import json
+import os
 import re
+import shlex
+import threading
+from base64 import b64decode
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from enum import Enum
+from functools import lru_cache
 from getpass import getpass
+from sys import intern
+from time import time
+
+from samba_capabilities import SambaCapabilities, from_json, probe_command
+from samba_concurrency import AdaptiveConcurrency, run_concurrently
+from samba_dispatcher import SambaToolDispatcher, command_argv
+from samba_transport import LocalTransport, ShellPipeline, SshTransport, Transport
+
+# Where Samba from the distribution's packages keeps the directory database
+DEFAULT_SAM_LDB = '/var/lib/samba/private/sam.ldb'
+# Commands samba_commands sends back-to-back down each shell, when it runs several shells at once
+LANE_BATCH_SIZE = 10
 
 # Notes from the Samba help
 """Samba-tool commands:
@@ -158,14 +199,19 @@ def flatten(l, ltypes=(list, tuple)):
     return ltype(l)
 
 
+# Anything outside space to 'z', or one of the characters that cause trouble in names
+_rx_illegal_chars = re.compile(r'[^ -z]|[`~!@#$%,^&*()}{\[\]\'|\\:;"<>?/]')
+
+
 def all_legal_chars(s):
-    if not all(32 <= ord(c) <= 122 for c in s):
-        return False
+    return _rx_illegal_chars.search(s) is None
 
-    if re.search(r'[`~!@#$%,^&*()}{\[\]\'|\\:;"<>?/]', s):
-        return False
 
-    return True
+def ldap_escape(value: str) -> str:
+    """
+    Escape a value for use inside an LDAP filter, eg. a DN or name in (distinguishedName=...)
+    """
+    return ''.join(f'\\{ord(c):02x}' if c in '\\*()\0' else c for c in value)
 
 
 def validate_ip(ip):
@@ -200,25 +246,458 @@ def validate_list_of_strings(*user_input) -> tuple[list, list]:
     return validated, errors
 
 
+def parse_ldif(lines):
+    """
+    Parse LDIF, which is what ldbsearch and samba-tool's 'show' commands print, into one dictionary per record.
+    Handles folded long lines, base64 encoded values (attribute:: value) and comments.
+    Attributes with several values (eg. memberOf) become a list of values.
+    :param lines: iterable of lines of text, with or without their line endings
+    :return: generator of dictionaries - attribute: value
+    """
+    record = {}
+    logical_line = None
+
+    def add_line(line):
+        attribute, _, value = line.partition(':')
+        # Every record has the same attribute names, so share one copy of each
+        attribute = intern(attribute)
+        if value.startswith(':'):
+            value = b64decode(value[1:].strip()).decode('utf-8', errors='replace')
+        else:
+            value = value.lstrip(' ')
+        if attribute not in record:
+            record[attribute] = value
+        elif isinstance(record[attribute], list):
+            record[attribute].append(value)
+        else:
+            record[attribute] = [record[attribute], value]
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith(' ') and logical_line is not None:
+            # Folded line: carry on from the line above
+            logical_line += line[1:]
+            continue
+        if logical_line is not None:
+            add_line(logical_line)
+            logical_line = None
+        if line == '':
+            if record:
+                yield record
+                record = {}
+            continue
+        if line.startswith('#'):
+            continue
+        logical_line = line
+
+    if logical_line is not None:
+        add_line(logical_line)
+    if record:
+        yield record
+
+
+# Below this many lines of LDIF, parsing in other processes costs more than it saves
+PARALLEL_PARSE_MIN_LINES = 50000
+# Sending the parsed records back from the workers costs about a third of parsing them, so with fewer cores than
+# this it isn't worth it
+PARALLEL_PARSE_MIN_CORES = 4
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _parse_ldif_chunk(lines: list) -> list:
+    """Runs in a worker process of parse_ldif_in_processes"""
+    return list(parse_ldif(lines))
+
+
+def _split_ldif(lines: list, no_of_chunks: int) -> list:
+    """
+    Split LDIF into about no_of_chunks lists of lines, only ever at the blank line between two records.
+    """
+    lstChunks = []
+    step = max(1, len(lines) // no_of_chunks)
+    start = 0
+    while start < len(lines):
+        end = min(start + step, len(lines))
+        while end < len(lines) and lines[end].rstrip('\r\n') != '':
+            end += 1
+        lstChunks.append(lines[start:end])
+        start = end
+    return lstChunks
+
+
+def _get_parse_pool(processes: int):
+    """
+    The worker processes are started the first time they're needed and then kept, as starting them is slow.
+    They are spawned rather than forked, as forking a process that has SSH and GUI threads running is asking for trouble.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            import multiprocessing
+            _parse_pool = multiprocessing.get_context('spawn').Pool(processes)
+            atexit.register(_parse_pool.terminate)
+        return _parse_pool
+
+
+def parse_ldif_in_processes(lines, processes: int = None, min_lines: int = PARALLEL_PARSE_MIN_LINES) -> list:
+    """
+    parse_ldif for big dumps (eg. every attribute of every user): the LDIF is split at record boundaries and
+    the pieces are parsed in a pool of worker processes, so it uses every core and doesn't hold up the GUI
+    thread (the GIL) while it's at it. Small dumps are just parsed here.
+    :param lines: lines of LDIF, with or without their line endings
+    :param processes: worker processes. Defaults to one per core, if there are PARALLEL_PARSE_MIN_CORES or more.
+                      1 means never use other processes.
+                      The workers are spawned, so they import the main script again: a script that parses in
+                      processes must start from an "if __name__ == '__main__':" block, or they'll start it over.
+    :param min_lines: parse dumps shorter than this here
+    :return: list of dictionaries - attribute: value, in the same order as parse_ldif would give them
+    """
+    lines = lines if isinstance(lines, list) else list(lines)
+    if processes is None:
+        cores = os.cpu_count() or 1
+        processes = cores if cores >= PARALLEL_PARSE_MIN_CORES else 1
+    if len(lines) < min_lines or processes < 2:
+        return list(parse_ldif(lines))
+
+    lstRecords = []
+    for lstChunk_records in _get_parse_pool(processes).map(_parse_ldif_chunk, _split_ldif(lines, processes * 4)):
+        lstRecords.extend(lstChunk_records)
+    return lstRecords
+
+
+class LRUCache:
+    """
+    A dictionary with a size limit. Once it is full, the entry used the longest time ago is thrown out,
+    so memory stays flat however many things go through it, while the popular ones stay instant.
+    Thread safe, so the GUI's background threads can share one.
+    """
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 1:
+            raise ValueError("The cache must be able to hold at least one thing.")
+        self.maxsize = maxsize
+        self.dicItems = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.dicItems)
+
+    def __contains__(self, key):
+        return key in self.dicItems
+
+    def get(self, key, default=None):
+        """
+        :return: the cached value (which now counts as recently used), or default if it isn't cached
+        """
+        with self.lock:
+            try:
+                self.dicItems.move_to_end(key)
+            except KeyError:
+                return default
+            return self.dicItems[key]
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used one if we are full
+        """
+        with self.lock:
+            self.dicItems[key] = value
+            self.dicItems.move_to_end(key)
+            while len(self.dicItems) > self.maxsize:
+                self.dicItems.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Forget a value, eg. because it has changed on the server
+        """
+        with self.lock:
+            return self.dicItems.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.dicItems.clear()
+
+
+class JobJournal:
+    """
+    A record, kept in a local file, of a long bulk job (eg. adding 10k users or resetting their passwords),
+    so that if the app or the connection dies halfway through, running the job again carries on where it left off.
+    The file is only ever appended to, one JSON object per line:
+        {"event": "plan", "job": "add_users", "items": ["jsmith", "amy", ...], "time": ...}
+        {"event": "sent", "items": ["jsmith", "amy", ...]}
+        {"event": "done", "item": "jsmith"}
+        {"event": "failed", "item": "amy", "error": "..."}
+        {"event": "checkpoint", "done": 1000, "failed": 3, "time": ...}
+        {"event": "finished", "time": ...}
+    Every line is flushed as it is written, so a crash of the app loses nothing. Every checkpoint_every items,
+    the file is also synced to disk, so a crash of the whole computer loses at most that many.
+    Only the names of the items are written, never passwords.
+
+    Usage:
+        with JobJournal('import.jsonl') as journal:
+            ad.add_users(lstUsers, journal=journal)
+    A job can also be done in several calls (eg. a chunk of users at a time): start it with every item first,
+    then each call only does the items of its chunk that aren't done yet.
+    """
+    def __init__(self, path: str, checkpoint_every: int = 100):
+        """
+        :param path: the journal file. If it exists, it is read back in, ready to resume the job.
+        :param checkpoint_every: items between syncs to disk
+        """
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.job = None
+        self.lstPlanned = []
+        self.setDone = set()
+        self.dicFailed = {}  # item: error message
+        # Items sent to the DC by an earlier run, which was interrupted before it heard back about them
+        self.setSent_before = set()
+        self.finished = False
+        self.resumed = False  # True if the journal was read back in from an earlier run
+        self.file = None
+        self.since_checkpoint = 0
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    dicEvent = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line was being written when we were interrupted
+                    continue
+                event = dicEvent.get('event')
+                if event == 'plan':
+                    self.job = dicEvent['job']
+                    self.lstPlanned = dicEvent['items']
+                elif event == 'sent':
+                    self.setSent_before.update(dicEvent['items'])
+                elif event == 'done':
+                    self.setDone.add(dicEvent['item'])
+                    self.dicFailed.pop(dicEvent['item'], None)
+                    self.setSent_before.discard(dicEvent['item'])
+                elif event == 'failed':
+                    self.dicFailed[dicEvent['item']] = dicEvent.get('error', '')
+                    self.setSent_before.discard(dicEvent['item'])
+                elif event == 'finished':
+                    self.finished = True
+        if self.job is None:
+            # No plan, or only part of one: we were interrupted before the job had really started. Start afresh.
+            self.setDone.clear()
+            self.dicFailed.clear()
+            self.setSent_before.clear()
+            self.finished = False
+            open(self.path, 'w').close()
+            return
+        self.resumed = True
+
+    def _write(self, dicEvent: dict):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps(dicEvent) + '\n')
+        self.file.flush()
+
+    def start(self, job: str, items: list) -> list:
+        """
+        Start the job, or resume it if the journal already has it.
+        :param job: what the job is, eg. 'add_users'. Resuming a different job from the same journal is an error.
+        :param items: the names of everything the job will do, in order, eg. usernames.
+                      When resuming (or doing the job a chunk at a time), they must all be in the journal's plan:
+                      use is_resumable to check that a journal is for the same job before offering to resume it.
+        :return: the items still to do: all of them for a new job, the ones not done yet when resuming
+        """
+        with self.lock:
+            if self.job is None:
+                self.job = job
+                self.lstPlanned = list(items)
+                self._write({'event': 'plan', 'job': job, 'items': self.lstPlanned, 'time': time()})
+                # Without the plan, nothing after it means anything, so make sure it gets to the disk
+                os.fsync(self.file.fileno())
+            elif self.job != job:
+                raise SambaException(f"{self.path} is the journal of a {self.job} job, not {job}.")
+            elif not set(items) <= set(self.lstPlanned):
+                # A chunk of the job is fine, but anything that wasn't planned means it's a different job
+                raise SambaException(f"{self.path} is the journal of a {job} job with different items. "
+                                     f"Start a new journal for this one.")
+            return [item for item in items if item not in self.setDone]
+
+    def is_resumable(self, job: str, items: list) -> bool:
+        """
+        :return: True if the journal has this very job (the same items, in the same order), started but unfinished
+        """
+        return self.resumed and not self.finished and self.job == job and list(items) == self.lstPlanned
+
+    def sent(self, items: list):
+        """
+        Items are about to be sent to the DC. Synced to disk, so that if the job is interrupted before it hears
+        back, the next run knows which of them might have been done anyway (see sent_before).
+        """
+        with self.lock:
+            self._write({'event': 'sent', 'items': list(items)})
+            os.fsync(self.file.fileno())
+
+    def sent_before(self, item: str) -> bool:
+        """
+        :return: True if an earlier run sent the item to the DC and was interrupted before it heard what became of it
+        """
+        return item in self.setSent_before
+
+    def done(self, item: str):
+        with self.lock:
+            self.setDone.add(item)
+            self.dicFailed.pop(item, None)
+            self._write({'event': 'done', 'item': item})
+            self._count()
+
+    def failed(self, item: str, error: str):
+        """
+        An item went wrong. It will be tried again if the job is resumed.
+        """
+        with self.lock:
+            self.dicFailed[item] = error
+            self._write({'event': 'failed', 'item': item, 'error': error})
+            self._count()
+
+    def _count(self):
+        self.since_checkpoint += 1
+        if self.since_checkpoint >= self.checkpoint_every:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        self._write({'event': 'checkpoint', 'done': len(self.setDone), 'failed': len(self.dicFailed), 'time': time()})
+        os.fsync(self.file.fileno())
+        self.since_checkpoint = 0
+
+    def checkpoint(self):
+        """
+        Sync everything written so far to disk
+        """
+        with self.lock:
+            if self.file is not None:
+                self._checkpoint()
+
+    def finish(self):
+        """
+        Mark the job as finished, ie. everything in it was done.
+        """
+        with self.lock:
+            self.finished = True
+            self._write({'event': 'finished', 'time': time()})
+            self._checkpoint()
+
+    def remaining(self) -> list:
+        """
+        :return: the planned items not done yet (including the ones that failed)
+        """
+        return [item for item in self.lstPlanned if item not in self.setDone]
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                if self.since_checkpoint:
+                    self._checkpoint()
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class User:
     """Represents an Active Directory user.
     Can populate the class from the dict and just grab the info you want.
     More of a read-only class... Users should be managed through samba-tool.
+    Kept compact because the GUI can hold 100k of them: no per-user __dict__, the flags are stored as the
+    userAccountControl number and only turned into names when asked for, and the raw dictionary from
+    samba-tool is only kept if you ask for it.
     """
-    def __init__(self, dic_user={}):
+    __slots__ = ('username', 'password', 'given_name', 'surname', 'ou', 'must_change_at_next_login',
+                 '_user_account_control', '_dic_full_info')
+
+    # The attributes needed for a list of users. Fetching just these is much lighter than 'user show'.
+    summary_attributes = ('sAMAccountName', 'givenName', 'sn', 'userAccountControl')
+    # AD timestamps worth reporting on. See samba_directory.decode_user_columns.
+    timestamp_attributes = ('pwdLastSet', 'lastLogonTimestamp', 'accountExpires', 'lockoutTime')
+    # What get_users(full=True) asks for: what 'user show' gives, and the usual optional attributes, but not the
+    # password hashes and other secrets that only an all-attribute search of the database would turn up
+    detail_attributes = ('objectClass', 'cn', 'sn', 'givenName', 'initials', 'displayName', 'description', 'name',
+                         'instanceType', 'whenCreated', 'whenChanged', 'uSNCreated', 'uSNChanged', 'objectGUID',
+                         'objectSid', 'objectCategory', 'distinguishedName', 'sAMAccountName', 'sAMAccountType',
+                         'userPrincipalName', 'userAccountControl', 'primaryGroupID', 'memberOf', 'badPwdCount',
+                         'badPasswordTime', 'codePage', 'countryCode', 'lastLogoff', 'lastLogon', 'logonCount',
+                         'pwdLastSet', 'lastLogonTimestamp', 'accountExpires', 'lockoutTime', 'adminCount',
+                         'mail', 'telephoneNumber', 'mobile', 'physicalDeliveryOfficeName', 'department', 'company',
+                         'title', 'manager', 'employeeID', 'employeeNumber', 'info', 'wWWHomePage',
+                         'streetAddress', 'l', 'st', 'postalCode', 'co', 'homeDirectory', 'homeDrive', 'scriptPath',
+                         'profilePath', 'servicePrincipalName', 'uidNumber', 'gidNumber', 'loginShell',
+                         'unixHomeDirectory')
+
+    def __init__(self, dic_user={}, keep_raw: bool = True):
+        """
+        :param dic_user: dictionary of the user's attributes from samba-tool, or nothing to make a new user
+        :param keep_raw: False to drop dic_user once the user is populated from it, to save memory
+        """
         # Basic properties used if we want to make a new user
         self.username = ''
         self.password = ''
         self.given_name = ''
         self.surname = ''
-        self.flags = []
+        self._user_account_control = 0  # No flags
         # TO DO: Some checking to handle whether OU has 'OU=' at the beginning, or if it is in a sub ou
         self.ou = ''
         self.must_change_at_next_login = False  # For use when making new users
 
-        self.dic_full_info = dic_user
-        if self.dic_full_info != {}:
+        self._dic_full_info = dic_user
+        if self._dic_full_info != {}:
             self.populate_from_dict()
+        if not keep_raw:
+            self._dic_full_info = None
+
+    @property
+    def dic_full_info(self) -> dict:
+        """
+        The dictionary the user was populated from. Empty if it wasn't kept (see keep_raw).
+        """
+        return self._dic_full_info if self._dic_full_info is not None else {}
+
+    @dic_full_info.setter
+    def dic_full_info(self, dic_user: dict):
+        self._dic_full_info = dic_user
+
+    @property
+    def user_account_control(self):
+        """
+        The userAccountControl number the flags come from, or None if it wasn't available
+        """
+        return self._user_account_control
+
+    @property
+    def flags(self) -> list:
+        """
+        List of the names of the user's flags, eg. ['ACCOUNTDISABLE', 'NORMAL_ACCOUNT']
+        """
+        if self._user_account_control is None:
+            return ['FLAGS UNAVAILABLE']
+        return list(_decode_user_flags(self._user_account_control))
+
+    @flags.setter
+    def flags(self, flags: list):
+        if 'FLAGS UNAVAILABLE' in flags:
+            self._user_account_control = None
+            return
+        user_account_control = 0
+        for flag in flags:
+            try:
+                user_account_control |= AccountFlags[flag].value
+            except KeyError:
+                raise ValueError(f"{flag} is not a user flag.")
+        self._user_account_control = user_account_control
 
     def populate_from_dict(self):
         """
@@ -228,16 +707,16 @@ class User:
         """
         # What the hell... Can someone tell me why I have to try four different keys for username?
         try:
-            self.set_username(self.dic_full_info['sAMAccountName'])
+            self._set_from_server(self.set_username, 'username', self.dic_full_info['sAMAccountName'])
         except KeyError:
             try:
-                self.set_username(self.dic_full_info['sAMAccountName:'])
+                self._set_from_server(self.set_username, 'username', self.dic_full_info['sAMAccountName:'])
             except KeyError:
                 try:
-                    self.set_username(self.dic_full_info['userPrincipalName:'])
+                    self._set_from_server(self.set_username, 'username', self.dic_full_info['userPrincipalName:'])
                 except KeyError:
                     try:
-                        self.set_username(self.dic_full_info['userPrincipalName'])
+                        self._set_from_server(self.set_username, 'username', self.dic_full_info['userPrincipalName'])
                     except KeyError as e:
                         self.set_username("USERNAME UNAVAILABLE")
 
@@ -245,26 +724,36 @@ class User:
 
         # Okay something went wrong when they were designing the naming system
         try:
-            self.set_given_name(self.dic_full_info['givenName'])
+            self._set_from_server(self.set_given_name, 'given_name', self.dic_full_info['givenName'])
         except KeyError:
             try:
-                self.set_given_name(self.dic_full_info['givenName:'])
+                self._set_from_server(self.set_given_name, 'given_name', self.dic_full_info['givenName:'])
             except KeyError:
                 try:
-                    self.set_given_name(self.dic_full_info['cn'])
+                    self._set_from_server(self.set_given_name, 'given_name', self.dic_full_info['cn'])
                 except KeyError:
                     self.set_given_name('GIVEN NAME UNAVAILABLE')
 
         # Not having a surname is acceptable, but if you ask me, it should still be in the dictionary as ''
         try:
-            self.set_surname(self.dic_full_info['sn'])
+            self._set_from_server(self.set_surname, 'surname', self.dic_full_info['sn'])
         except KeyError:
             self.surname = ''
 
         try:
-            self.flags = self.parse_user_flags(self.dic_full_info['userAccountControl'])
+            self._user_account_control = int(self.dic_full_info['userAccountControl'])
         except KeyError:
-            self.flags = ['FLAGS UNAVAILABLE']
+            self._user_account_control = None
+
+    def _set_from_server(self, setter, attribute: str, value):
+        """
+        Names that are already on the server were accepted by Samba, even if they have characters our setters
+        turn down (accents, for example). Don't refuse to show those users, just take the names as they are.
+        """
+        try:
+            setter(value)
+        except (ValueError, SambaException):
+            setattr(self, attribute, value)
 
     def set_username(self, username: str):
         if not isinstance(username, str):
@@ -343,6 +832,263 @@ class User:
         return [flag.name for flag in AccountFlags if userAccountControl & flag.value == flag.value]
 
 
+@lru_cache(maxsize=None)
+def _decode_user_flags(userAccountControl: int) -> tuple:
+    """
+    Flag names for a userAccountControl number. Cached, because a whole domain only uses a handful of
+    different numbers, so every user with the same flags shares one tuple of the same (interned) names.
+    """
+    return tuple(User.parse_user_flags(userAccountControl))
+
+
+# Column headings accepted in a CSV of users to import (compared in lower case), and the User attribute each fills
+USER_CSV_HEADINGS = {
+    'username': 'username', 'user name': 'username', 'samaccountname': 'username', 'login': 'username',
+    'given name': 'given_name', 'given_name': 'given_name', 'givenname': 'given_name', 'first name': 'given_name',
+    'surname': 'surname', 'sn': 'surname', 'last name': 'surname', 'family name': 'surname',
+    'password': 'password',
+    'change at login': 'must_change_at_next_login', 'must change at next login': 'must_change_at_next_login',
+    'must_change_at_next_login': 'must_change_at_next_login',
+}
+# Without a heading row, the columns are taken to be in the same order as the Add users window
+USER_CSV_COLUMNS = ('username', 'given_name', 'surname', 'password', 'must_change_at_next_login')
+TRUE_STRINGS = ('1', 'true', 'yes', 'y', 'x')
+FALSE_STRINGS = ('0', 'false', 'no', 'n')
+
+
+# The same rules as all_legal_chars plus no space at the start, for a whole column of names joined by newlines
+_rx_bad_names = re.compile(r'^ |[^\n -z]|[`~!@#$%,^&*()}{\[\]\'|\\:;"<>?/]', re.MULTILINE)
+
+
+def _bad_names(values: list) -> list:
+    """
+    Which of a column of names the User setters would turn down (illegal characters or a space at the start).
+    The column is checked with one regular expression search over all of it rather than one per name.
+    :return: the indexes of the bad names, in order
+    """
+    text = '\n'.join(values)
+    if text.count('\n') != len(values) - 1:
+        # Some of the names have a line break in them (a quoted CSV cell). Those are bad anyway.
+        return [i for i, value in enumerate(values) if value and (value[0] == ' ' or _rx_illegal_chars.search(value))]
+    lstStarts = list(itertools.accumulate((len(value) + 1 for value in values[:-1]), initial=0))
+    lstBad = []
+    for match in _rx_bad_names.finditer(text):
+        i = bisect_right(lstStarts, match.start()) - 1
+        if not lstBad or lstBad[-1] != i:
+            lstBad.append(i)
+    return lstBad
+
+
+def _rows_to_users(lstLine_nos: list, lstRows: list, columns: tuple, setUsernames: set) -> tuple:
+    """
+    Check a chunk of CSV rows the way the User setters would, but a column at a time,
+    which is a lot quicker than making each row go through the setters one by one.
+    :param lstLine_nos: the line number of each row, for the error messages
+    :param lstRows: list of rows, each a list of len(columns) bits of text
+    :param columns: the User attribute in each column (None for columns to ignore)
+    :param setUsernames: lower case usernames seen in earlier chunks, to catch duplicates. Added to.
+    :return: list of user objects and list of (line number, error message) for the rows that failed
+    """
+    dicColumns = {attribute: list(values) for attribute, values in zip(columns, zip(*lstRows)) if attribute}
+    for attribute in USER_CSV_COLUMNS:
+        dicColumns.setdefault(attribute, [''] * len(lstRows))
+    dicErrors = {}
+
+    def fail(i, message):
+        dicErrors.setdefault(i, []).append(message)
+
+    for attribute, label, required in (('username', 'username', True), ('given_name', 'given name', True),
+                                       ('surname', 'surname', False)):
+        values = dicColumns[attribute]
+        for i in _bad_names(values):
+            if values[i][0] == ' ':
+                fail(i, f"The {label} starts with a space")
+            else:
+                fail(i, f"Illegal characters found in {label} {values[i]}")
+        if required:
+            for i in [i for i, value in enumerate(values) if value == '']:
+                fail(i, f"Please enter a {label}.")
+
+    for i in [i for i, password in enumerate(dicColumns['password']) if password == '']:
+        fail(i, "Please enter a password.")
+
+    lstMust_change = [value.strip().lower() for value in dicColumns['must_change_at_next_login']]
+    for i, value in enumerate(lstMust_change):
+        if value == '' or value in TRUE_STRINGS:
+            lstMust_change[i] = True
+        elif value in FALSE_STRINGS:
+            lstMust_change[i] = False
+        else:
+            fail(i, f"Change at login should be yes or no, not {value}")
+
+    for i, username in enumerate(dicColumns['username']):
+        if username.lower() in setUsernames:
+            fail(i, f"{username} is in the file more than once")
+        setUsernames.add(username.lower())
+
+    lstUsers = []
+    for i, (username, given_name, surname, password) in enumerate(zip(
+            dicColumns['username'], dicColumns['given_name'], dicColumns['surname'], dicColumns['password'])):
+        if i in dicErrors:
+            continue
+        # Already checked, so no need for the setters
+        usr = User()
+        usr.username = username
+        usr.given_name = given_name
+        usr.surname = surname
+        usr.password = password
+        usr.must_change_at_next_login = lstMust_change[i]
+        lstUsers.append(usr)
+    return lstUsers, [(lstLine_nos[i], ' '.join(lstMessages)) for i, lstMessages in dicErrors.items()]
+
+
+def read_user_csv(fp, chunk_size: int = 1000):
+    """
+    Read users to add from a CSV or TSV file (the delimiter is worked out from the start of the file).
+    The file is read as it goes rather than all at once, and checked a chunk of rows at a time.
+    The first row (that isn't blank) can be headings (see USER_CSV_HEADINGS), otherwise the columns are
+    username, given name, surname, password, change at login (yes/no, defaults to yes).
+        for lstUsers, lstErrors in read_user_csv('new_students.csv'):
+            ...
+    :param fp: path of the file, or a file opened in text mode with newline=''
+    :param chunk_size: rows per chunk
+    :return: generator of (list of user objects, list of (line number, error message)), a chunk at a time
+    """
+    if isinstance(fp, str):
+        with open(fp, newline='', encoding='utf-8-sig') as file:
+            yield from read_user_csv(file, chunk_size)
+        return
+
+    sample = fp.read(4096)
+    fp.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',\t;')
+    except csv.Error:
+        dialect = csv.excel_tab if '\t' in sample else csv.excel
+    reader = csv.reader(fp, dialect)
+
+    columns = USER_CSV_COLUMNS
+    setUsernames = set()
+    lstLine_nos = []
+    lstRows = []
+    lstErrors = []
+    first = True
+    for row in reader:
+        if not any(row):
+            continue
+        # The first row that isn't blank, so blank lines before the headings don't make them a user
+        if first:
+            first = False
+            if all(cell.strip().lower() in USER_CSV_HEADINGS for cell in row if cell.strip()):
+                columns = tuple(USER_CSV_HEADINGS.get(cell.strip().lower()) for cell in row)
+                if 'username' not in columns:
+                    raise ValueError("The CSV has headings but none of them is username")
+                continue
+        if len(row) > len(columns):
+            lstErrors.append((reader.line_num, f"Too many columns ({len(row)})"))
+            continue
+        if len(row) < len(columns):
+            row += [''] * (len(columns) - len(row))
+        lstLine_nos.append(reader.line_num)
+        lstRows.append(row)
+        if len(lstRows) >= chunk_size:
+            lstUsers, lstChunk_errors = _rows_to_users(lstLine_nos, lstRows, columns, setUsernames)
+            yield lstUsers, sorted(lstErrors + lstChunk_errors)
+            lstLine_nos = []
+            lstRows = []
+            lstErrors = []
+    if lstRows or lstErrors:
+        lstUsers, lstChunk_errors = _rows_to_users(lstLine_nos, lstRows, columns, setUsernames)
+        yield lstUsers, sorted(lstErrors + lstChunk_errors)
+
+
+def filetime_to_iso(value) -> str:
+    """
+    An AD timestamp (a Windows FILETIME, eg. pwdLastSet) as ISO 8601 UTC text, or '' for never/not set.
+    For a whole domain at once, samba_directory.decode_user_columns is quicker.
+    """
+    if not value:
+        return ''
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return ''
+    if value <= 0 or value >= 0x7FFFFFFFFFFFFFFF:
+        return ''
+    return (datetime(1601, 1, 1) + timedelta(microseconds=value // 10)).isoformat() + 'Z'
+
+
+class ExportWriter:
+    """
+    Writes rows to a CSV or JSON Lines file as they come, so an export never holds more than a row in memory.
+    """
+    def __init__(self, fp, columns: tuple, file_format: str = 'csv'):
+        """
+        :param fp: path of the file, or a file opened in text mode (with newline='' for CSV)
+        :param columns: the keys of each row, in order. CSV gets them as a heading row.
+        :param file_format: 'csv' or 'jsonl'
+        """
+        if file_format not in ('csv', 'jsonl'):
+            raise ValueError(f"Can't export to {file_format}. Please choose csv or jsonl.")
+        self.columns = columns
+        self.file_format = file_format
+        self.own_file = isinstance(fp, str)
+        self.file = open(fp, 'w', newline='', encoding='utf-8') if self.own_file else fp
+        self.no_of_rows = 0
+        if file_format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(columns)
+
+    def write(self, row: tuple):
+        """
+        :param row: values in the same order as the columns. Lists become '|' separated text in CSV.
+        """
+        if self.file_format == 'csv':
+            self.writer.writerow(['|'.join(value) if isinstance(value, (list, tuple)) else value for value in row])
+        else:
+            self.file.write(json.dumps(dict(zip(self.columns, row))) + '\n')
+        self.no_of_rows += 1
+
+    def close(self):
+        if self.own_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _output_dict(stdout: str, stderr: str) -> dict:
+    """Output from the dispatcher or the shell pipeline, in the same form as SshSamba._sh_command gives it"""
+    return {'stdin': None,
+            'stdout': stdout.split('\n') if stdout else None,
+            'stderr': stderr.split('\n') if stderr else None,
+            }
+
+
+def _parse_labelled(lines) -> dict:
+    """
+    samba-tool's 'Label: value' lines (eg. domain info, domain passwordsettings show) as a dictionary.
+    Lines without a colon are skipped. Only the first colon counts, so values can have colons in them.
+    """
+    dicLabelled = {}
+    for line in lines:
+        label, colon, value = line.partition(':')
+        if colon:
+            dicLabelled[label.strip()] = value.strip()
+    return dicLabelled
+
+
+def _already_exists(e: Exception) -> bool:
+    """Whether samba-tool's error says the thing we tried to add is there already"""
+    text = '\n'.join(e.args[0]) if e.args and isinstance(e.args[0], list) else str(e)
+    return 'already exists' in text.lower() or 'ENTRY_ALREADY_EXISTS' in text
+
+
 class AccountFlags(Enum):
     SCRIPT = 0x0001
     ACCOUNTDISABLE = 0x0002
@@ -379,7 +1125,28 @@ class AlliterationError(Exception):
 
 
 class SshSamba:
-    def __init__(self, ip_address='10.150.17.100'):
+    # What 'domain info' says, in its text
+    domain_info_labels = ('Forest', 'Domain', 'Netbios domain', 'DC name', 'DC netbios name', 'Server site',
+                          'Client site')
+    # What 'domain passwordsettings show' says, in its text, and the option 'domain passwordsettings set' takes for each
+    password_policy_options = {
+        'Password complexity': 'complexity',
+        'Store plaintext passwords': 'store-plaintext',
+        'Password history length': 'history-length',
+        'Minimum password length': 'min-pwd-length',
+        'Minimum password age (days)': 'min-pwd-age',
+        'Maximum password age (days)': 'max-pwd-age',
+        'Account lockout duration (mins)': 'account-lockout-duration',
+        'Account lockout threshold (attempts)': 'account-lockout-threshold',
+        'Reset account lockout after (mins)': 'reset-account-lockout',
+    }
+
+    def __init__(self, ip_address='10.150.17.100', transport: Transport = None):
+        """
+        :param ip_address: the domain controller
+        :param transport: how to run commands on it (see samba_transport). Leave it out to connect over SSH
+                          with connect_to_server, or use connect_locally when running on the DC itself.
+        """
         # Variables to make the connection:
         self.remote_server_ip = ip_address
         self.user = 'root'
@@ -423,7 +1190,31 @@ class SshSamba:
                                 'Terminal Server License Servers',
                                 'Account Operators')
         self.built_in_users = ('krbtgt',)
-        self.ssh = None  # Will be Paramiko SSH Client
+        self.transport = transport  # Will be SshTransport once connect_to_server is done
+        self.dispatcher = None  # See start_dispatcher
+        # Shells for samba_commands that aren't in use right now (see ShellPipeline), started when first needed.
+        # No more than one is kept once samba_commands is done.
+        self.pipelines = []
+        self._pipelines_lock = threading.Lock()
+        # How many commands bulk jobs run on the DC at once. Its limit and latency say how it's going.
+        # None = one at a time (pipelined through one shell where possible), the gentlest on the DC.
+        self.concurrency = AdaptiveConcurrency()
+        # SSH compression: True, False, or 'auto' to turn it on if big outputs come in slowly (see SshTransport)
+        self.compression = 'auto'
+
+        # The domain controller's database, for searches that would take one samba-tool call per object.
+        # If Samba is somewhere else on the DC, get_capabilities finds it.
+        self.sam_ldb = DEFAULT_SAM_LDB
+        # What the DC's samba-tool can do. Found out when first needed (see get_capabilities).
+        self.capabilities = None
+        self._capabilities_lock = threading.Lock()
+
+        # Full user details ('user show') of the users looked at most recently
+        self.user_cache = LRUCache(maxsize=256)
+        # Worker processes for parsing big LDIF dumps (see parse_ldif_in_processes). 1 = none (the default),
+        # None = one per core. Anything but 1 needs the script using SshSamba to start from an
+        # "if __name__ == '__main__':" block, as the workers are spawned and import the script again.
+        self.parse_processes = 1
 
     def set_ip(self, ip: str):
         """
@@ -453,37 +1244,97 @@ class SshSamba:
             raise ValueError("Passsword must be a string.")
         self.password = password
 
+    def set_compression(self, compression):
+        """
+        Setter for SSH compression, for the next connect_to_server.
+        Worth it over a slow link (VPN, another site) when listing lots of users; a waste of CPU on a LAN.
+        :param compression: True, False or 'auto'
+        :return: Silence = success
+        """
+        if compression not in (True, False, 'auto'):
+            raise ValueError("Compression must be True, False or 'auto'.")
+        self.compression = compression
+
     def connect_to_server(self):
         """
         Initialise the connection to the server.
         """
         print("Connecting to server...")
         print("")
-        self.ssh = paramiko.SSHClient()
-        self.ssh.load_system_host_keys()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(self.remote_server_ip, username=self.user, password=self.password)
+        transport = SshTransport(self.remote_server_ip, self.user, self.password, compress=self.compression)
 
         # OS should keep our memory safe from other processes, but I will overwrite and free the memory
-        # now we are finished with the password.
+        # now we are finished with the password. (The transport forgets its copy once it has logged in.)
         self.password = "sahjdio327nyc327qey273eyn921ye923e912eyn2yd283e7bh8237e2y38eb723ye8723ey738"
         del self.password
 
+        transport.connect()
+        self.transport = transport
+        self.capabilities = None
         print("Connected!")
 
+    def connect_locally(self, env: dict = None):
+        """
+        For running on the domain controller itself: run the commands here as subprocesses instead of over SSH.
+        No password needed, but samba-tool and ldbsearch need to be run by a user that can read the database (root).
+        :param env: extra environment variables for the commands (see LocalTransport)
+        """
+        self.remote_server_ip = '127.0.0.1'
+        self.transport = LocalTransport(env)
+        self.capabilities = None
+
+    def is_connected(self) -> bool:
+        """
+        :return: True once connect_to_server (or connect_locally) has finished and the connection is still up
+        """
+        return self.transport is not None and self.transport.is_connected()
+
+    def get_capabilities(self, refresh: bool = False) -> SambaCapabilities:
+        """
+        What the DC's samba-tool can do. Found out once per connection, with one command (see samba_capabilities).
+        Also points self.sam_ldb at wherever the DC keeps its database, if that's not the usual place.
+        :param refresh: True to ask again (eg. after Samba on the DC has been upgraded)
+        :return: SambaCapabilities. If the DC couldn't be asked, nothing is known and everything is done the old way.
+        """
+        with self._capabilities_lock:
+            if self.capabilities is None or refresh:
+                try:
+                    output = self._sh_command(probe_command())
+                    capabilities = SambaCapabilities([line for line in output['stdout'] or [] if line])
+                except (ConnectionError, OSError, UnicodeDecodeError):
+                    capabilities = SambaCapabilities()
+                if capabilities.private_dir and self.sam_ldb == DEFAULT_SAM_LDB:
+                    self.sam_ldb = capabilities.private_dir.rstrip('/') + '/sam.ldb'
+                self.capabilities = capabilities
+            return self.capabilities
+
+    def _samba_json(self, cmd: str, args: str, lstLabels, dicOptions: dict = None, required=None) -> dict:
+        """
+        A samba-tool command's output as JSON, with the names its text uses (see samba_capabilities.from_json).
+        :param cmd: the samba-tool command, eg. 'domain info'
+        :param args: what goes after it
+        :return: dictionary of label: value, or None if this samba-tool can't do it, so read the text instead
+        """
+        capabilities = self.get_capabilities()
+        if not capabilities.supports_json(cmd):
+            return None
+        try:
+            dicLabelled = from_json(json.loads('\n'.join(self.samba_command(f'{cmd} {args} --json'))),
+                                    lstLabels, dicOptions, required)
+        except (SambaException, ValueError):
+            dicLabelled = None
+        if dicLabelled is None:
+            capabilities.no_json(cmd)
+        return dicLabelled
+
     def get_domain(self) -> dict:
         """
         Get the domain info by asking the remote host
         :return: Dictionary containing the domain info from samba-tool
         """
-        domain_info = self.samba_command(f'domain info {self.remote_server_ip}')
-        dicDomain = {}
-
-        # Assumes no one is using colons in their naming...
-        domain_info = [line.split(':') for line in domain_info if line != '']
-        for line in domain_info:
-            dicDomain[line[0].rstrip(' ')] = line[1].lstrip(' ')
-
+        dicDomain = self._samba_json('domain info', self.remote_server_ip, self.domain_info_labels, required=('Domain',))
+        if dicDomain is None:
+            dicDomain = _parse_labelled(self.samba_command(f'domain info {self.remote_server_ip}'))
         return dicDomain
 
     def get_domain_long(self) -> str:
@@ -497,13 +1348,16 @@ class SshSamba:
         """
         Good practice to close the connection when you're done.
         """
-        self.ssh.close()
+        self.stop_dispatcher()
+        self._close_idle_pipelines()
+        if self.transport is not None:
+            self.transport.close()
 
     def _sh_command(self, cmd: str) -> dict:
         """
         Run a command and get the results back as a tuple of a list of strings.
-        :param cmd: any command to execute on the remote host through Paramiko SSH Client
-        :return: Dict of stdin, stdout, stderr as lists of strings (lines of text returned)
+        :param cmd: any command to execute on the remote host, through the shell (see samba_transport)
+        :return: Dict of stdin, stdout, stderr as lists of strings (lines of text returned). stdin is always None.
         """
         def process_stream(std: bytes):
             if std == b'':
@@ -513,31 +1367,64 @@ class SshSamba:
                 std = std.split('\n')
             return std
 
-        if not self.ssh:
-            raise ConnectionError("No SSH client active.")
-        stdin, stdout, stderr = self.ssh.exec_command(cmd)
-        try:
-            stdin = stdin.read()
-            stdin = process_stream(stdin)
-        except IOError:
-            stdin = None
+        if self.transport is None:
+            raise ConnectionError("Not connected to the domain controller.")
+        stdout, stderr = self.transport.run(cmd)
 
-        try:
-            stdout = stdout.read()
-            stdout = process_stream(stdout)
-        except IOError:
-            stdout = None
+        return {'stdin': None,
+                'stdout': process_stream(stdout),
+                'stderr': process_stream(stderr),
+                }
 
+    def _sh_command_stream(self, cmd: str):
+        """
+        Run a command and hand back its output a line at a time, as it arrives, instead of all at once at the end.
+        Raises SambaException at the end if the command wrote anything to stderr.
+        Stopping early (eg. breaking out of a for loop) stops the command.
+        :param cmd: any command to execute on the remote host, through the shell (see samba_transport)
+        :return: generator of lines of text, without line endings
+        """
+        if self.transport is None:
+            raise ConnectionError("Not connected to the domain controller.")
+        errors = yield from self.transport.stream(cmd)
+        if errors.strip():
+            raise SambaException(errors.split('\n'))
+
+    def start_dispatcher(self) -> bool:
+        """
+        Start one long-lived samba-tool process on the DC and send it every samba_command from now on, instead of
+        starting samba-tool afresh each time. Saves the Python start-up and Samba imports on every command,
+        which is most of the time a quick command takes. Worth it for anything that runs many commands.
+        :return: True if it started. False if it couldn't (eg. a samba-tool it doesn't understand),
+                 in which case everything carries on as before.
+        """
+        if self.dispatcher is not None:
+            return True
+        dispatcher = SambaToolDispatcher(self.transport)
         try:
-            stderr = stderr.read()
-            stderr = process_stream(stderr)
-        except IOError:
-            stderr = None
-
-        return {'stdin': stdin,
-                'stdout': stdout,
-                'stderr': stderr,
-                }
+            dispatcher.start()
+        except (ConnectionError, RuntimeError):
+            return False
+        self.dispatcher = dispatcher
+        return True
+
+    def stop_dispatcher(self):
+        """Go back to one samba-tool process per command"""
+        if self.dispatcher is not None:
+            dispatcher, self.dispatcher = self.dispatcher, None
+            dispatcher.close()
+
+    def _dispatch(self, argv: list) -> dict:
+        """
+        Run a samba-tool command in the dispatcher, with its output in the same form as _sh_command gives it.
+        """
+        try:
+            status, stdout, stderr = self.dispatcher.run(argv)
+        except ConnectionError as e:
+            # Might have been part way through the command, so it can't just be tried again
+            self.stop_dispatcher()
+            raise SambaException(f"samba-tool {' '.join(argv)}: {e}")
+        return _output_dict(stdout, stderr)
 
     def samba_command(self, cmd: str) -> list:
         """
@@ -546,7 +1433,122 @@ class SshSamba:
         :param cmd: the stuff that comes after typing 'samba-tool'
         :return: a list of of strings (lines of text returned)
         """
-        output = self._sh_command(f'samba-tool {cmd}')
+        argv = command_argv(cmd) if self.dispatcher is not None else None
+        if argv is not None:
+            output = self._dispatch(argv)
+        else:
+            output = self._sh_command(f'samba-tool {cmd}')
+        return self._samba_output(cmd, output)
+
+    def samba_commands(self, lstCmds: list):
+        """
+        Execute many samba-tool commands, sending them all to the DC back-to-back instead of waiting for each one
+        to finish before sending the next, which over a slow link saves a round trip per command.
+        If the dispatcher is running (see start_dispatcher) they go through it, one after another.
+        Otherwise they go through shells on the DC (see ShellPipeline): several at once, as many as
+        self.concurrency allows (see samba_concurrency), each sent LANE_BATCH_SIZE commands back-to-back,
+        or if self.concurrency is None, one shell with all of them.
+            for usr, result in zip(lstUsers, ad.samba_commands([f'user disable "{usr}"' for usr in lstUsers])):
+                if isinstance(result, Exception):
+                    ...
+        Stopping early doesn't unsend commands: the rest may still run.
+        :param lstCmds: list of the stuff that comes after typing 'samba-tool', one for each command
+        :return: generator of, for each command in order as soon as it is finished, what samba_command would return
+                 (a list of strings), or the exception (usually SambaException) it would have raised.
+                 Raises SambaException if the connection to the DC is lost part way.
+        """
+        lstCmds = list(lstCmds)
+        lstArgv = [command_argv(cmd) for cmd in lstCmds] if self.dispatcher is not None else None
+        replies = None
+        try:
+            if lstArgv is not None and None not in lstArgv:
+                replies = self.dispatcher.run_many(lstArgv)
+            elif self.concurrency is None:
+                replies = self._pipelined(lstCmds)
+            else:
+                replies = self._pipelined_in_lanes(lstCmds)
+            for cmd, (status, stdout, stderr) in zip(lstCmds, replies):
+                try:
+                    yield self._samba_output(cmd, _output_dict(stdout, stderr))
+                except SambaException as e:
+                    yield e
+        except ConnectionError as e:
+            if self.dispatcher is not None and not self.dispatcher.is_running():
+                self.stop_dispatcher()
+            raise SambaException(f"Lost the connection part way through the commands: {e}")
+        finally:
+            # zip doesn't ask for more than there are commands, so it's left waiting after the last reply.
+            # Finish it now, so the shell it used can be used again, rather than whenever it's thrown away
+            # (which could be a long time: the exceptions handed back hold on to this generator).
+            if replies is not None:
+                replies.close()
+
+    def _pipelined(self, lstCmds: list):
+        """
+        Run samba-tool commands back-to-back through a shell on the DC: one that isn't in use, or a new one
+        :return: generator of (exit status, stdout, stderr) for each command in order
+        """
+        if self.transport is None:
+            raise ConnectionError("Not connected to the domain controller.")
+        with self._pipelines_lock:
+            pipeline = self.pipelines.pop() if self.pipelines else ShellPipeline(self.transport)
+        try:
+            yield from pipeline.run_many([f'samba-tool {cmd}' for cmd in lstCmds])
+        finally:
+            with self._pipelines_lock:
+                self.pipelines.append(pipeline)
+
+    def _pipelined_in_lanes(self, lstCmds: list):
+        """
+        _pipelined, for batches of LANE_BATCH_SIZE commands, several batches at once as self.concurrency allows.
+        So each of the lanes still saves a round trip per command.
+        :return: generator of (exit status, stdout, stderr) for each command in order
+        """
+        lstBatches = [lstCmds[i:i + LANE_BATCH_SIZE] for i in range(0, len(lstCmds), LANE_BATCH_SIZE)]
+        results = run_concurrently(lambda lstBatch: list(self._pipelined(lstBatch)), lstBatches,
+                                   self.concurrency, cost=len)
+        try:
+            for replies in results:
+                if isinstance(replies, Exception):
+                    raise replies
+                yield from replies
+        finally:
+            # Waits for any lanes still going. Then only one shell is kept: the others would each hold one of
+            # the DC's few SSH sessions (see AdaptiveConcurrency's max_limit) for as long as this is connected.
+            results.close()
+            self._close_idle_pipelines(keep=1)
+
+    def _close_idle_pipelines(self, keep: int = 0):
+        """
+        Close the shells that samba_commands isn't using right now
+        :param keep: how many of them to keep for next time
+        """
+        with self._pipelines_lock:
+            lstPipelines, self.pipelines = self.pipelines[keep:], self.pipelines[:keep]
+        for pipeline in lstPipelines:
+            pipeline.close()
+
+    def _concurrently(self, func, items):
+        """
+        func(item) for each item, several at once as self.concurrency allows (or one at a time if it's None).
+        Failures of the command itself (SambaException, ValueError) don't count against the DC, anything else
+        (eg. a channel that wouldn't open) does.
+        :return: generator of func's result, or the exception it raised, for each item in order
+        """
+        if self.concurrency is None:
+            for item in items:
+                try:
+                    yield func(item)
+                except Exception as e:
+                    yield e
+            return
+        yield from run_concurrently(func, items, self.concurrency,
+                                    is_trouble=lambda e: not isinstance(e, (SambaException, ValueError)))
+
+    def _samba_output(self, cmd: str, output: dict) -> list:
+        """
+        The lines samba-tool wrote, from the output of _sh_command. Raises SambaException if it went wrong.
+        """
         if output['stderr']:
             # Error returned by SSH
             raise SambaException(output['stderr'])
@@ -559,25 +1561,125 @@ class SshSamba:
 
         return output['stdout']
 
-    def get_users(self) -> list:
+    def ldb_search(self, ldap_filter: str, attributes=(), base: str = None, scope: str = 'sub') -> list:
+        """
+        Search the domain controller's database directly with ldbsearch.
+        Gets the attributes of any number of objects in one go, instead of one samba-tool call per object.
+        :param ldap_filter: eg. '(objectClass=user)'
+        :param attributes: the attributes to get. Leave empty for all of them.
+        :param base: DN to start searching from. Defaults to the whole domain.
+        :param scope: 'sub', 'one' or 'base'
+        :return: list of dictionaries - attribute: value (see parse_ldif)
+        """
+        output = self._sh_command(self._ldb_search_command(ldap_filter, attributes, base, scope))
+        if output['stderr'] and any(output['stderr']):
+            raise SambaException(output['stderr'])
+        return parse_ldif_in_processes(output['stdout'] or [], processes=self.parse_processes)
+
+    def ldb_search_iter(self, ldap_filter: str, attributes=(), base: str = None, scope: str = 'sub', page_size: int = 500):
+        """
+        Like ldb_search, but hands back the objects one at a time as they arrive, so memory use stays the same
+        however big the domain is, and the first objects can be used before the last ones have been sent.
+        The server works through the search a page at a time too (the paged results control).
+        :param page_size: objects per page on the server
+        :return: generator of dictionaries - attribute: value (see parse_ldif)
+        """
+        return parse_ldif(self._sh_command_stream(self._ldb_search_command(ldap_filter, attributes, base, scope, page_size)))
+
+    def _ldb_search_command(self, ldap_filter: str, attributes=(), base: str = None, scope: str = 'sub',
+                            page_size: int = None) -> str:
+        """
+        The ldbsearch command line for ldb_search, for when it needs to be piped into something on the server.
+        Raises SambaException straight away if the DC is known not to have ldbsearch, so callers can fall back to
+        samba-tool without a round trip to find out.
+        """
+        if self.get_capabilities().ldbsearch is False:
+            raise SambaException("There's no ldbsearch on the domain controller.")
+        cmd = f'ldbsearch -H {shlex.quote(self.sam_ldb)} -s {scope}'
+        if page_size:
+            cmd += f' --controls=paged_results:1:{int(page_size)}'
+        if base:
+            cmd += f' -b {shlex.quote(base)}'
+        cmd += f' {shlex.quote(ldap_filter)}'
+        for attribute in attributes:
+            cmd += f' {shlex.quote(attribute)}'
+        return cmd
+
+    def get_users(self, full: bool = True) -> list:
         """
         Get details of all users
+        :param full:    True gets what 'user show' has to say about every user (User.detail_attributes).
+                        False gets just the User.summary_attributes of all users,
+                        which is plenty for a list of users. Use get_user for the rest when you need it.
+                        Either way it's one ldbsearch for the whole domain if possible. A full dump can be many
+                        megabytes, which can be parsed in worker processes (see parse_processes).
         :return: list of user objects
         """
+        try:
+            lstRecords = self.ldb_search('(&(objectCategory=person)(objectClass=user))',
+                                         User.detail_attributes if full else User.summary_attributes)
+        except SambaException:
+            # No ldbsearch (or no access to the database) on this DC, so do it the slow way
+            lstRecords = None
+        if lstRecords is not None:
+            return [User(dic_user=dicUsr, keep_raw=full) for dicUsr in lstRecords
+                    if 'sAMAccountName' in dicUsr and dicUsr['sAMAccountName'] not in self.built_in_users]
+
         lstUsers = self.samba_command('user list')
         lstUsers = [usr for usr in lstUsers if usr not in self.built_in_users and usr != '']
-        lst_user_objects = []
-        for usr in lstUsers:
-            lstUsr = self.samba_command(f'user show \"{usr}\"')
-            dicUsr = {}
-            for info in lstUsr:
-                if info != '':
-                    key, value = info.split(': ')
-                    dicUsr[key] = value
-            lst_user_objects.append(User(dic_user=dicUsr))
+        lst_user_objects = [self.get_user(usr) for usr in lstUsers]
 
         return lst_user_objects
 
+    def get_user_columns(self, attributes=None) -> dict:
+        """
+        Get attributes of all users as columns, ready for samba_directory.decode_user_columns.
+        One ldbsearch for the whole domain.
+        :param attributes: the attributes to get. Defaults to User.summary_attributes and User.timestamp_attributes.
+        :return: dictionary - attribute: [value for each user]. Every column is in the same user order,
+                 with None where a user doesn't have that attribute. Multi-valued attributes come back as lists.
+                 There is always a 'dn' column too.
+        """
+        if attributes is None:
+            attributes = User.summary_attributes + User.timestamp_attributes
+        attributes = list(attributes)
+        if 'sAMAccountName' not in attributes:
+            attributes.insert(0, 'sAMAccountName')
+
+        dicColumns = {attribute: [] for attribute in attributes + ['dn']}
+        for dicUsr in self.ldb_search('(&(objectCategory=person)(objectClass=user))', attributes):
+            if dicUsr.get('sAMAccountName') in self.built_in_users or 'sAMAccountName' not in dicUsr:
+                continue
+            for attribute, column in dicColumns.items():
+                column.append(dicUsr.get(attribute))
+        return dicColumns
+
+    def get_user(self, username: str, use_cache: bool = True) -> User:
+        """
+        Get all the details of one user.
+        The most recently looked at users are kept in self.user_cache, so looking at them again is instant.
+        :param username: the user's login name
+        :param use_cache: False to always ask the server
+        :return: user object
+        """
+        if use_cache:
+            usr = self.user_cache.get(username)
+            if usr is not None:
+                return usr
+
+        lstUsr = self.samba_command(f'user show \"{username}\"')
+        dicUsr = next(parse_ldif(lstUsr), {})
+        usr = User(dic_user=dicUsr)
+        self.user_cache.put(username, usr)
+        return usr
+
+    def _forget_users(self, lstUsers):
+        """
+        Drop users from the cache after changing them
+        """
+        for usr in lstUsers:
+            self.user_cache.pop(usr.username if isinstance(usr, User) else usr)
+
     def _get_group_members(self, grp: str) -> list:
         """
         Get the members of group. To be called by 'get groups'. I made it private but I guess you can use it if you like.
@@ -587,16 +1689,334 @@ class SshSamba:
         lstUsers = [usr for usr in lstUsers if usr not in self.built_in_users and usr != '']
         return lstUsers
 
-    def get_groups(self) -> dict:
+    def get_groups(self, max_members: int = None, member_counts: dict = None) -> dict:
         """
         Get all non-built-in groups and members
+        :param max_members: if given, groups with more members than this only get their first max_members members.
+                            Use iter_group_members for the rest and get_group_member_counts for how many there are.
+        :param member_counts: the result of get_group_member_counts, if you already have it
         :return: dictionary -  group name: [group member, group member]
         """
         lstGroups = self.samba_command('group list')
         lstGroups = [grp for grp in lstGroups if grp not in self.built_in_groups and grp != '']
-        dicGroups = {group: self._get_group_members(group) for group in lstGroups}
+        if max_members is not None and member_counts is None:
+            member_counts = self.get_group_member_counts()
+
+        def get_members(group):
+            if max_members is not None and member_counts.get(group, 0) > max_members:
+                return next(self.iter_group_members(group, page_size=max_members), [])
+            return self._get_group_members(group)
+
+        # A samba-tool call per group, so several at once (see self.concurrency)
+        dicGroups = {}
+        for group, members in zip(lstGroups, self._concurrently(get_members, lstGroups)):
+            if isinstance(members, Exception):
+                raise members
+            dicGroups[group] = members
         return dicGroups
 
+    def _get_group_dn(self, grp: str) -> str:
+        lstRecords = self.ldb_search(f'(&(objectClass=group)(sAMAccountName={ldap_escape(grp)}))', ('dn',))
+        if not lstRecords:
+            raise SambaException(f"No such group: {grp}")
+        return lstRecords[0]['dn']
+
+    def count_group_members(self, grp: str) -> int:
+        """
+        How many members a group has, without fetching them: they are counted on the server.
+        :param grp: group name
+        :return: number of members
+        """
+        cmd = self._ldb_search_command(f'(&(objectClass=group)(sAMAccountName={ldap_escape(grp)}))', ('member',))
+        output = self._sh_command(f"{cmd} | grep -c '^member:'")
+        if output['stderr'] and any(output['stderr']):
+            raise SambaException(output['stderr'])
+        return int(output['stdout'][0])
+
+    def get_group_member_counts(self) -> dict:
+        """
+        How many members each (non-built-in) group has, without fetching the members: they are counted on the server.
+        Falls back to fetching every group's members if there's no ldbsearch.
+        :return: dictionary - group name: number of members
+        """
+        try:
+            cmd = self._ldb_search_command('(objectClass=group)', ('sAMAccountName', 'member'))
+        except SambaException:
+            return {grp: len(members) for grp, members in self.get_groups().items()}
+        awk = ('/^dn:/ {name = ""; count = 0} /^sAMAccountName:/ {name = $0} /^member:/ {count++} '
+               '/^$/ {if (name != "") print count "\\t" name; name = ""} END {if (name != "") print count "\\t" name}')
+        output = self._sh_command(f"{cmd} | awk {shlex.quote(awk)}")
+        if output['stderr'] and any(output['stderr']):
+            return {grp: len(members) for grp, members in self.get_groups().items()}
+
+        dicCounts = {}
+        for line in output['stdout'] or []:
+            count, _, name_line = line.partition('\t')
+            if name_line:
+                grp = next(parse_ldif([name_line]))['sAMAccountName']
+                if grp not in self.built_in_groups:
+                    dicCounts[grp] = int(count)
+        return dicCounts
+
+    def _names_of_dns(self, lstDns: list, batch_size: int = 1000) -> dict:
+        """
+        Look up the sAMAccountNames of a lot of objects by DN, a batch of DNs per search.
+        :return: dictionary - lower case DN: name
+        """
+        dicNames = {}
+        for first in range(0, len(lstDns), batch_size):
+            ldap_filter = '(|' + ''.join(f'(distinguishedName={ldap_escape(dn)})' for dn in lstDns[first:first + batch_size]) + ')'
+            for dicRecord in self.ldb_search(ldap_filter, ('sAMAccountName',)):
+                if 'dn' in dicRecord and 'sAMAccountName' in dicRecord:
+                    dicNames[dicRecord['dn'].lower()] = dicRecord['sAMAccountName']
+        return dicNames
+
+    def _page_members_with_samba_tool(self, grp: str, page_size: int, start: int, with_offsets: bool = False):
+        lstMembers = self._get_group_members(grp)
+        for first in range(start, len(lstMembers), page_size):
+            lstPage = lstMembers[first:first + page_size]
+            if with_offsets:
+                yield lstPage, (first + page_size if first + page_size < len(lstMembers) else None)
+            else:
+                yield lstPage
+
+    def iter_group_members(self, grp: str, page_size: int = 1000, start: int = 0, with_offsets: bool = False):
+        """
+        Get the members of a group a page at a time, for groups too big to fetch (or show) in one go.
+        Uses ranged retrieval of the member attribute (member;range=0-999, member;range=1000-1999, ...),
+        so the server never has to send more than one page at once.
+        Falls back to fetching all the members with samba-tool and handing them out a page at a time.
+        :param grp: group name
+        :param page_size: members per page
+        :param start: the number of members to skip, eg. to carry on from the pages you already have.
+                      Built-in and unknown members are left out of the pages, so carry on from the offset
+                      with_offsets gives, not from how many members you have.
+        :param with_offsets: True to get (page, start for the next page) instead of just each page.
+                             The start for the next page is None after the last page.
+        :return: generator of lists of usernames (and group names of nested groups), at most page_size long
+        """
+        try:
+            group_dn = self._get_group_dn(grp)
+        except SambaException:
+            yield from self._page_members_with_samba_tool(grp, page_size, start, with_offsets)
+            return
+
+        first_page = True
+        while True:
+            lstRecords = self.ldb_search('(objectClass=group)', (f'member;range={start}-{start + page_size - 1}',),
+                                         base=group_dn, scope='base')
+            dicRecord = lstRecords[0] if lstRecords else {}
+            attribute = next((key for key in dicRecord if key.startswith('member;range=')), None)
+            if attribute is None:
+                if first_page:
+                    # This database doesn't do ranged retrieval
+                    yield from self._page_members_with_samba_tool(grp, page_size, start, with_offsets)
+                return
+            lstDns = dicRecord[attribute] if isinstance(dicRecord[attribute], list) else [dicRecord[attribute]]
+
+            dicNames = self._names_of_dns(lstDns)
+            lstPage = [dicNames.get(dn.lower()) for dn in lstDns]
+            lstPage = [usr for usr in lstPage if usr and usr not in self.built_in_users]
+            # The server says when that was the last page
+            last = attribute.endswith('-*')
+            start += len(lstDns)
+            yield (lstPage, None if last else start) if with_offsets else lstPage
+
+            if last:
+                return
+            first_page = False
+
+    def get_group_nesting(self) -> dict:
+        """
+        Get every group (built-in ones too, as those are the ones that matter most, eg. Domain Admins)
+        with its direct members split into users and groups, for working out nested membership.
+        One ldbsearch if possible, otherwise a samba-tool call per group.
+        :return: dictionary - group name: {'users': [username, username], 'groups': [group name, group name]}
+        """
+        try:
+            lstRecords = self.ldb_search('(|(objectClass=group)(objectClass=user))', ('sAMAccountName', 'objectClass', 'member'))
+        except SambaException:
+            lstRecords = None
+
+        if lstRecords is not None:
+            dicNames = {}  # DN: (name, is a group)
+            for dicRecord in lstRecords:
+                if 'sAMAccountName' in dicRecord and 'dn' in dicRecord:
+                    classes = dicRecord.get('objectClass', [])
+                    if isinstance(classes, str):
+                        classes = [classes]
+                    dicNames[dicRecord['dn'].lower()] = (dicRecord['sAMAccountName'], 'group' in classes)
+            dicNesting = {}
+            for dicRecord in lstRecords:
+                name, is_group = dicNames.get(dicRecord.get('dn', '').lower(), (None, False))
+                if not is_group:
+                    continue
+                members = dicRecord.get('member', [])
+                if isinstance(members, str):
+                    members = [members]
+                dicMembers = dicNesting[name] = {'users': [], 'groups': []}
+                for member_dn in members:
+                    if member_dn.lower() in dicNames:
+                        member, member_is_group = dicNames[member_dn.lower()]
+                        dicMembers['groups' if member_is_group else 'users'].append(member)
+            return dicNesting
+
+        lstGroups = [grp for grp in self.samba_command('group list') if grp != '']
+        setGroups = set(lstGroups)
+        dicNesting = {}
+        for grp in lstGroups:
+            members = [mem for mem in self.samba_command(f'group listmembers \"{grp}\"') if mem != '']
+            dicNesting[grp] = {'users': [mem for mem in members if mem not in setGroups],
+                               'groups': [mem for mem in members if mem in setGroups]}
+        return dicNesting
+
+    def iter_users(self, page_size: int = 500, attributes: tuple = User.summary_attributes):
+        """
+        Go through the users one at a time, with the same details as get_users(full=False), without waiting for
+        (or keeping) the whole list. Stop whenever you like.
+            for usr in ad.iter_users():
+                ...
+        Falls back to samba-tool, a call per user, if there's no ldbsearch.
+        :param page_size: users per page on the server
+        :param attributes: what to get for each user: User.summary_attributes and any more you need,
+                           which are kept in each user's dic_full_info. samba-tool gets everything anyway.
+        :return: generator of user objects
+        """
+        keep_raw = not set(attributes) <= set(User.summary_attributes)
+        started = False
+        try:
+            for dicUsr in self.ldb_search_iter('(&(objectCategory=person)(objectClass=user))', attributes,
+                                               page_size=page_size):
+                if 'sAMAccountName' in dicUsr and dicUsr['sAMAccountName'] not in self.built_in_users:
+                    started = True
+                    yield User(dic_user=dicUsr, keep_raw=keep_raw)
+        except SambaException:
+            if started:
+                raise
+            for username in self.samba_command('user list'):
+                if username not in self.built_in_users and username != '':
+                    yield self.get_user(username)
+
+    def iter_groups(self, page_size: int = 100):
+        """
+        Go through the (non-built-in) groups one at a time, with their members, without waiting for (or keeping)
+        all of them. The members of a page of groups are looked up together.
+        Falls back to samba-tool, a call per group, if there's no ldbsearch.
+        :param page_size: groups per page
+        :return: generator of (group name, [group member, group member])
+        """
+        started = False
+        try:
+            lstPage = []
+            for dicGrp in self.ldb_search_iter('(objectClass=group)', ('sAMAccountName', 'member'), page_size=page_size):
+                grp = dicGrp.get('sAMAccountName')
+                if grp is None or grp in self.built_in_groups:
+                    continue
+                members = dicGrp.get('member', [])
+                lstPage.append((grp, [members] if isinstance(members, str) else members))
+                if len(lstPage) >= page_size:
+                    started = True
+                    yield from self._name_group_members(lstPage)
+                    lstPage = []
+            started = True
+            yield from self._name_group_members(lstPage)
+        except SambaException:
+            if started:
+                raise
+            for grp in self.samba_command('group list'):
+                if grp not in self.built_in_groups and grp != '':
+                    yield grp, self._get_group_members(grp)
+
+    def _name_group_members(self, lstPage: list):
+        """Turn the member DNs of a page of groups into names, like _get_group_members returns them"""
+        dicNames = self._names_of_dns([dn for _, lstDns in lstPage for dn in lstDns])
+        for grp, lstDns in lstPage:
+            members = [dicNames.get(dn.lower()) for dn in lstDns]
+            yield grp, [mem for mem in members if mem and mem not in self.built_in_users]
+
+    def iter_computers(self, page_size: int = 500):
+        """
+        Go through the computers' names one at a time, without waiting for (or keeping) the whole list.
+        Falls back to samba-tool if there's no ldbsearch.
+        :param page_size: computers per page on the server
+        :return: generator of computer names (like get_computers)
+        """
+        started = False
+        try:
+            for dicComputer in self.ldb_search_iter('(objectClass=computer)', ('sAMAccountName',), page_size=page_size):
+                if 'sAMAccountName' in dicComputer:
+                    started = True
+                    yield dicComputer['sAMAccountName']
+        except SambaException:
+            if started:
+                raise
+            yield from (computer for computer in self.get_computers() if computer != '')
+
+    def export_users(self, fp, file_format: str = 'csv', page_size: int = 500) -> int:
+        """
+        Write every user to a CSV or JSON Lines file, with their flags decoded and their timestamps as ISO 8601 (UTC).
+        Users are written as they arrive from the server (see iter_users), so memory use stays flat.
+        :param fp: path of the file, or a file opened in text mode (with newline='' for CSV)
+        :param file_format: 'csv' or 'jsonl'
+        :param page_size: users per page on the server
+        :return: the number of users written
+        """
+        columns = ('username', 'given_name', 'surname', 'flags', 'dn') + User.timestamp_attributes
+        with ExportWriter(fp, columns, file_format) as writer:
+            for usr in self.iter_users(page_size=page_size,
+                                       attributes=User.summary_attributes + User.timestamp_attributes):
+                dicUsr = usr.dic_full_info
+                writer.write((usr.username, usr.given_name, usr.surname, usr.flags, dicUsr.get('dn', ''))
+                             + tuple(filetime_to_iso(dicUsr.get(attribute)) for attribute in User.timestamp_attributes))
+            return writer.no_of_rows
+
+    def export_groups(self, fp_groups, fp_memberships=None, file_format: str = 'csv', page_size: int = 100) -> int:
+        """
+        Write every (non-built-in) group with its number of members and, optionally, every membership
+        (one group, member pair per row) to CSV or JSON Lines files. Both come from one pass over the groups
+        (see iter_groups), written as they arrive.
+        :param fp_groups: path of the groups file, or a file opened in text mode (with newline='' for CSV)
+        :param fp_memberships: the same for the memberships file, or None to leave them out
+        :param file_format: 'csv' or 'jsonl'
+        :param page_size: groups per page
+        :return: the number of groups written
+        """
+        return self._export_groups(fp_groups, fp_memberships, file_format, page_size)[0]
+
+    def _export_groups(self, fp_groups, fp_memberships, file_format: str, page_size: int) -> tuple:
+        """
+        export_groups, for export_directory too
+        :return: (groups written, memberships written)
+        """
+        with ExportWriter(fp_groups, ('group', 'members'), file_format) as writer_groups:
+            writer_memberships = ExportWriter(fp_memberships, ('group', 'member'), file_format) \
+                if fp_memberships is not None else None
+            try:
+                for grp, members in self.iter_groups(page_size=page_size):
+                    writer_groups.write((grp, len(members)))
+                    if writer_memberships is not None:
+                        for member in members:
+                            writer_memberships.write((grp, member))
+            finally:
+                if writer_memberships is not None:
+                    writer_memberships.close()
+            return writer_groups.no_of_rows, writer_memberships.no_of_rows if writer_memberships is not None else 0
+
+    def export_directory(self, folder: str, file_format: str = 'csv') -> dict:
+        """
+        Export users, groups and memberships into a folder as users.csv, groups.csv and memberships.csv
+        (or .jsonl), for reporting.
+        :param folder: where to put the files. Made if it isn't there.
+        :param file_format: 'csv' or 'jsonl'
+        :return: dictionary - file path: number of rows written
+        """
+        os.makedirs(folder, exist_ok=True)
+        fpUsers, fpGroups, fpMemberships = (os.path.join(folder, f'{name}.{file_format}')
+                                            for name in ('users', 'groups', 'memberships'))
+        dicWritten = {fpUsers: self.export_users(fpUsers, file_format)}
+        dicWritten[fpGroups], dicWritten[fpMemberships] = self._export_groups(fpGroups, fpMemberships, file_format, 100)
+        return dicWritten
+
     def get_organizational_units(self) -> list:
         """
         Get a list of the OUs in the domain
@@ -619,6 +2039,13 @@ class SshSamba:
         Internal use only - please make a user object and use self.add_users instead.
         Silence = success. Exception will be raised if something went wrong
         """
+        self.samba_command(self._add_user_command(username, pw, given_name, surname, must_change_at_next_login))
+
+    @staticmethod
+    def _add_user_command(username, pw, given_name='', surname='', must_change_at_next_login=True) -> str:
+        """
+        The samba-tool command for _add_user. Raises ValueError if any of the names won't do.
+        """
         if not all_legal_chars(username):
             raise ValueError("Illegal characters found in username")
         if not all_legal_chars(given_name):
@@ -627,34 +2054,66 @@ class SshSamba:
             raise ValueError("Illegal characters found in surname")
 
         if must_change_at_next_login:
-            self.samba_command(f"user create \"{username}\" \"{pw}\" --given-name=\"{given_name}\" --surname=\"{surname}\" --must-change-at-next-login")
+            return f"user create \"{username}\" \"{pw}\" --given-name=\"{given_name}\" --surname=\"{surname}\" --must-change-at-next-login"
         else:
-            self.samba_command(f"user create \"{username}\" \"{pw}\" --given-name=\"{given_name}\" --surname=\"{surname}\"")
+            return f"user create \"{username}\" \"{pw}\" --given-name=\"{given_name}\" --surname=\"{surname}\""
 
-    def add_users(self, lstUsers):
+    def add_users(self, lstUsers, journal: JobJournal = None):
         """
         Add a list of users to the domain. Users must be a user object please.
         :param lstUsers: List (or not) of user objects
+        :param journal: record progress here, and skip the users it says were already added (see JobJournal).
+                        Resuming after an interruption, a user that turns out to exist already counts as added,
+                        but only if the run that was interrupted had sent it: otherwise the username belongs to
+                        somebody else.
         Silence = success. Exception will be raised if something went wrong
         """
         if not isinstance(lstUsers, list):
             lstUsers = [lstUsers]
 
         lstErrors = []
+        if journal is not None:
+            setTo_do = set(journal.start('add_users', [usr.username for usr in lstUsers if isinstance(usr, User)]))
 
+        lstTo_add = []  # (user, samba-tool command)
         for usr in lstUsers:
             if not isinstance(usr, User):
                 lstErrors.append(f'{usr} is not a user object')
                 continue
+            if journal is not None and usr.username not in setTo_do:
+                continue
             try:
-                self._add_user(usr.username,
-                               usr.password,
-                               given_name=usr.given_name,
-                               surname=usr.surname,
-                               must_change_at_next_login=usr.must_change_at_next_login)
-            except Exception as e:
+                lstTo_add.append((usr, self._add_user_command(usr.username,
+                                                              usr.password,
+                                                              given_name=usr.given_name,
+                                                              surname=usr.surname,
+                                                              must_change_at_next_login=usr.must_change_at_next_login)))
+            except ValueError as e:
                 lstErrors.append(repr(e))
+                if journal is not None:
+                    journal.failed(usr.username, repr(e))
 
+        # Sent back-to-back rather than one at a time (see samba_commands). The results come back in order
+        # as each user is added, so the journal is as up to date as ever.
+        if journal is not None and lstTo_add:
+            journal.sent([usr.username for usr, _ in lstTo_add])
+        try:
+            for (usr, _), result in zip(lstTo_add, self.samba_commands([cmd for _, cmd in lstTo_add])):
+                if not isinstance(result, Exception):
+                    if journal is not None:
+                        journal.done(usr.username)
+                elif journal is not None and journal.sent_before(usr.username) and _already_exists(result):
+                    # Added just before the interruption, but not written down
+                    journal.done(usr.username)
+                else:
+                    lstErrors.append(repr(result))
+                    if journal is not None:
+                        journal.failed(usr.username, repr(result))
+        except SambaException as e:
+            lstErrors.append(repr(e))
+
+        if journal is not None and not journal.remaining():
+            journal.finish()
         if len(lstErrors) > 0:
             errors = '\n'.join(lstErrors)
             raise SambaException(f"Errors when adding users: {errors}")
@@ -669,14 +2128,16 @@ class SshSamba:
             lstUsers = [lstUsers]
 
         lstErrors = []
+        lstNames = [usr.username if isinstance(usr, User) else usr for usr in lstUsers]
 
-        for usr in lstUsers:
-            if isinstance(usr, User):
-                usr = usr.username
-            try:
-                self.samba_command(f'user delete \"{usr}\"')
-            except Exception as e:
-                lstErrors.append(repr(e))
+        try:
+            # Sent back-to-back rather than one at a time (see samba_commands)
+            for result in self.samba_commands([f'user delete \"{usr}\"' for usr in lstNames]):
+                if isinstance(result, Exception):
+                    lstErrors.append(repr(result))
+        except SambaException as e:
+            lstErrors.append(repr(e))
+        self._forget_users(lstUsers)
 
         if len(lstErrors) > 0:
             errors = '\n'.join(lstErrors)
@@ -692,14 +2153,16 @@ class SshSamba:
             lstUsers = [lstUsers]
 
         lstErrors = []
+        lstNames = [usr.username if isinstance(usr, User) else usr for usr in lstUsers]
 
-        for usr in lstUsers:
-            if isinstance(usr, User):
-                usr = usr.username
-            try:
-                self.samba_command(f'user disable \"{usr}\"')
-            except Exception as e:
-                lstErrors.append(repr(e))
+        try:
+            # Sent back-to-back rather than one at a time (see samba_commands)
+            for result in self.samba_commands([f'user disable \"{usr}\"' for usr in lstNames]):
+                if isinstance(result, Exception):
+                    lstErrors.append(repr(result))
+        except SambaException as e:
+            lstErrors.append(repr(e))
+        self._forget_users(lstUsers)
 
         if len(lstErrors) > 0:
             errors = '\n'.join(lstErrors)
@@ -715,20 +2178,23 @@ class SshSamba:
             lstUsers = [lstUsers]
 
         lstErrors = []
+        lstNames = [usr.username if isinstance(usr, User) else usr for usr in lstUsers]
 
-        for usr in lstUsers:
-            if isinstance(usr, User):
-                usr = usr.username
-            try:
-                self.samba_command(f'user enable \"{usr}\"')
-            except Exception as e:
-                lstErrors.append(repr(e))
+        try:
+            # Sent back-to-back rather than one at a time (see samba_commands)
+            for result in self.samba_commands([f'user enable \"{usr}\"' for usr in lstNames]):
+                if isinstance(result, Exception):
+                    lstErrors.append(repr(result))
+        except SambaException as e:
+            lstErrors.append(repr(e))
+        self._forget_users(lstUsers)
 
         if len(lstErrors) > 0:
             errors = '\n'.join(lstErrors)
             raise SambaException(f"Errors when enabling users: {errors}")
 
     def password_user(self, user, password, must_change_at_next_login=False):
+        self._forget_users([user])
         if must_change_at_next_login:
             self.samba_command(f'user setpassword \"{user}\" --newpassword=\"{password}\" --must-change-at-next-login')
         else:
@@ -755,6 +2221,41 @@ class SshSamba:
                 
                 
 
+    def password_users(self, lstPasswords, must_change_at_next_login=False, journal: JobJournal = None):
+        """
+        Reset the passwords of a lot of users.
+        :param lstPasswords: list of (username, new password)
+        :param must_change_at_next_login: make them all choose a new password when they next log in
+        :param journal: record progress here, and skip the users it says are already done (see JobJournal).
+                        Setting a password twice does no harm, so a user cut off halfway is just done again.
+        Silence = success. Exception will be raised if something went wrong
+        """
+        lstErrors = []
+        if journal is not None:
+            setTo_do = set(journal.start('password_users', [usr for usr, _ in lstPasswords]))
+
+        if journal is not None:
+            lstPasswords = [(usr, password) for usr, password in lstPasswords if usr in setTo_do]
+
+        def set_password(usr_password):
+            self.password_user(*usr_password, must_change_at_next_login=must_change_at_next_login)
+
+        # Several at once (see self.concurrency). The results come back in order, as each finishes.
+        for (usr, _), result in zip(lstPasswords, self._concurrently(set_password, lstPasswords)):
+            if isinstance(result, Exception):
+                error = result.args[0] if result.args and isinstance(result.args[0], str) else repr(result)
+                lstErrors.append(f"{usr}: {error}")
+                if journal is not None:
+                    journal.failed(usr, error)
+            elif journal is not None:
+                journal.done(usr)
+
+        if journal is not None and not journal.remaining():
+            journal.finish()
+        if lstErrors:
+            errors = '\n'.join(lstErrors)
+            raise SambaException(f"Errors when setting passwords: {errors}")
+
     def edit_user(self, user, params):
         # TO DO: this
         # edit
@@ -805,6 +2306,8 @@ class SshSamba:
         if not members:
             raise ValueError("No valid usernames found.")
 
+        # memberOf has changed
+        self._forget_users(members)
         return self.samba_command(f'group addmembers \"{group}\" "{", ".join(members)}"')
 
     def delete_members_from_group(self, group: str, members: list):
@@ -827,6 +2330,7 @@ class SshSamba:
         if errors:
             raise ValueError(f"Got the following errors from the list of members: {errors}")
 
+        self._forget_users(members)
         self.samba_command(f'group removemembers \"{group}\" "{", ".join(members)}"')
 
     def add_organizational_unit(self, organizational_unit: str, parent_organizational_unit: str = None):
@@ -852,14 +2356,11 @@ class SshSamba:
         Get password policy for the domain
         :return: dictionary of password policy
         """
-        dicPolicy = {}
-        lstPolicy = self.samba_command('domain passwordsettings show')
-
-        # Assumes no unexpected colons...
-        policy_info = [line.split(':') for line in lstPolicy if line != '' and 'Password information for domain' not in line]
-        for line in policy_info:
-            dicPolicy[line[0].rstrip(' ')] = line[1].lstrip(' ')
-
+        dicPolicy = self._samba_json('domain passwordsettings show', '', self.password_policy_options,
+                                     self.password_policy_options)
+        if dicPolicy is None:
+            # The first line is 'Password information for domain ...', which has no colon
+            dicPolicy = _parse_labelled(self.samba_command('domain passwordsettings show'))
         return dicPolicy
 
     def set_password_policy(self, dicPolicy):
@@ -872,21 +2373,10 @@ class SshSamba:
                             but there must not be any extraneous keys.
         :return: Silence = success. Exception will be raised if something went wrong
         """
-        dicSyntax = {
-            'Password complexity': 'complexity',
-            'Store plaintext passwords': 'store-plaintext',
-            'Password history length': 'history-length',
-            'Minimum password length': 'min-pwd-length',
-            'Minimum password age (days)': 'min-pwd-age',
-            'Maximum password age (days)': 'max-pwd-age',
-            'Account lockout duration (mins)': 'account-lockout-duration',
-            'Account lockout threshold (attempts)': 'account-lockout-threshold',
-            'Reset account lockout after (mins)': 'reset-account-lockout',
-        }
         policy_params = ''
         for key, value in dicPolicy.items():
             try:
-                policy_params += f"--{dicSyntax[key]}={value} "
+                policy_params += f"--{self.password_policy_options[key]}={value} "
             except KeyError:
                 raise AlliterationError(f"Please provide proper password policy parameters!\nInvalid parameter: {key}")
 
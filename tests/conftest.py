@@ -0,0 +1,143 @@
+"""
+Everything runs against the fake samba-tool in fake_samba, either as a local subprocess (LocalTransport)
+or over SSH (SshTransport) to a Paramiko server in this process that runs the commands the same way.
+No network, and no Samba, needed.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import paramiko
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from samba_transport import LocalTransport, SshTransport  # noqa: E402
+from ssh_samba import SshSamba  # noqa: E402
+
+DIR_FAKE_SAMBA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_samba')
+FAKE_ENV = {'PATH': DIR_FAKE_SAMBA + os.pathsep + os.environ.get('PATH', ''),
+            'PYTHONPATH': DIR_FAKE_SAMBA}
+
+
+class ShellServer(paramiko.ServerInterface):
+    """Lets anyone in, and runs every command through the shell with the fake samba-tool first on the PATH"""
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OR_UNKNOWN_CHANNEL_TYPE
+
+    def check_channel_exec_request(self, channel, command):
+        # After a moment, so Paramiko has said yes to the command before any output (or the end of it) goes
+        timer = threading.Timer(0.01, run_for_channel, args=(channel, command.decode('utf-8')))
+        timer.daemon = True
+        timer.start()
+        return True
+
+
+def run_for_channel(channel, cmd: str):
+    """What sshd does: the command's stdin, stdout and stderr are the channel's, and it's killed if that closes"""
+    proc = subprocess.Popen(cmd, shell=True, env={**os.environ, **FAKE_ENV},
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump_in():
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                proc.stdin.write(data)
+                proc.stdin.flush()
+        except OSError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def pump_out(fpFrom, send):
+        try:
+            for data in iter(lambda: fpFrom.read1(65536), b''):
+                send(data)
+        except OSError:
+            # The client closed the channel
+            proc.kill()
+
+    threading.Thread(target=pump_in, daemon=True).start()
+    thread_err = threading.Thread(target=pump_out, args=(proc.stderr, channel.sendall_stderr), daemon=True)
+    thread_err.start()
+    pump_out(proc.stdout, channel.sendall)
+    thread_err.join()
+    status = proc.wait()
+    try:
+        # Killed by a signal, eg. because the client went away: the shell's way of saying so
+        channel.send_exit_status(status if status >= 0 else 128 - status)
+        channel.close()
+    except (OSError, EOFError):
+        # Or the whole connection has gone
+        pass
+
+
+@pytest.fixture(scope='session')
+def host_key():
+    return paramiko.RSAKey.generate(2048)
+
+
+@pytest.fixture
+def connect_ssh(host_key):
+    """
+    Connect an SshTransport to a new server in this process.
+    :return: function of SshTransport's compress, returning the connected transport
+    """
+    lstConnections = []
+
+    def connect(compress=False):
+        client_sock, server_sock = socket.socketpair()
+        server = paramiko.Transport(server_sock)
+        server.add_server_key(host_key)
+        server.use_compression(True)  # Willing, if the client asks for it
+        server.start_server(event=threading.Event(), server=ShellServer())  # Without waiting for the client
+        transport = SshTransport('test', 'root', 'password', compress=compress, sock=client_sock)
+        transport.connect()
+        lstConnections.append((transport, server))
+        return transport
+
+    yield connect
+    for transport, server in lstConnections:
+        transport.close()
+        server.close()
+
+
+@pytest.fixture
+def ssh_transport(connect_ssh):
+    return connect_ssh()
+
+
+@pytest.fixture
+def local_transport():
+    transport = LocalTransport(FAKE_ENV)
+    yield transport
+    transport.close()
+
+
+@pytest.fixture(params=['local', 'ssh'])
+def transport(request):
+    """Each test using this runs once with each transport, as they should behave the same"""
+    return request.getfixturevalue(f'{request.param}_transport')
+
+
+@pytest.fixture
+def ad(transport):
+    ad = SshSamba('test', transport=transport)
+    yield ad
+    ad.close()
@@ -0,0 +1,73 @@
+"""
+The few samba-tool commands the tests use, answering the way the real ones do.
+samba_tool is what samba.netcmd.main has on Samba 4.18 onwards, which the dispatcher's worker runs in-process.
+"""
+
+import json
+import os
+import sys
+
+USERS = ('alice', 'bob', 'carol')
+DOMAIN_INFO = {'Forest': 'example.com', 'Domain': 'example.com', 'Netbios domain': 'EXAMPLE',
+               'DC name': 'dc1.example.com', 'DC netbios name': 'DC1', 'Server site': 'Default-First-Site-Name',
+               'Client site': 'Default-First-Site-Name'}
+# Every DC says the same DC holds the FSMO roles
+FSMO_OWNER = 'DC2'
+FSMO_ROLES = ('SchemaMasterRole', 'InfrastructureMasterRole', 'RidAllocationMasterRole', 'PdcEmulationMasterRole',
+              'DomainNamingMasterRole', 'DomainDnsZonesMasterRole', 'ForestDnsZonesMasterRole')
+
+
+def domain_info(dc: str) -> dict:
+    """What domain info says about the DC at address dc: DC1 unless it's called something like dc2"""
+    name = dc.upper() if dc.lower().startswith('dc') else 'DC1'
+    return {**DOMAIN_INFO, 'DC name': f'{name.lower()}.example.com', 'DC netbios name': name}
+
+
+def samba_tool(*args):
+    if args == ('--version',):
+        sys.stdout.write("4.20.1-Debian\n")
+    elif '--help' in args:
+        sys.stdout.write(f"Usage: samba-tool {' '.join(args[:-1])} [options]\n\nOptions:\n  -h, --help\n")
+        if args[:2] == ('domain', 'info'):
+            sys.stdout.write("  --json                Output in JSON format\n")
+    elif args[:2] == ('domain', 'info') and len(args) >= 3:
+        dicInfo = domain_info(args[2])
+        if '--json' in args:
+            sys.stdout.write(json.dumps({label.lower().replace(' ', '_'): value
+                                         for label, value in dicInfo.items()}) + '\n')
+        else:
+            sys.stdout.write(''.join(f"{label:<17}: {value}\n" for label, value in dicInfo.items()))
+    elif args[:2] == ('fsmo', 'show'):
+        sys.stdout.write(''.join(f"{role} owner: CN=NTDS Settings,CN={FSMO_OWNER},CN=Servers,"
+                                 f"CN=Default-First-Site-Name,CN=Sites,CN=Configuration,DC=example,DC=com\n"
+                                 for role in FSMO_ROLES))
+    elif args[:2] == ('user', 'list'):
+        sys.stdout.write(''.join(f'{usr}\n' for usr in USERS))
+    elif args[:2] == ('user', 'show') and len(args) == 3:
+        if args[2] not in USERS:
+            sys.stderr.write(f"ERROR: Unable to find user \"{args[2]}\"\n")
+            return 255
+        sys.stdout.write(f"dn: CN={args[2]},CN=Users,DC=example,DC=com\n"
+                         f"sAMAccountName: {args[2]}\n"
+                         f"givenName: {args[2].title()}\n"
+                         f"userAccountControl: 512\n")
+    elif args[:2] == ('user', 'create') and len(args) >= 3:
+        if args[2] in USERS:
+            sys.stderr.write(f"ERROR(ldb): Failed to add user '{args[2]}':  - LDAP error 68 LDAP_ENTRY_ALREADY_EXISTS"
+                             f" -  <00002071: samldb: Account name (sAMAccountName) '{args[2]}' already in use!> <>\n")
+            return 255
+        sys.stdout.write(f"User '{args[2]}' added successfully\n")
+    elif args[:1] == ('count',) and len(args) == 2:
+        # Lots of output, eg. for streaming
+        sys.stdout.write(''.join(f'{i}\n' for i in range(int(args[1]))))
+    elif args[:1] == ('crash',):
+        raise RuntimeError("boom")
+    elif args[:1] == ('exit',):
+        sys.exit(3)
+    elif args[:1] == ('raw',):
+        # Some of Samba writes straight to the file descriptor
+        sys.stdout.flush()
+        os.write(1, b'straight to fd 1\n')
+    else:
+        sys.stdout.write("Usage: samba-tool <subcommand>\n")
+        return 1
@@ -0,0 +1,94 @@
+"""
+samba_capabilities: reading what the probe found, and matching samba-tool's JSON up with the names from its text.
+"""
+
+from samba_capabilities import JSON_COMMANDS, SambaCapabilities, from_json, probe_command
+from ssh_samba import DEFAULT_SAM_LDB
+
+POLICY_LABELS = ('Password complexity', 'Minimum password length', 'Minimum password age (days)')
+POLICY_OPTIONS = {'Password complexity': 'complexity', 'Minimum password length': 'min-pwd-length',
+                  'Minimum password age (days)': 'min-pwd-age'}
+
+
+def test_probe_command_checks_every_json_command():
+    cmd = probe_command()
+    assert 'samba-tool --version' in cmd
+    for json_command in JSON_COMMANDS:
+        assert f'samba-tool {json_command} --help' in cmd
+
+
+def test_parse_probe_output():
+    capabilities = SambaCapabilities(['version: 4.20.1-Debian', 'ldbsearch: yes',
+                                      'private_dir: /usr/local/samba/private', 'json: domain info'])
+    assert capabilities.probed
+    assert capabilities.version_string == '4.20.1-Debian'
+    assert capabilities.version == (4, 20, 1)
+    assert capabilities.ldbsearch is True
+    assert capabilities.private_dir == '/usr/local/samba/private'
+    assert capabilities.supports_json('domain info')
+    assert not capabilities.supports_json('domain passwordsettings show')
+    capabilities.no_json('domain info')
+    assert not capabilities.supports_json('domain info')
+
+
+def test_parse_probe_output_of_an_old_dc():
+    capabilities = SambaCapabilities(['version: 4.9.5-Debian'])
+    assert capabilities.version == (4, 9, 5)
+    assert capabilities.ldbsearch is False
+    assert capabilities.private_dir is None
+    assert not capabilities.json_commands
+
+
+def test_not_probed():
+    capabilities = SambaCapabilities()
+    assert not capabilities.probed
+    assert capabilities.version is None
+    assert capabilities.ldbsearch is None
+
+
+def test_odd_version():
+    capabilities = SambaCapabilities(['version: something else'])
+    assert capabilities.version_string == 'something else'
+    assert capabilities.version is None
+
+
+def test_from_json_matches_labels_options_and_case():
+    dicJson = {'password_complexity': True, 'minPwdLength': 7, 'Minimum password age': 1, 'unknown': 'x'}
+    assert from_json(dicJson, POLICY_LABELS, POLICY_OPTIONS) == {'Password complexity': 'on',
+                                                                 'Minimum password length': '7',
+                                                                 'Minimum password age (days)': '1'}
+
+
+def test_from_json_gives_up_without_what_is_required():
+    dicJson = {'password_complexity': False, 'min_pwd_length': 7}
+    assert from_json(dicJson, POLICY_LABELS, POLICY_OPTIONS) is None
+    assert from_json(dicJson, POLICY_LABELS, POLICY_OPTIONS, required=('Minimum password length',)) == \
+        {'Password complexity': 'off', 'Minimum password length': '7'}
+
+
+def test_from_json_leaves_out_nested_values():
+    dicJson = {'domain': 'example.com', 'forest': {'name': 'example.com'}}
+    assert from_json(dicJson, ('Domain', 'Forest'), required=('Domain',)) == {'Domain': 'example.com'}
+    assert from_json(dicJson, ('Domain', 'Forest')) is None
+
+
+def test_from_json_isnt_a_dictionary():
+    assert from_json(['example.com'], ('Domain',)) is None
+    assert from_json({'domain': None}, ('Domain',)) == {'Domain': ''}
+
+
+def test_probe_the_fake_samba_tool(ad):
+    capabilities = ad.get_capabilities()
+    assert capabilities.version == (4, 20, 1)
+    assert capabilities.supports_json('domain info')
+    assert not capabilities.supports_json('domain passwordsettings show')
+    assert ad.sam_ldb == DEFAULT_SAM_LDB
+    assert ad.get_capabilities() is capabilities
+
+
+def test_json_and_text_agree(ad):
+    dicDomain = ad.get_domain()
+    assert dicDomain['Domain'] == 'example.com'
+    assert dicDomain['DC netbios name'] == 'DC1'
+    ad.get_capabilities().no_json('domain info')
+    assert ad.get_domain() == dicDomain
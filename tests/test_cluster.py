@@ -0,0 +1,146 @@
+"""
+samba_cluster: reads to the quickest DC, writes to the PDC emulator, and reads following writes for a while.
+The DCs are the fake samba-tool run locally, each made slower or quicker to answer.
+"""
+
+import time
+
+import pytest
+
+import samba_cluster
+from conftest import FAKE_ENV
+from samba_cluster import DomainControllers, connect_all
+from samba_transport import LocalTransport
+from ssh_samba import SambaException, SshSamba
+
+# dc3 is the quickest and dc2 (the PDC emulator, see FSMO_OWNER) the slowest
+DELAYS = {'dc1': 0.05, 'dc2': 0.1, 'dc3': 0.0}
+
+
+class SlowTransport(LocalTransport):
+    """A DC that takes delay seconds longer to answer each command"""
+    def __init__(self, delay: float):
+        super().__init__(FAKE_ENV)
+        self.delay = delay
+
+    def run(self, cmd: str) -> tuple:
+        time.sleep(self.delay)
+        return super().run(cmd)
+
+
+@pytest.fixture
+def dcs():
+    dcs = DomainControllers([SshSamba(host, transport=SlowTransport(delay)) for host, delay in DELAYS.items()],
+                            probe_interval=60)
+    yield dcs
+    dcs.close()
+
+
+def answered_by(dcs: DomainControllers) -> str:
+    """Which DC a read went to"""
+    return dcs.get_domain()['DC netbios name']
+
+
+def test_reads_go_to_the_quickest(dcs):
+    assert answered_by(dcs) == 'DC3'
+    assert [dc['host'] for dc in sorted(dcs.stats(), key=lambda dc: dc['latency'])] == ['dc3', 'dc1', 'dc2']
+
+
+def test_reads_go_elsewhere_if_the_quickest_stops_answering(dcs):
+    dcs.measure()
+    dcs.dcs[2].ad.transport.close()
+    assert answered_by(dcs) == 'DC1'
+    assert not dcs.stats()[2]['healthy']
+
+
+def test_writes_go_to_the_pdc_emulator(dcs):
+    assert dcs.writer.remote_server_ip == 'dc2'
+    assert dcs.samba_command('user create dave') == ["User 'dave' added successfully", '']
+    assert [dc['host'] for dc in dcs.stats() if dc['writer']] == ['dc2']
+
+
+def test_the_writer_given(dcs):
+    dcs = DomainControllers([dc.ad for dc in dcs.dcs], writer=dcs.dcs[0].ad)
+    assert dcs.writer.remote_server_ip == 'dc1'
+
+
+def test_reads_follow_a_write_for_a_while(dcs):
+    dcs.consistency_window = 0.5
+    assert answered_by(dcs) == 'DC3'
+    dcs.samba_command('user create dave')
+    # Not everywhere yet
+    assert answered_by(dcs) == 'DC2'
+    time.sleep(0.5)
+    assert answered_by(dcs) == 'DC3'
+
+
+def test_a_failed_write_still_counts(dcs):
+    with pytest.raises(SambaException):
+        dcs.samba_command('user create alice')
+    assert answered_by(dcs) == 'DC2'
+
+
+def test_iter_reads_are_tried_again_before_their_first_item(dcs, monkeypatch):
+    def gone(*args, **kwargs):
+        raise ConnectionError("Gone")
+        yield
+
+    dcs.measure()
+    monkeypatch.setattr(dcs.dcs[2].ad, 'iter_users', gone)
+    monkeypatch.setattr(dcs.dcs[0].ad, 'iter_users', lambda *args, **kwargs: iter(['from dc1']))
+    assert list(dcs.iter_users()) == ['from dc1']
+    assert not dcs.stats()[2]['healthy']
+
+
+def test_iter_reads_arent_tried_again_after_their_first_item(dcs, monkeypatch):
+    def gone_part_way(*args, **kwargs):
+        yield 'from dc3'
+        raise ConnectionError("Gone")
+
+    dcs.measure()
+    monkeypatch.setattr(dcs.dcs[2].ad, 'iter_users', gone_part_way)
+    monkeypatch.setattr(dcs.dcs[0].ad, 'iter_users', lambda *args, **kwargs: iter(['from dc1']))
+    lstItems = []
+    with pytest.raises(ConnectionError):
+        for item in dcs.iter_users():
+            lstItems.append(item)
+    assert lstItems == ['from dc3']
+    # But the next read goes elsewhere
+    assert not dcs.stats()[2]['healthy']
+    assert list(dcs.iter_users()) == ['from dc1']
+
+
+def test_iter_reads_dont_ask_until_wanted(dcs, monkeypatch):
+    lstAsked = []
+    monkeypatch.setattr(dcs.dcs[2].ad, 'iter_users', lambda *args, **kwargs: lstAsked.append(args) or iter([]))
+    iterator = dcs.iter_users()
+    assert not lstAsked
+    assert list(iterator) == []
+    assert lstAsked == [()]
+
+
+def test_nothing_answering(dcs):
+    for dc in dcs.dcs:
+        dc.ad.transport.close()
+    with pytest.raises(ConnectionError, match='None of the domain controllers'):
+        dcs.get_domain()
+
+
+def test_not_one_of_samba_ssh_methods(dcs):
+    with pytest.raises(AttributeError):
+        dcs.no_such_method()
+
+
+def test_connect_all_leaves_stdout_alone(monkeypatch, capsys):
+    def connect_to_server(ad):
+        print("Connecting to server...")
+        if ad.remote_server_ip == '10.0.0.9':
+            raise ConnectionError("Refused")
+        ad.transport = LocalTransport(FAKE_ENV)
+
+    monkeypatch.setattr(samba_cluster.SshSamba, 'connect_to_server', connect_to_server)
+    with connect_all(['10.0.0.1', '10.0.0.9', '10.0.0.3'], 'root', 'password') as dcs:
+        assert [dc['host'] for dc in dcs.stats()] == ['10.0.0.1', '10.0.0.3']
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert "Couldn't connect to 10.0.0.9: Refused" in err
@@ -0,0 +1,88 @@
+"""
+SshTransport's compression: on, off, or 'auto', which turns it on once big outputs are seen to come in slowly.
+"""
+
+import pytest
+
+import samba_transport
+from samba_transport import AUTO_COMPRESSION_BELOW, AUTO_COMPRESSION_MIN_BYTES, SshTransport
+from ssh_samba import SshSamba
+
+BIG = AUTO_COMPRESSION_MIN_BYTES
+SLOW = AUTO_COMPRESSION_BELOW / 2
+FAST = AUTO_COMPRESSION_BELOW * 2
+
+
+def test_bad_setting():
+    with pytest.raises(ValueError):
+        SshTransport('test', 'root', 'password', compress='sometimes')
+
+
+@pytest.mark.parametrize('compress', [True, False, 'auto'])
+def test_small_outputs_dont_count(compress):
+    transport = SshTransport('test', 'root', 'password', compress=compress)
+    transport._measure(BIG - 1, (BIG - 1) / SLOW)
+    transport._measure(BIG, 0)
+    assert transport.bandwidth is None
+    assert not transport._compress_next
+
+
+def test_auto_turns_on_for_slow_outputs():
+    transport = SshTransport('test', 'root', 'password', compress='auto')
+    transport._measure(BIG, BIG / FAST)
+    assert transport.bandwidth == FAST
+    assert not transport._compress_next
+    # Averaged, so one slow output after a fast one isn't enough
+    transport._measure(BIG, BIG / (FAST / 8))
+    assert transport.bandwidth == pytest.approx(FAST * 9 / 16)
+    assert not transport._compress_next
+    transport._measure(BIG, BIG / (FAST / 8))
+    assert transport._compress_next
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_only_auto_turns_itself_on(compress):
+    transport = SshTransport('test', 'root', 'password', compress=compress)
+    transport._measure(BIG, BIG / (SLOW / 100))
+    assert transport.bandwidth == SLOW / 100
+    assert not transport._compress_next
+
+
+def test_compression_on_from_the_start(connect_ssh):
+    transport = connect_ssh(compress=True)
+    assert transport.compressed
+    assert transport.run('samba-tool user list') == (b'alice\nbob\ncarol\n', b'')
+
+
+def test_off(connect_ssh):
+    transport = connect_ssh(compress=False)
+    transport.run(f'samba-tool count {BIG}')
+    assert not transport.compressed
+
+
+def test_auto_turns_on_before_the_next_command(connect_ssh, monkeypatch):
+    transport = connect_ssh(compress='auto')
+    assert not transport.compressed
+    # However fast this link is, count it as slow
+    monkeypatch.setattr(samba_transport, 'AUTO_COMPRESSION_BELOW', float('inf'))
+    out, _ = transport.run(f'samba-tool count {BIG // 4}')
+    assert len(out) > BIG
+    assert transport._compress_next
+    assert not transport.compressed
+    # The keys are agreed again, with compression, before this one
+    assert transport.run('samba-tool user list') == (b'alice\nbob\ncarol\n', b'')
+    assert transport.compressed
+    assert not transport._compress_next
+
+
+def test_kept_shells_dont_stop_it_turning_on(ssh_transport):
+    ad = SshSamba('test', transport=ssh_transport)
+    lstCmds = ['user list'] * 30
+    list(ad.samba_commands(lstCmds))
+    # The shell samba_commands keeps for next time is open, but idle
+    assert ad.pipelines
+    ssh_transport._compress_next = True
+    assert ad.samba_command('user list') == ['alice', 'bob', 'carol', '']
+    assert ssh_transport.compressed
+    # And samba_commands starts a new shell
+    assert list(ad.samba_commands(lstCmds)) == [['alice', 'bob', 'carol', '']] * len(lstCmds)
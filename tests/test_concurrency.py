@@ -0,0 +1,120 @@
+"""
+samba_concurrency: AIMD on how many commands run at once.
+"""
+
+import threading
+import time
+
+import pytest
+
+from samba_concurrency import AdaptiveConcurrency, run_concurrently
+
+
+def saturate(controller: AdaptiveConcurrency, latency: float, ok: bool = True, rounds: int = 1):
+    """Fill every slot, then let them all finish with latency"""
+    for _ in range(rounds):
+        no_of_slots = controller.limit
+        for _ in range(no_of_slots):
+            controller.acquire()
+        for _ in range(no_of_slots):
+            controller.release(latency, ok)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'initial': 0},
+    {'initial': 9, 'max_limit': 8},
+    {'min_limit': 3, 'initial': 2},
+    {'backoff': 1.0},
+])
+def test_bad_settings(kwargs):
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(**kwargs)
+
+
+def test_grows_while_latency_holds():
+    controller = AdaptiveConcurrency(initial=2, max_limit=6)
+    saturate(controller, 0.1, rounds=20)
+    assert controller.limit == 6
+
+
+def test_doesnt_grow_unless_the_limit_is_reached():
+    controller = AdaptiveConcurrency(initial=2)
+    for _ in range(50):
+        controller.acquire()
+        controller.release(0.1)
+    assert controller.limit == 2
+
+
+def test_backs_off_when_latency_rises():
+    controller = AdaptiveConcurrency(initial=6, max_limit=6, backoff=0.5)
+    saturate(controller, 0.1)
+    controller.acquire()
+    controller.release(1.0)
+    assert controller.limit == 3
+    # Only once per round
+    controller.acquire()
+    controller.release(1.0)
+    assert controller.limit == 3
+
+
+def test_backs_off_on_errors_no_lower_than_min():
+    controller = AdaptiveConcurrency(initial=4, min_limit=2)
+    saturate(controller, 0.1, ok=False, rounds=10)
+    assert controller.limit == 2
+    assert controller.stats()['errors'] > 0
+
+
+def test_default_leaves_room_under_max_sessions():
+    # OpenSSH's MaxSessions is 10, and the GUI's prefetcher (2), the dispatcher (1) and samba_commands' shell (1)
+    # need channels too
+    assert AdaptiveConcurrency().max_limit + 2 + 1 + 1 <= 10
+
+
+def test_acquire_waits_for_a_slot():
+    controller = AdaptiveConcurrency(initial=1, max_limit=1)
+    controller.acquire()
+    thread = threading.Thread(target=controller.acquire, daemon=True)
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+    controller.release(0.1)
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_run_concurrently_keeps_the_order():
+    def work(i):
+        time.sleep(0.01 * (5 - i % 5))
+        if i == 3:
+            raise ValueError(i)
+        return i * 2
+
+    lstResults = list(run_concurrently(work, range(10), AdaptiveConcurrency(initial=4)))
+    assert [result for i, result in enumerate(lstResults) if i != 3] == [i * 2 for i in range(10) if i != 3]
+    assert isinstance(lstResults[3], ValueError)
+
+
+def test_run_concurrently_trouble():
+    controller = AdaptiveConcurrency(initial=2)
+
+    def work(i):
+        raise KeyError(i)
+
+    list(run_concurrently(work, range(4), controller, is_trouble=lambda e: False))
+    assert controller.stats()['errors'] == 0
+    list(run_concurrently(work, range(4), controller))
+    assert controller.stats()['errors'] == 4
+
+
+def test_run_concurrently_cost():
+    controller = AdaptiveConcurrency(initial=1, max_limit=1)
+    list(run_concurrently(lambda lstBatch: time.sleep(0.1), [[1] * 10], controller, cost=len))
+    assert controller.stats()['latency'] < 0.05
+
+
+def test_run_concurrently_stopped_early_gives_back_the_slots():
+    controller = AdaptiveConcurrency(initial=2)
+    results = run_concurrently(lambda i: time.sleep(0.01), range(20), controller)
+    next(results)
+    results.close()
+    assert controller.stats()['in_flight'] == 0
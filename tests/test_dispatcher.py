@@ -0,0 +1,101 @@
+"""
+samba_dispatcher: the commands run in one long-lived worker should answer exactly as samba-tool would.
+"""
+
+import threading
+
+import pytest
+
+from conftest import FAKE_ENV
+from samba_dispatcher import SambaToolDispatcher, command_argv
+from samba_transport import LocalTransport
+from ssh_samba import SambaException, SshSamba
+
+
+@pytest.fixture
+def dispatcher(transport):
+    dispatcher = SambaToolDispatcher(transport)
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.close()
+
+
+@pytest.mark.parametrize('cmd, argv', [
+    ('user list', ['user', 'list']),
+    ('user show "Amy Smith"', ['user', 'show', 'Amy Smith']),
+    ("user create bob 'pa ss' --given-name=Bob", ['user', 'create', 'bob', 'pa ss', '--given-name=Bob']),
+    ('user list | grep a', None),
+    ('user show $USER', None),
+    ('user show "unbalanced', None),
+])
+def test_command_argv(cmd, argv):
+    assert command_argv(cmd) == argv
+
+
+def test_run(dispatcher):
+    assert dispatcher.run(['user', 'list']) == (0, 'alice\nbob\ncarol\n', '')
+    status, stdout, stderr = dispatcher.run(['user', 'show', 'nobody'])
+    assert (status, stdout) == (255, '')
+    assert 'Unable to find user' in stderr
+
+
+def test_exceptions_and_exits_are_replies(dispatcher):
+    status, stdout, stderr = dispatcher.run(['crash'])
+    assert status == 1
+    assert 'RuntimeError: boom' in stderr
+    assert dispatcher.run(['exit'])[0] == 3
+    # Output written straight to the file descriptor is caught too
+    assert dispatcher.run(['raw']) == (0, 'straight to fd 1\n', '')
+    assert dispatcher.is_running()
+
+
+def test_run_many_in_order(dispatcher):
+    lstArgv = [['user', 'show', usr] for usr in ('carol', 'nobody', 'alice')]
+    replies = list(dispatcher.run_many(lstArgv))
+    assert [status for status, _, _ in replies] == [0, 255, 0]
+    assert 'sAMAccountName: carol' in replies[0][1]
+    assert 'sAMAccountName: alice' in replies[2][1]
+
+
+def test_run_many_stopped_early_leaves_the_worker_ready(dispatcher):
+    replies = dispatcher.run_many([['user', 'list']] * 5)
+    next(replies)
+    replies.close()
+    assert dispatcher.run(['user', 'show', 'bob'])[0] == 0
+
+
+def test_run_many_last_reply_doesnt_hold_the_worker(dispatcher):
+    # zip stops asking once the shorter list runs out, leaving run_many waiting at its last reply
+    for _ in zip(['one'], dispatcher.run_many([['user', 'list']])):
+        pass
+    thread = threading.Thread(target=dispatcher.run, args=(['user', 'list'],), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_samba_command_through_the_dispatcher(transport):
+    ad = SshSamba('test', transport=transport)
+    lstBefore = [ad.samba_command(cmd) for cmd in ('user list', 'user show bob')]
+    assert ad.start_dispatcher()
+    try:
+        assert [ad.samba_command(cmd) for cmd in ('user list', 'user show bob')] == lstBefore
+        with pytest.raises(SambaException, match='ENTRY_ALREADY_EXISTS'):
+            ad.samba_command('user create alice')
+        # Needs a real shell, so goes around the dispatcher
+        assert ad.samba_command('user list | grep o') == ['bob', 'carol', '']
+    finally:
+        ad.close()
+
+
+def test_worker_that_cant_load_samba_tool():
+    # The fake samba-tool, without its Samba libraries on the PYTHONPATH
+    transport = LocalTransport({'PATH': FAKE_ENV['PATH']})
+    with pytest.raises(RuntimeError, match='samba'):
+        SambaToolDispatcher(transport).start()
+    with pytest.raises(ConnectionError):
+        SambaToolDispatcher(transport, samba_tool='no-such-samba-tool').start()
+    # SshSamba carries on without it
+    ad = SshSamba('test', transport=transport)
+    assert not ad.start_dispatcher()
+    assert ad.dispatcher is None
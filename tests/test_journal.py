@@ -0,0 +1,76 @@
+"""
+JobJournal: carrying on with an interrupted bulk job, without doing anything twice or taking somebody else's work
+as done.
+"""
+
+import pytest
+
+from ssh_samba import JobJournal, SambaException, User
+
+
+def new_user(username: str) -> User:
+    usr = User()
+    usr.username = username
+    usr.password = 'Passw0rd!'
+    return usr
+
+
+def interrupted(path: str, lstPlanned: list, lstSent: list = (), lstDone: list = ()):
+    """A journal left behind by a run that stopped part way"""
+    with JobJournal(str(path)) as journal:
+        journal.start('add_users', lstPlanned)
+        if lstSent:
+            journal.sent(lstSent)
+        for item in lstDone:
+            journal.done(item)
+
+
+def test_replay(tmp_path):
+    path = tmp_path / 'import.jsonl'
+    interrupted(path, ['alice', 'dave', 'erin'], lstSent=['alice', 'dave'], lstDone=['alice'])
+    journal = JobJournal(str(path))
+    assert journal.resumed
+    assert journal.is_resumable('add_users', ['alice', 'dave', 'erin'])
+    assert not journal.is_resumable('add_users', ['alice', 'dave'])
+    assert journal.remaining() == ['dave', 'erin']
+    assert journal.sent_before('dave')
+    assert not journal.sent_before('alice')
+    assert not journal.sent_before('erin')
+
+
+def test_without_a_plan_starts_afresh(tmp_path):
+    path = tmp_path / 'import.jsonl'
+    path.write_text('{"event": "done", "item": "alice"}\n{"event": "pl')
+    journal = JobJournal(str(path))
+    assert not journal.resumed
+    assert journal.start('add_users', ['alice']) == ['alice']
+
+
+def test_a_different_job(tmp_path):
+    path = tmp_path / 'import.jsonl'
+    interrupted(path, ['dave'])
+    with JobJournal(str(path)) as journal:
+        with pytest.raises(SambaException):
+            journal.start('add_users', ['erin'])
+        with pytest.raises(SambaException):
+            journal.start('delete_users', ['dave'])
+
+
+def test_resume_counts_what_was_sent_as_added(ad, tmp_path):
+    path = tmp_path / 'import.jsonl'
+    # alice was sent, and added, but the run stopped before hearing so
+    interrupted(path, ['alice', 'dave'], lstSent=['alice', 'dave'])
+    with JobJournal(str(path)) as journal:
+        ad.add_users([new_user('alice'), new_user('dave')], journal=journal)
+        assert journal.finished
+
+
+def test_resume_doesnt_take_somebody_elses_user_as_added(ad, tmp_path):
+    path = tmp_path / 'import.jsonl'
+    # carol was never sent: the carol that exists isn't this job's
+    interrupted(path, ['dave', 'carol'], lstSent=['dave'], lstDone=['dave'])
+    with JobJournal(str(path)) as journal:
+        with pytest.raises(SambaException, match='ENTRY_ALREADY_EXISTS'):
+            ad.add_users([new_user('dave'), new_user('carol')], journal=journal)
+        assert journal.remaining() == ['carol']
+        assert not journal.finished
@@ -0,0 +1,84 @@
+"""
+ShellPipeline, and samba_commands, which sends commands back-to-back through it (several shells at once if the
+concurrency controller is on).
+"""
+
+import threading
+
+import pytest
+
+from samba_concurrency import AdaptiveConcurrency
+from samba_transport import ShellPipeline
+from ssh_samba import LANE_BATCH_SIZE, SambaException
+
+
+@pytest.fixture
+def pipeline(transport):
+    pipeline = ShellPipeline(transport)
+    yield pipeline
+    pipeline.close()
+
+
+def test_run_many_in_order(pipeline):
+    replies = list(pipeline.run_many(['echo one', 'echo two >&2; exit 4', 'printf "no newline"', 'true']))
+    assert replies == [(0, 'one\n', ''), (4, '', 'two\n'), (0, 'no newline', ''), (0, '', '')]
+
+
+def test_commands_cant_eat_the_ones_after(pipeline):
+    # Anything reading stdin gets /dev/null rather than the rest of the commands
+    assert list(pipeline.run_many(['cat', 'echo after'])) == [(0, '', ''), (0, 'after\n', '')]
+
+
+def test_stopped_early_starts_a_new_shell(pipeline):
+    replies = pipeline.run_many(['echo one', 'echo two', 'echo three'])
+    assert next(replies) == (0, 'one\n', '')
+    replies.close()
+    assert list(pipeline.run_many(['echo again'])) == [(0, 'again\n', '')]
+
+
+def test_last_reply_doesnt_hold_the_pipeline(pipeline):
+    # zip stops asking once the shorter list runs out, leaving run_many waiting at its last reply
+    for _ in zip(['one'], pipeline.run_many(['echo one'])):
+        pass
+    thread = threading.Thread(target=lambda: list(pipeline.run_many(['echo two'])), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+@pytest.mark.parametrize('concurrency', [None, AdaptiveConcurrency()], ids=['one shell', 'lanes'])
+def test_samba_commands(ad, concurrency):
+    ad.concurrency = concurrency
+    lstCmds = [f'user show {usr}' for usr in ('alice', 'nobody', 'bob', 'carol')] * LANE_BATCH_SIZE
+    lstResults = list(ad.samba_commands(lstCmds))
+    assert len(lstResults) == len(lstCmds)
+    for cmd, result in zip(lstCmds, lstResults):
+        if 'nobody' in cmd:
+            assert isinstance(result, SambaException)
+        else:
+            assert result == ad.samba_command(cmd)
+    # One shell is kept for next time, however many lanes there were: each would hold an SSH session
+    assert len(ad.pipelines) == 1
+
+
+def test_samba_commands_stopped_early_keeps_one_shell(ad):
+    ad.concurrency = AdaptiveConcurrency(initial=4, max_limit=4)
+    results = ad.samba_commands(['user list'] * LANE_BATCH_SIZE * 8)
+    next(results)
+    results.close()
+    assert len(ad.pipelines) <= 1
+    assert ad.concurrency.stats()['in_flight'] == 0
+
+
+def test_samba_commands_usage_is_an_error(ad):
+    lstResults = list(ad.samba_commands(['user list', 'no such command']))
+    assert lstResults[0] == ['alice', 'bob', 'carol', '']
+    assert isinstance(lstResults[1], SambaException)
+
+
+def test_samba_commands_times_the_commands_not_the_batches(ad):
+    ad.concurrency = AdaptiveConcurrency()
+    list(ad.samba_commands(['user list'] * LANE_BATCH_SIZE * 3))
+    dicStats = ad.concurrency.stats()
+    assert dicStats['completed'] == 3
+    assert dicStats['in_flight'] == 0
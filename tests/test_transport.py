@@ -0,0 +1,88 @@
+"""
+LocalTransport and SshTransport should be interchangeable under SshSamba: the same output, the same errors,
+the same streaming.
+"""
+
+import time
+
+import pytest
+
+from ssh_samba import SambaException, SshSamba
+
+
+def test_run_gives_stdout_and_stderr_as_bytes(transport):
+    out, err = transport.run('echo out; echo err >&2')
+    assert out == b'out\n'
+    assert err == b'err\n'
+
+
+def test_samba_command(ad):
+    assert ad.samba_command('user list') == ['alice', 'bob', 'carol', '']
+    assert ad.samba_command('user show bob')[:2] == ['dn: CN=bob,CN=Users,DC=example,DC=com', 'sAMAccountName: bob']
+
+
+def test_samba_command_is_the_same_either_way(local_transport, ssh_transport):
+    local, ssh = SshSamba('test', transport=local_transport), SshSamba('test', transport=ssh_transport)
+    for cmd in ('user list', 'user show alice', 'user create dave'):
+        assert local.samba_command(cmd) == ssh.samba_command(cmd)
+
+
+def test_stderr_raises_samba_exception(ad):
+    with pytest.raises(SambaException, match='ENTRY_ALREADY_EXISTS'):
+        ad.samba_command('user create alice')
+
+
+def test_usage_raises_samba_exception(ad):
+    with pytest.raises(SambaException, match="Didn't understand command"):
+        ad.samba_command('no such command')
+
+
+def test_get_user(ad):
+    usr = ad.get_user('carol')
+    assert (usr.username, usr.given_name) == ('carol', 'Carol')
+
+
+def test_stream(transport):
+    stream = transport.stream('samba-tool count 1000; echo done >&2')
+    lstLines = []
+    try:
+        while True:
+            lstLines.append(next(stream))
+    except StopIteration as e:
+        errors = e.value
+    assert lstLines == [str(i) for i in range(1000)]
+    assert errors == 'done\n'
+
+
+def test_stream_raises_samba_exception_at_the_end(ad):
+    stream = ad._sh_command_stream('samba-tool user list; samba-tool user show nobody')
+    assert [next(stream) for _ in range(3)] == ['alice', 'bob', 'carol']
+    with pytest.raises(SambaException, match='Unable to find user'):
+        next(stream)
+
+
+def test_stopping_a_stream_early_stops_the_command(transport):
+    stream = transport.stream('i=0; while true; do echo $i; i=$((i+1)); done')
+    assert [next(stream) for _ in range(3)] == ['0', '1', '2']
+    start = time.monotonic()
+    stream.close()
+    assert time.monotonic() - start < 5
+    # And the transport carries on as before
+    assert transport.run('echo still here') == (b'still here\n', b'')
+
+
+def test_open_talks_a_line_at_a_time(transport):
+    channel = transport.open('while read line; do echo "got $line"; done')
+    try:
+        for word in ('one', 'two'):
+            channel.write_line(word)
+            assert channel.read_line() == f'got {word}'
+    finally:
+        channel.close()
+
+
+def test_closed_transport(local_transport):
+    local_transport.close()
+    assert not local_transport.is_connected()
+    with pytest.raises(ConnectionError):
+        local_transport.run('true')
@@ -0,0 +1,54 @@
+"""
+read_user_csv: users to add from a CSV or TSV file, read and checked a chunk at a time.
+"""
+
+import io
+
+import pytest
+
+from ssh_samba import read_user_csv
+
+
+def read(text: str, chunk_size: int = 1000) -> tuple:
+    """:return: all the users' (username, given name, surname, password, must change) and all the errors"""
+    lstUsers = []
+    lstErrors = []
+    for lstChunk, lstChunk_errors in read_user_csv(io.StringIO(text, newline=''), chunk_size):
+        lstUsers += [(usr.username, usr.given_name, usr.surname, usr.password, usr.must_change_at_next_login)
+                     for usr in lstChunk]
+        lstErrors += lstChunk_errors
+    return lstUsers, lstErrors
+
+
+def test_without_headings():
+    assert read('jsmith,John,Smith,Passw0rd!,no\namy,Amy,Jones,Passw0rd!\n') == \
+        ([('jsmith', 'John', 'Smith', 'Passw0rd!', False), ('amy', 'Amy', 'Jones', 'Passw0rd!', True)], [])
+
+
+@pytest.mark.parametrize('before', ['', '\n', '\n\n\t\t\n'], ids=['first line', 'after a blank line', 'after more'])
+def test_headings(before):
+    text = before + 'Password\tLogin\tSurname\tFirst name\nPassw0rd!\tjsmith\tSmith\tJohn\n'
+    assert read(text) == ([('jsmith', 'John', 'Smith', 'Passw0rd!', True)], [])
+
+
+def test_headings_without_a_username():
+    with pytest.raises(ValueError):
+        read('given name,surname\nJohn,Smith\n')
+
+
+def test_only_the_first_row_can_be_headings():
+    lstUsers, _ = read('jsmith,John,Smith,Passw0rd!\nusername,surname,given name,password\n')
+    assert [usr[0] for usr in lstUsers] == ['jsmith', 'username']
+
+
+def test_errors_say_which_line():
+    lstUsers, lstErrors = read('jsmith,John,Smith,Passw0rd!,maybe\n\namy,Amy,Jones,Passw0rd!,no,extra\n'
+                               'bob,Bob,Brown,Passw0rd!\nBOB,Bob,Brown,Passw0rd!\n')
+    assert [usr[0] for usr in lstUsers] == ['bob']
+    assert [line_no for line_no, _ in lstErrors] == [1, 3, 5]
+
+
+def test_chunks():
+    text = ''.join(f'user{i},Given,Surname,Passw0rd!\n' for i in range(25))
+    lstChunks = list(read_user_csv(io.StringIO(text, newline=''), chunk_size=10))
+    assert [len(lstChunk) for lstChunk, _ in lstChunks] == [10, 10, 5]